@@ -0,0 +1,114 @@
+import copy
+import json
+
+import redis
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User, PRINCIPAL_KEY, PRINCIPAL_SECONDS, redis_cache
+
+
+def principal_claims(user):
+    """The stable facts about `user` that most requests need, as a json-able dict."""
+    membership = getattr(user, 'membership_plan', None)
+    return {
+        'id': user.id,
+        'username': user.username,
+        'username_slug': user.username_slug,
+        'email': user.email,
+        'is_active': user.is_active,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'is_email_verified': user.is_email_verified,
+        'subscription_badge': membership.subscription_badge if membership is not None else False,
+    }
+
+
+def load_principal(user_id):
+    """Claims of `user_id` from the principal cache, read from the database on a miss."""
+    key = PRINCIPAL_KEY.format(user_id)
+    cached = redis_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    user = User.objects.select_related('membership_plan').filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+    if user is None:
+        return None
+    claims = principal_claims(user)
+    redis_cache.set(key, json.dumps(claims), ex=PRINCIPAL_SECONDS)
+    return claims
+
+
+class Principal(SimpleLazyObject):
+    """
+    `request.user` of a token request. The cached claims answer id / username / badge
+    lookups; any other attribute loads the User row once and is delegated to it, so
+    `Songs(user=request.user)` or `request.user.membership_plan` keep working.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.__dict__['claims'] = claims
+        super().__init__(lambda: User.objects.select_related('profile', 'membership_plan').get(pk=claims['id']))
+
+    def __getattr__(self, name):
+        if name == 'pk':
+            name = 'id'
+        if name in self.claims and self._wrapped is empty:
+            return self.claims[name]
+        return super().__getattr__(name)
+
+    def __bool__(self):
+        return True
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self.claims)
+        return copy.copy(self._wrapped)
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            result = type(self)(copy.deepcopy(self.claims, memo))
+            memo[id(self)] = result
+            return result
+        return copy.deepcopy(self._wrapped, memo)
+
+    def load(self):
+        if self._wrapped is empty:
+            self._setup()
+        return self._wrapped
+
+    def has_perms(self, perm_list, obj=None):
+        # safe methods ask DjangoModelPermissions for no permission at all
+        if not perm_list or (self.is_active and self.is_superuser):
+            return True
+        return self.load().has_perms(perm_list, obj)
+
+    def has_perm(self, perm, obj=None):
+        if self.is_active and self.is_superuser:
+            return True
+        return self.load().has_perm(perm, obj)
+
+
+class PrincipalJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication answering from the principal cache instead of loading the user."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        try:
+            claims = load_principal(user_id)
+        except redis.RedisError:
+            return super().get_user(validated_token)
+
+        if claims is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not claims['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return Principal(claims)
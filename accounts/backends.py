@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class LoginBackend(ModelBackend):
+    """
+    ModelBackend that loads the user together with every row the login payload
+    (GetFullUserSerializer) reads, so a login is one joined query and one password hash.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = UserModel._default_manager.select_related(
+            'profile', 'user_xrp_wallet', 'membership_plan__membership') \
+            .filter(**{UserModel.USERNAME_FIELD: username}).first()
+        if user is None:
+            # hash anyway so a missing account takes as long as a wrong password
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,183 @@
+import json
+import smtplib
+import uuid
+
+import redis
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+from django.utils.dateparse import parse_datetime
+
+from .models import User
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# one bulk mailing run: {'name': ..., 'params': json, 'sent': n, 'failed': n}
+MAILING_RUN_KEY = 'mailing:{}'
+# chunk first id -> chunk last id, fixed when the run is created so checkpoints keep matching
+MAILING_CHUNKS_KEY = 'mailing:{}:chunks'
+# chunk first id -> id of the last recipient handled in that chunk, the resume checkpoint
+MAILING_PROGRESS_KEY = 'mailing:{}:progress'
+# held from the moment a chunk is queued until it is sent, so a resume does not queue it twice
+MAILING_LEASE_KEY = 'mailing:{}:lease:{}'
+# ids of recipients whose message was refused
+MAILING_FAILED_KEY = 'mailing:{}:failed'
+MAILING_SECONDS = 7 * 24 * 60 * 60
+# a chunk whose worker died is queued again by the next resume once its lease runs out
+CHUNK_LEASE_SECONDS = 30 * 60
+# recipients per chunk task, all sent over one SMTP connection
+CHUNK_SIZE = 500
+
+
+def _announcement_recipients(params):
+    return User.objects.all()
+
+
+def _inactive_recipients(params):
+    return User.objects.filter(last_login__lt=parse_datetime(params['cutoff']))
+
+
+# name -> what is sent and to whom; `params` are fixed when the run is created so a
+# resumed run sends the same mail to the same people
+MAILINGS = {
+    'announcement': {
+        'subject': 'Important Announcement',
+        'body': 'Important Announcement',
+        'template': 'users/emails/important_notification.html',
+        'recipients': _announcement_recipients,
+        'context': lambda user, params: {'username': user.username, 'message': params['message']},
+    },
+    'inactive_alert': {
+        'subject': 'Inactive Account Alert',
+        'body': 'please get login soon.',
+        'template': 'users/emails/inactive_alert_email.html',
+        'recipients': _inactive_recipients,
+        'context': lambda user, params: {'username': user.username, 'domain': params['domain']},
+    },
+}
+
+
+def _chunk_bounds(mailing, params):
+    ids = _recipients(mailing, params).order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1]
+        yield batch[0], last_id
+
+
+def create_run(name, params):
+    """Record a run and split its recipients into chunks by id range, once."""
+    run_id = uuid.uuid4().hex
+    key = MAILING_RUN_KEY.format(run_id)
+    chunks_key = MAILING_CHUNKS_KEY.format(run_id)
+    pipe = redis_cache.pipeline()
+    pipe.hset(key, mapping={'name': name, 'params': json.dumps(params), 'sent': 0, 'failed': 0})
+    for first_id, last_id in _chunk_bounds(MAILINGS[name], params):
+        pipe.hset(chunks_key, first_id, last_id)
+    for run_key in (key, chunks_key):
+        pipe.expire(run_key, MAILING_SECONDS)
+    pipe.execute()
+    return run_id
+
+
+def _run(run_id):
+    run = redis_cache.hgetall(MAILING_RUN_KEY.format(run_id))
+    if not run:
+        raise KeyError('unknown or expired mailing run {}'.format(run_id))
+    return MAILINGS[run[b'name'].decode()], json.loads(run[b'params'])
+
+
+def _recipients(mailing, params):
+    return mailing['recipients'](params).exclude(email='').exclude(email__isnull=True)
+
+
+def pending_chunks(run_id):
+    """
+    (first_id, last_id) of every chunk of the run that has not been sent completely and
+    is not queued or being sent right now.
+    """
+    _run(run_id)
+    chunks = sorted((int(first_id), int(last_id))
+                    for first_id, last_id in redis_cache.hgetall(MAILING_CHUNKS_KEY.format(run_id)).items())
+    progress = {int(first_id): int(done_id)
+                for first_id, done_id in redis_cache.hgetall(MAILING_PROGRESS_KEY.format(run_id)).items()}
+    pipe = redis_cache.pipeline(transaction=False)
+    for first_id, _ in chunks:
+        pipe.exists(MAILING_LEASE_KEY.format(run_id, first_id))
+    leased = pipe.execute()
+    return [(first_id, last_id) for (first_id, last_id), in_flight in zip(chunks, leased)
+            if progress.get(first_id, 0) < last_id and not in_flight]
+
+
+def lease_chunk(run_id, first_id):
+    """Claim a chunk before queueing it; False when it is already queued or being sent."""
+    return bool(redis_cache.set(MAILING_LEASE_KEY.format(run_id, first_id), 1, nx=True, ex=CHUNK_LEASE_SECONDS))
+
+
+def _refused(error):
+    """A 5xx reply refuses the recipient for good; a 4xx one (mailbox busy, try later) is worth a retry."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+    else:
+        codes = [error.smtp_code]
+    return all(code >= 500 for code in codes)
+
+
+def send_chunk(run_id, first_id, last_id):
+    """
+    Send the run's mail to the recipients with ids in [first_id, last_id] over a single
+    SMTP connection, checkpointing after every recipient. A recipient refused for good is
+    recorded and skipped; connection errors and temporary (4xx) refusals propagate so the
+    task can retry from the checkpoint. The chunk's lease is held until it is done.
+    """
+    mailing, params = _run(run_id)
+    run_key = MAILING_RUN_KEY.format(run_id)
+    progress_key = MAILING_PROGRESS_KEY.format(run_id)
+    failed_key = MAILING_FAILED_KEY.format(run_id)
+    lease_key = MAILING_LEASE_KEY.format(run_id, first_id)
+    redis_cache.set(lease_key, 1, ex=CHUNK_LEASE_SECONDS)
+    done_id = int(redis_cache.hget(progress_key, first_id) or 0)
+    users = _recipients(mailing, params).filter(id__gte=max(first_id, done_id + 1), id__lte=last_id) \
+        .only('id', 'username', 'email').order_by('id')
+    template = get_template(mailing['template'])
+
+    sent = 0
+    connection = get_connection()
+    try:
+        # opened here, send_messages() would otherwise connect and quit for every message
+        connection.open()
+        for user in users.iterator():
+            message = EmailMultiAlternatives(subject=mailing['subject'], body=mailing['body'],
+                                             from_email=settings.DEFAULT_FROM_EMAIL, to=[user.email],
+                                             connection=connection)
+            message.attach_alternative(template.render(mailing['context'](user, params)), 'text/html')
+            pipe = redis_cache.pipeline()
+            try:
+                connection.send_messages([message])
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                if not _refused(e):
+                    raise
+                pipe.sadd(failed_key, user.id)
+                pipe.hincrby(run_key, 'failed', 1)
+            else:
+                sent += 1
+                pipe.hincrby(run_key, 'sent', 1)
+            pipe.hset(progress_key, first_id, user.id)
+            pipe.expire(lease_key, CHUNK_LEASE_SECONDS)
+            pipe.execute()
+    finally:
+        connection.close()
+
+    pipe = redis_cache.pipeline()
+    pipe.hset(progress_key, first_id, last_id)
+    for key in (progress_key, failed_key):
+        pipe.expire(key, MAILING_SECONDS)
+    pipe.delete(lease_key)
+    pipe.execute()
+    return sent
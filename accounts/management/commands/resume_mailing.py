@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from accounts.mailing import MAILING_RUN_KEY, redis_cache
+from accounts.tasks import dispatch_mailing
+
+
+class Command(BaseCommand):
+    help = "Re-queue the unsent chunks of a bulk mailing run (the run id is returned by the task that started it)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_id')
+
+    def handle(self, *args, **options):
+        queued = dispatch_mailing(options['run_id'])
+        run = redis_cache.hgetall(MAILING_RUN_KEY.format(options['run_id']))
+        self.stdout.write(self.style.SUCCESS(
+            f"{queued} chunks queued, {int(run.get(b'sent', 0))} sent and {int(run.get(b'failed', 0))} refused so far"))
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0028_sendimportantannouncement'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['username'], name='user_username_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    Contact = apps.get_model('accounts', 'Contact')
+    Songs = apps.get_model('beats', 'Songs')
+    sources = {
+        'followers_count': (Contact, 'user_to'),
+        'following_count': (Contact, 'user_from'),
+        'track_count': (Songs, 'user'),
+        'likes_count': (Songs.users_like.through, 'user'),
+    }
+    for counter, (model, field) in sources.items():
+        rows = model.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field) \
+            .annotate(n=Count('id')).values('n')
+        Profile.objects.update(**{counter: Coalesce(Subquery(rows), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0030_profile_renditions'),
+        ('beats', '0020_songs_photo_main_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='track_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
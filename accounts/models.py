@@ -1,23 +1,40 @@
 import random
+
+import redis
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.core.mail import EmailMultiAlternatives
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.template.loader import get_template
 from django.utils import timezone
 
 from djstripe.models import Customer, Subscription
 from easy_thumbnails.fields import ThumbnailerImageField
 from phonenumber_field.modelfields import PhoneNumberField
 
-from beats.utils import get_username_unique_slug
+from accounts.outbox import queue_email
+from beats.compression import watch_image_field
+from common.random_sampler import RandomSampler
+from common.utils import allocate_slug
 from rest_framework.authtoken.models import Token
 
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# claims of an authenticated user (see accounts.authentication), dropped whenever
+# the user, their profile or their membership changes
+PRINCIPAL_KEY = 'auth:principal:{}'
+PRINCIPAL_SECONDS = 5 * 60
+
 
 def generate_user_verification_code():
     n = 6
@@ -71,11 +88,15 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
+    class Meta(AbstractUser.Meta):
+        # fuzzy artist matching in the beats search endpoint
+        indexes = [GinIndex(fields=['username'], name='user_username_trgm', opclasses=['gin_trgm_ops'])]
+
     def save(self, *args, **kwargs):
 
         if not self.username_slug and self.pk:
             slug_str = f'{self.username}'
-            self.username_slug = get_username_unique_slug(self, slug_str, User.objects)
+            self.username_slug = allocate_slug(User.objects, slug_str, field='username_slug')
             # print(self.id)
             # token = Token.objects.create(user_id=self.pk)
             # self.email_verification_token = token.key
@@ -150,13 +171,9 @@ class UserPasswordReset(BaseTimestampModel):
             'reset_code': self.reset_code_str
         }
 
-        html_message = get_template(password_reset_email_template_html)
-        html_content = html_message.render(template_context)
-        email = EmailMultiAlternatives(
-            subject=mail_subject, from_email=sender, to=send_to, headers=headers
-        )
-        email.attach_alternative(html_content, 'text/html')
-        email.send()
+        # delivered by accounts.tasks.deliver_queued_email, the request does not wait on SMTP
+        queue_email(mail_subject, send_to, template=password_reset_email_template_html,
+                    context=template_context, from_email=sender, headers=headers)
 
         self.reset_code_sent_at = timezone.now()
         self.save()
@@ -170,6 +187,9 @@ def send_user_password_reset_email(sender, instance, created, **kwargs):
         instance.send_reset_password_email()
 
 
+DEFAULT_AVATAR = 'avatar.jpg'
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, related_name='profile', on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
@@ -177,9 +197,11 @@ class Profile(models.Model):
     birth_date = models.DateField(null=True, blank=True)
     date_joined = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
-    avatar = ThumbnailerImageField(upload_to='users/%Y/%m/%d/', resize_source=dict(size=(250, 250), sharpen=True),
-                                   default='avatar.jpg')
-    cover_photo = ThumbnailerImageField(upload_to='users/%Y/%m/%d/', resize_source=dict(size=(900, 300), blank=True))
+    avatar = ThumbnailerImageField(upload_to='users/%Y/%m/%d/', default=DEFAULT_AVATAR)
+    cover_photo = ThumbnailerImageField(upload_to='users/%Y/%m/%d/')
+    # resized webp/jpeg copies of avatar and cover_photo, built by beats.tasks.build_image_renditions
+    avatar_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    cover_photo_renditions = models.JSONField(default=dict, blank=True, editable=False)
     blue_tick_verified = models.BooleanField(default=False)
     website_link = models.URLField(null=True, blank=True)
     instagram_link = models.URLField(null=True, blank=True)
@@ -188,6 +210,13 @@ class Profile(models.Model):
     youtube_link = models.URLField(null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True,
                                    db_index=True)
+    # social counters, kept by the Contact/Songs/likes writers and repaired by
+    # accounts.tasks.reconcile_profile_counters
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    track_count = models.PositiveIntegerField(default=0)
+    # songs this user liked
+    likes_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ('-created',)
@@ -200,22 +229,10 @@ class Profile(models.Model):
     def username_slug(self):
         return self.user.username_slug
 
-    @property
-    def followers_count(self):
-        return self.user.followers.count()
-
-    @property
-    def following_count(self):
-        return self.user.following.count()
-
     @property
     def full_name(self):
         return self.user.full_name
 
-    @property
-    def track_count(self):
-        return self.user.beats.count()
-
     @property
     def username(self):
         return self.user.username
@@ -264,6 +281,107 @@ user_model.add_to_class('following',
                                                related_name='followers',
                                                symmetrical=False))
 
+def with_listing_data(users):
+    """Everything ChildFullUserSerializer reads, joined into the page query."""
+    return users.select_related('profile', 'user_xrp_wallet', 'membership_plan')
+
+
+def _profile_counters():
+    # counter -> (model holding the rows, field pointing at the user)
+    songs = apps.get_model('beats', 'Songs')
+    return {
+        'followers_count': (Contact, 'user_to'),
+        'following_count': (Contact, 'user_from'),
+        'track_count': (songs, 'user'),
+        'likes_count': (songs.users_like.through, 'user'),
+    }
+
+
+def _counter_expression(model, field):
+    rows = model.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field) \
+        .annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(rows), 0)
+
+
+def bump_profile_counter(user_id, counter, delta):
+    """`counter = counter + delta` on one profile, never below zero."""
+    profiles = Profile.objects.filter(user_id=user_id)
+    if delta < 0:
+        profiles = profiles.filter(**{counter + '__gte': -delta})
+    profiles.update(**{counter: F(counter) + delta})
+
+
+def recount_profiles(user_ids=None, counters=None, batch_size=5000):
+    """
+    Recompute `counters` (all of them when None) from the source tables for
+    `user_ids` (every profile when None), writing only the rows that drifted.
+    """
+    sources = _profile_counters()
+    counters = counters or list(sources)
+    profiles = Profile.objects.all() if user_ids is None else Profile.objects.filter(user_id__in=user_ids)
+    ids = profiles.order_by('id').values_list('id', flat=True)
+    fixed = 0
+    last_id = 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return fixed
+        last_id = batch[-1]
+        for counter in counters:
+            expression = _counter_expression(*sources[counter])
+            fixed += Profile.objects.filter(id__in=batch).alias(actual=expression) \
+                .exclude(**{counter: F('actual')}).update(**{counter: expression})
+
+
+@receiver(post_save, sender=Contact)
+def contact_created(sender, instance, created, **kwargs):
+    if created:
+        bump_profile_counter(instance.user_to_id, 'followers_count', 1)
+        bump_profile_counter(instance.user_from_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Contact)
+def contact_deleted(sender, instance, **kwargs):
+    bump_profile_counter(instance.user_to_id, 'followers_count', -1)
+    bump_profile_counter(instance.user_from_id, 'following_count', -1)
+
+
+@receiver(post_save, sender='beats.Songs')
+def song_created(sender, instance, created, **kwargs):
+    if created:
+        bump_profile_counter(instance.user_id, 'track_count', 1)
+
+
+@receiver(post_delete, sender='beats.Songs')
+def song_deleted(sender, instance, **kwargs):
+    bump_profile_counter(instance.user_id, 'track_count', -1)
+
+
+def forget_principals(user_ids):
+    keys = [PRINCIPAL_KEY.format(user_id) for user_id in user_ids]
+    if keys:
+        redis_cache.delete(*keys)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_principal_changed(sender, instance, **kwargs):
+    forget_principals([instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender='subscriptions.UserMembership')
+@receiver(post_delete, sender='subscriptions.UserMembership')
+def membership_principal_changed(sender, instance, **kwargs):
+    forget_principals([instance.user_id])
+
+
+# random user ids for follow suggestions, see common.random_sampler
+user_sampler = RandomSampler('users', User.objects.all())
+user_sampler.watch(User)
+watch_image_field(Profile, 'avatar', 'square', skip=(DEFAULT_AVATAR,))
+watch_image_field(Profile, 'cover_photo', 'cover')
+
 class SendImportantAnnouncement(models.Model):
     message  = models.TextField(help_text='Message Should Be Concise.')
     created_at = models.DateTimeField(auto_now_add=True,
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+
+from common.utils import redis_lock
+
+logger = logging.getLogger(__name__)
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# json messages waiting for delivery, appended by queue_email
+OUTBOX_KEY = 'outbox:pending'
+# the batch being delivered; entries are removed as they are handled so a crashed run resumes
+OUTBOX_SENDING_KEY = 'outbox:sending'
+# failed messages scored by the time of their next attempt
+OUTBOX_RETRY_KEY = 'outbox:retry'
+# messages that failed OUTBOX_MAX_ATTEMPTS times, kept for inspection
+OUTBOX_DEAD_KEY = 'outbox:dead'
+OUTBOX_DEDUPE_KEY = 'outbox:dedupe:{}'
+# the same message to the same people is sent once per window
+OUTBOX_DEDUPE_SECONDS = 10 * 60
+# messages per delivery run; with the 5 second schedule this caps delivery at ~20 mails/second
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_SECONDS = 60
+# a delivery run holds the lock while it sends, so an overlapping beat run cannot resend its batch
+OUTBOX_LOCK_SECONDS = 10 * 60
+
+# appends a message, unless ARGV[3] asks for dedupe and the same message was queued within the
+# window; the dedupe key is only set together with the push, so a failed push blocks nothing
+QUEUE_SCRIPT = redis_cache.register_script("""
+local dedupe = ARGV[3] == '1'
+if dedupe and redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+if dedupe then
+    redis.call('SET', KEYS[2], 1, 'EX', tonumber(ARGV[2]))
+end
+return 1
+""")
+
+# moves the next batch to the sending list, or hands back the batch a crashed run left behind
+TAKE_BATCH_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return redis.call('LRANGE', KEYS[2], 0, -1)
+end
+local batch = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #batch > 0 then
+    redis.call('LTRIM', KEYS[1], #batch, -1)
+    redis.call('RPUSH', KEYS[2], unpack(batch))
+end
+return batch
+""")
+
+# puts retries whose time has come back on the pending list
+RELEASE_RETRIES_SCRIPT = redis_cache.register_script("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #due > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    redis.call('RPUSH', KEYS[2], unpack(due))
+end
+return #due
+""")
+
+
+def queue_email(subject, to, body='', template=None, context=None, html=None, from_email=None, headers=None,
+                dedupe=True):
+    """
+    Append a message to the outbox; deliver_queued_email sends it from celery. `template`
+    is rendered with `context` at delivery time, so `context` must be json-able.
+    Returns False when the same message was queued within OUTBOX_DEDUPE_SECONDS; pass
+    `dedupe=False` for mail the user asked for again, e.g. a resent verification link.
+    """
+    message = {'subject': subject, 'to': list(to), 'body': body, 'template': template, 'context': context or {},
+               'html': html, 'from_email': from_email or settings.DEFAULT_FROM_EMAIL, 'headers': headers or {}}
+    digest = hashlib.sha1(json.dumps(message, sort_keys=True).encode()).hexdigest()
+    message['attempts'] = 0
+    return bool(QUEUE_SCRIPT(keys=[OUTBOX_KEY, OUTBOX_DEDUPE_KEY.format(digest)],
+                             args=[json.dumps(message), OUTBOX_DEDUPE_SECONDS, int(dedupe)]))
+
+
+def _build_message(entry, connection, templates):
+    message = EmailMultiAlternatives(subject=entry['subject'], body=entry['body'], from_email=entry['from_email'],
+                                     to=entry['to'], headers=entry['headers'], connection=connection)
+    html = entry['html']
+    if entry['template']:
+        if entry['template'] not in templates:
+            templates[entry['template']] = get_template(entry['template'])
+        html = templates[entry['template']].render(entry['context'])
+    if html:
+        message.attach_alternative(html, 'text/html')
+    return message
+
+
+def _retry_later(entry, pipe):
+    entry['attempts'] += 1
+    if entry['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+        logger.error('giving up on email %r to %s', entry['subject'], entry['to'])
+        pipe.rpush(OUTBOX_DEAD_KEY, json.dumps(entry))
+        return
+    # 1, 2, 4, 8 minutes
+    due = time.time() + OUTBOX_RETRY_SECONDS * 2 ** (entry['attempts'] - 1)
+    pipe.zadd(OUTBOX_RETRY_KEY, {json.dumps(entry): due})
+
+
+def deliver_queued_email():
+    """
+    Send up to OUTBOX_BATCH_SIZE queued messages over one SMTP connection. A failed
+    message is retried later with backoff instead of holding up the rest of the batch.
+    Returns the number of messages sent (0 when another run is still delivering).
+    """
+    with redis_lock('outbox', OUTBOX_LOCK_SECONDS) as locked:
+        if not locked:
+            return 0
+        return _deliver_batch()
+
+
+def _deliver_batch():
+    RELEASE_RETRIES_SCRIPT(keys=[OUTBOX_RETRY_KEY, OUTBOX_KEY], args=[time.time()])
+    batch = TAKE_BATCH_SCRIPT(keys=[OUTBOX_KEY, OUTBOX_SENDING_KEY], args=[OUTBOX_BATCH_SIZE])
+    if not batch:
+        return 0
+
+    sent = 0
+    templates = {}
+    connection = get_connection()
+    opened = False
+    try:
+        for raw in batch:
+            entry = json.loads(raw)
+            pipe = redis_cache.pipeline()
+            try:
+                if not opened:
+                    # kept open for the whole batch, send_messages() would otherwise reconnect per message
+                    connection.open()
+                    opened = True
+                connection.send_messages([_build_message(entry, connection, templates)])
+                sent += 1
+            except Exception:
+                logger.exception('email %r to %s failed', entry['subject'], entry['to'])
+                _retry_later(entry, pipe)
+                connection.close()
+                opened = False
+            # by value: the entry is gone from the batch whatever position it had
+            pipe.lrem(OUTBOX_SENDING_KEY, 1, raw)
+            pipe.execute()
+    finally:
+        connection.close()
+    return sent
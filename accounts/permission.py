@@ -13,7 +13,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # Write permissions are only allowed to the owner of the subscriber.
-        return obj.user == request.user
+        return obj.user_id == request.user.id
 
 
 class MyUserPermission(permissions.BasePermission):
@@ -16,27 +16,39 @@ from .models import User, Profile
 from beats.validators import (
     FileExtensionValidator
 )
-from beats.utils import get_username_unique_slug
+from beats.serializers import RenditionImageField, RenditionSrcsetField
 
 
 class ProfileSerializer(serializers.ModelSerializer):
+    avatar = RenditionImageField()
+    avatar_srcset = RenditionSrcsetField(source='avatar')
+    cover_photo = RenditionImageField(kind='cover')
+    cover_photo_srcset = RenditionSrcsetField(kind='cover', source='cover_photo')
+
     class Meta:
         model = Profile
-        fields = ['id', 'username', 'username_slug', 'full_name', 'avatar', 'cover_photo', 'bio', 'location',
+        fields = ['id', 'username', 'username_slug', 'full_name', 'avatar', 'avatar_srcset', 'cover_photo',
+                  'cover_photo_srcset', 'bio', 'location',
                   'birth_date', 'blue_tick_verified', 'website_link', 'instagram_link', 'facebook_link',
                   'twitter_link', 'youtube_link', 'followers_count', 'following_count',
-                  'track_count', 'get_subscription_badge']
+                  'track_count', 'likes_count', 'get_subscription_badge']
+        read_only_fields = ['followers_count', 'following_count', 'track_count', 'likes_count']
 
 
 class ChildProfileSerializer(serializers.ModelSerializer):
+    avatar = RenditionImageField()
+
     class Meta:
         model = Profile
 
         fields = ['id', 'username', 'username_slug', 'avatar', 'blue_tick_verified', 'followers_count',
                   'following_count', 'track_count', 'get_subscription_badge']
+        read_only_fields = ['followers_count', 'following_count', 'track_count']
 
 
 class SecondChildProfileSerializer(serializers.ModelSerializer):
+    avatar = RenditionImageField()
+
     class Meta:
         model = Profile
         fields = ['id', 'username', 'username_slug', 'avatar', 'get_subscription_badge']
@@ -64,16 +76,17 @@ class GetFullUserSerializer(serializers.ModelSerializer):
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def get_user_data(self, user):
-        serializer = GetFullUserSerializer(user)
+        serializer = GetFullUserSerializer(user, context=self.context)
         return serializer.data
 
     def validate(self, attrs):
+        # authenticate() goes through accounts.backends.LoginBackend, so self.user already
+        # carries the profile, membership and wallet rows the payload needs
         data = super().validate(attrs)
 
-        # Add custom data to the response
-        user = self.user
-
-        data['user'] = self.get_user_data(user)
+        # Add custom data to the response, built once for the login views to reuse
+        if self.user.is_email_verified:
+            data['user'] = self.get_user_data(self.user)
 
         return data
 
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, unicode_literals
 
+import smtplib
 from datetime import timedelta
 
 import redis
@@ -11,7 +12,8 @@ from django.shortcuts import get_object_or_404
 from django.template.loader import get_template, render_to_string
 from django.utils import timezone
 
-from accounts.models import User, Contact, SendImportantAnnouncement
+from accounts import mailing, outbox
+from accounts.models import User, Contact, SendImportantAnnouncement, recount_profiles
 from invitation.models import InviteUser
 
 app = Celery('marketplace', broker='redis://localhost:6379/0')
@@ -22,6 +24,18 @@ redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
                                 db=settings.REDIS_DB)
 
 
+# sends the mail queued with accounts.outbox.queue_email, scheduled in CELERY_BEAT_SCHEDULE
+@shared_task
+def deliver_queued_email():
+    return outbox.deliver_queued_email()
+
+
+# repairs Profile follower/following/track/like counters, scheduled in CELERY_BEAT_SCHEDULE
+@shared_task
+def reconcile_profile_counters():
+    return recount_profiles()
+
+
 # send welcome email
 
 @shared_task
@@ -150,26 +164,11 @@ def send_email_verification_token(data):
 
 @shared_task
 def send_custom_message_to_users():
-    users = User.objects.all()
-
     # Fetch the custom message from the database
     custom_message = SendImportantAnnouncement.objects.first()
-
-    for user in users:
-        if user.email and custom_message:
-
-            context = {
-                'username': user.username,
-                'message': custom_message.message,
-            }
-
-            subject = 'Important Announcement'
-            template = 'users/emails/important_notification.html'
-            email_content = render_to_string(template, context)
-
-            from_email = settings.DEFAULT_FROM_EMAIL
-            recipient_list = [user.email]
-            send_mail(subject, 'Important Announcement', from_email, recipient_list, html_message=email_content)
+    if not custom_message:
+        return None
+    return start_mailing('announcement', {'message': custom_message.message})
 
 
 # this task is used to make all user follow the admin
@@ -190,28 +189,31 @@ def follow_admin():
 def send_inactive_users_alert():
     two_weeks_ago = timezone.now() - timedelta(weeks=2)
     current_site = get_current_site(None)  # Get the current site
+    return start_mailing('inactive_alert', {'cutoff': two_weeks_ago.isoformat(), 'domain': current_site.domain})
 
-    inactive_users = User.objects.filter(last_login__lt=two_weeks_ago)
-    print(inactive_users)
 
-    for user in inactive_users:
-        if user.email:  # Ensure user has an email address
-            subject = 'Inactive Account Alert'
-            template = 'users/emails/inactive_alert_email.html'
+# bulk mailing, see accounts.mailing
+def start_mailing(name, params):
+    run_id = mailing.create_run(name, params)
+    dispatch_mailing(run_id)
+    return run_id
+
+
+@shared_task
+def dispatch_mailing(run_id):
+    """Queue every chunk of the run that is not sent or in flight; calling it again resumes the run."""
+    queued = 0
+    for first_id, last_id in mailing.pending_chunks(run_id):
+        if mailing.lease_chunk(run_id, first_id):
+            send_mailing_chunk.delay(run_id, first_id, last_id)
+            queued += 1
+    return queued
 
-            # Create a context dictionary to pass variables to the template
-            context = {
-                'username': user.username,
-                'domain': current_site.domain,
-            }
 
-            # Render the email content using the template and context
-            email_content = render_to_string(template, context)
-            from_email = settings.DEFAULT_FROM_EMAIL
-            recipient_list = [user.email]
+@shared_task(autoretry_for=(smtplib.SMTPException, OSError), retry_backoff=True, max_retries=5)
+def send_mailing_chunk(run_id, first_id, last_id):
+    return mailing.send_chunk(run_id, first_id, last_id)
 
-            # Send the email
-            send_mail(subject, 'please get login soon.', from_email, recipient_list, html_message=email_content)
 
 @shared_task
 def send_inactive_user_alert_demo():
@@ -1,3 +1,97 @@
+import json
+import smtplib
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from common.utils import redis_lock
+
+from . import mailing, outbox
+from .models import User
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        keys = [outbox.OUTBOX_KEY, outbox.OUTBOX_SENDING_KEY, outbox.OUTBOX_RETRY_KEY, outbox.OUTBOX_DEAD_KEY]
+        keys += outbox.redis_cache.keys(outbox.OUTBOX_DEDUPE_KEY.format('*'))
+        outbox.redis_cache.delete(*keys)
+        self.connection = mock.MagicMock()
+        patcher = mock.patch.object(outbox, 'get_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_same_message_is_queued_once_unless_dedupe_is_off(self):
+        self.assertTrue(outbox.queue_email('Hi', ['a@example.com'], body='hello'))
+        self.assertFalse(outbox.queue_email('Hi', ['a@example.com'], body='hello'))
+        self.assertTrue(outbox.queue_email('Hi', ['a@example.com'], body='hello', dedupe=False))
+        self.assertEqual(outbox.redis_cache.llen(outbox.OUTBOX_KEY), 2)
+
+    def test_overlapping_run_does_not_resend_the_batch(self):
+        outbox.queue_email('Hi', ['a@example.com'], body='hello')
+        with redis_lock('outbox', 60):
+            self.assertEqual(outbox.deliver_queued_email(), 0)
+        self.connection.send_messages.assert_not_called()
+        self.assertEqual(outbox.deliver_queued_email(), 1)
+        self.assertEqual(outbox.deliver_queued_email(), 0)
+        self.assertEqual(self.connection.send_messages.call_count, 1)
+
+    def test_failed_message_is_scheduled_for_retry(self):
+        outbox.queue_email('First', ['a@example.com'], body='hello')
+        outbox.queue_email('Second', ['b@example.com'], body='hello')
+        self.connection.send_messages.side_effect = [OSError('connection reset'), 1]
+        self.assertEqual(outbox.deliver_queued_email(), 1)
+        self.assertEqual(outbox.redis_cache.llen(outbox.OUTBOX_SENDING_KEY), 0)
+        retry, = outbox.redis_cache.zrange(outbox.OUTBOX_RETRY_KEY, 0, -1)
+        self.assertEqual(json.loads(retry)['subject'], 'First')
+        self.assertEqual(json.loads(retry)['attempts'], 1)
+
+    def test_batch_left_by_a_crashed_run_is_resumed(self):
+        outbox.queue_email('Hi', ['a@example.com'], body='hello')
+        outbox.TAKE_BATCH_SCRIPT(keys=[outbox.OUTBOX_KEY, outbox.OUTBOX_SENDING_KEY], args=[10])
+        self.assertEqual(outbox.deliver_queued_email(), 1)
+        self.assertEqual(outbox.redis_cache.llen(outbox.OUTBOX_SENDING_KEY), 0)
+
+
+class MailingRunTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(email='user{}@example.com'.format(n), username='user{}'.format(n),
+                                               password='secret') for n in range(5)]
+        patcher = mock.patch.object(mailing, 'CHUNK_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = mock.MagicMock()
+        patcher = mock.patch.object(mailing, 'get_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.run_id = mailing.create_run('announcement', {'message': 'hello'})
+        self.chunks = mailing.pending_chunks(self.run_id)
+
+    def test_checkpoints_survive_changes_to_the_recipients(self):
+        first_id, last_id = self.chunks[0]
+        mailing.send_chunk(self.run_id, first_id, last_id)
+        # the first recipient of the second chunk leaves, which would shift recomputed chunks
+        User.objects.filter(id=self.chunks[1][0]).delete()
+        self.assertEqual(mailing.pending_chunks(self.run_id), self.chunks[1:])
+
+    def test_chunks_in_flight_are_not_queued_again(self):
+        first_id, _ = self.chunks[0]
+        self.assertTrue(mailing.lease_chunk(self.run_id, first_id))
+        self.assertFalse(mailing.lease_chunk(self.run_id, first_id))
+        self.assertEqual(mailing.pending_chunks(self.run_id), self.chunks[1:])
+
+    def test_temporary_refusal_is_retried_from_the_checkpoint(self):
+        first_id, last_id = self.chunks[0]
+        self.connection.send_messages.side_effect = [1, smtplib.SMTPDataError(451, b'try again later')]
+        with self.assertRaises(smtplib.SMTPDataError):
+            mailing.send_chunk(self.run_id, first_id, last_id)
+        progress = mailing.redis_cache.hget(mailing.MAILING_PROGRESS_KEY.format(self.run_id), first_id)
+        self.assertEqual(int(progress), first_id)
+        self.assertFalse(mailing.redis_cache.exists(mailing.MAILING_FAILED_KEY.format(self.run_id)))
+
+    def test_permanent_refusal_is_recorded_and_skipped(self):
+        first_id, last_id = self.chunks[0]
+        self.connection.send_messages.side_effect = [smtplib.SMTPDataError(550, b'no such user'), 1]
+        self.assertEqual(mailing.send_chunk(self.run_id, first_id, last_id), 1)
+        self.assertEqual(mailing.redis_cache.smembers(mailing.MAILING_FAILED_KEY.format(self.run_id)),
+                         {str(first_id).encode()})
+        self.assertEqual(mailing.pending_chunks(self.run_id), self.chunks[1:])
@@ -14,6 +14,7 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
@@ -23,13 +24,10 @@ from .serializers import (GetFullUserSerializer, UpdateProfileSerializer, UserSe
                           EmailVerificationSerializer, ResetPasswordRequestSerializer, ResetPasswordSerializer,
                           Important_Notification, CustomTokenObtainPairSerializer)
 from accounts.tasks import send_email_verification_token
+from redeemCoins import ledger
+from redeemCoins.models import CoinTransaction
 from .utils import Util
 
-# connect to redis
-redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
-                                port=settings.REDIS_PORT,
-                                db=settings.REDIS_DB)
-
 
 class CurrentUserApiView(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -137,55 +135,48 @@ class LoginView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
     def post(self, request, *args, **kwargs):
+        # validate once: the password is hashed a single time and the serializer hands
+        # back the authenticated user, so nothing is fetched or checked again here
+        serializer = self.get_serializer(data=request.data)
         try:
-            response = super().post(request, *args, **kwargs)
+            serializer.is_valid(raise_exception=True)
         except AuthenticationFailed as e:
             # Handle the authentication failed exception
             error_message = 'Invalid email or password.'
             return self.custom_error_response(error_message)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
 
-        return self.process_response(response)
-
-    def process_response(self, response):
-        res = response.data
+        user = serializer.user
+        if not user.is_email_verified:
+            self.send_verification_email(user)
+            error_message = 'Please verify your email address. we sent you email verification on your email account.'
+            return self.custom_error_response(error_message)
 
-        if response.status_code == 200 and 'access' in res:
-            email = self.request.data.get('email')
-            user = User.objects.filter(email=email).first()
+        return self.process_response(user, serializer.validated_data)
 
-            if user:
-                if not user.is_email_verified:
-                    error_message = 'Please verify your email address. we sent you email verification on your email account.'
-                    token = Token.objects.get(user_id=user.id)
-                    request = HttpRequest()
-
-                    # Get the current site
-                    current_site = get_current_site(request)
+    def process_response(self, user, res):
+        return Response(res)
 
-                    # Get the protocol used in the request (HTTP or HTTPS)
-                    protocol = 'https' if request.is_secure() else 'http'
+    def send_verification_email(self, user):
+        token = Token.objects.get(user_id=user.id)
+        request = HttpRequest()
 
-                    # Generate the absolute URL with the correct protocol
-                    absolute_url = f'{protocol}://{current_site.domain}/email-verify/{token}'
+        # Get the current site
+        current_site = get_current_site(request)
 
-                    email_body = 'Hey,' + user.username + ' use the link below to verify your email \n' \
-                                 + absolute_url
-                    data = {'email_body': email_body, 'to_email': user.email, 'username': user.username,
-                            'email_subject': 'Verify your email'}
+        # Get the protocol used in the request (HTTP or HTTPS)
+        protocol = 'https' if request.is_secure() else 'http'
 
-                    send_email_verification_token.delay(data)
-                    return self.custom_error_response(error_message)
-                elif not user.check_password(self.request.data.get('password')):
-                    error_message = 'Invalid email or password.'
-                    return self.custom_error_response(error_message)
+        # Generate the absolute URL with the correct protocol
+        absolute_url = f'{protocol}://{current_site.domain}/email-verify/{token}'
 
-                serializer = GetFullUserSerializer(user,  context={'request': self.request})
-                res['user'] = serializer.data
-            else:
-                error_message = 'Invalid email or password.'
-                return self.custom_error_response(error_message)
+        email_body = 'Hey,' + user.username + ' use the link below to verify your email \n' \
+                     + absolute_url
+        data = {'email_body': email_body, 'to_email': user.email, 'username': user.username,
+                'email_subject': 'Verify your email'}
 
-        return Response(res)
+        send_email_verification_token.delay(data)
 
     def custom_error_response(self, error_message):
         return Response({
@@ -195,93 +186,33 @@ class LoginView(TokenObtainPairView):
         }, status=status.HTTP_200_OK)
 
 
+class AlternativeLoginView(LoginView):
 
-class AlternativeLoginView(TokenObtainPairView):
-    serializer_class = CustomTokenObtainPairSerializer
-
-    def post(self, request, *args, **kwargs):
-        try:
-            response = super().post(request, *args, **kwargs)
-        except AuthenticationFailed as e:
-            # Handle the authentication failed exception
-            error_message = 'Invalid email or password.'
-            return self.custom_error_response(error_message)
-
-        return self.process_response(response)
-
-    def process_response(self, response):
-        res = response.data
+    def process_response(self, user, res):
         current_coins = 0
+        try:
+            current_coins = ledger.balance(user.id)
+        except redis.ConnectionError:
+            pass
 
-        if response.status_code == 200 and 'access' in res:
-            email = self.request.data.get('email')
-            try:
-                user = User.objects.get(email=email)
-                try:
-                    current_coins = redis_cache.hget('users:{}:coins'.format(user.id), user.id)
-                except redis.ConnectionError:
-                    pass
-                if not user.is_email_verified:
-                    error_message = 'Please verify your email address. we sent you email verification on your email account.'
-                    token = Token.objects.get(user_id=user.id)
-                    request = HttpRequest()
-
-                    # Get the current site
-                    current_site = get_current_site(request)
-
-                    # Get the protocol used in the request (HTTP or HTTPS)
-                    protocol = 'https' if request.is_secure() else 'http'
-
-                    # Generate the absolute URL with the correct protocol
-                    absolute_url = f'{protocol}://{current_site.domain}/email-verify/{token}'
-
-                    email_body = 'Hey,' + user.username + ' use the link below to verify your email \n' \
-                                 + absolute_url
-                    data = {'email_body': email_body, 'to_email': user.email, 'username': user.username,
-                            'email_subject': 'Verify your email'}
-
-                    send_email_verification_token.delay(data)
-                    return self.custom_error_response(error_message)
-                elif not user.check_password(self.request.data.get('password')):
-                    error_message = 'Invalid email or password.'
-                    return self.custom_error_response(error_message)
-
-                serializer = GetFullUserSerializer(user, context={'request': self.request})
-                user_data = serializer.data
-
-                if current_coins:
-                    user_data['coins'] = int(current_coins)
-                else:
-                    user_data['coins'] = 0
-
-                result_data = {
-
-                    'access': res.get('access'),
-                    'refresh': res.get('refresh'),
-                    'user': user_data,  # User-specific information from the serializer
-                    # Include other fields from res as needed
-                }
-
-                return Response({
-                    'status': True,
-                    'message': 'Successful login.',
-                    'result': result_data
-                }, status=status.HTTP_200_OK)
-
-
-            except User.DoesNotExist:
-                error_message = 'Invalid email or password.'
-                return self.custom_error_response(error_message)
+        user_data = res['user']
+        user_data['coins'] = current_coins
 
+        result_data = {
 
+            'access': res.get('access'),
+            'refresh': res.get('refresh'),
+            'user': user_data,  # User-specific information from the serializer
+            # Include other fields from res as needed
+        }
 
-    def custom_error_response(self, error_message):
         return Response({
-            'status': False,
-            'message': error_message,
-            'result': {}
+            'status': True,
+            'message': 'Successful login.',
+            'result': result_data
         }, status=status.HTTP_200_OK)
 
+
 class VerifyEmail(views.APIView):
     serializer_class = EmailVerificationSerializer
     permission_classes = (permissions.AllowAny,)
@@ -423,8 +354,7 @@ class CounterCoinsApiView(views.APIView):
     @swagger_auto_schema(auto_schema=None)
     def post(self, request, *args, **kwargs):
         user_detail = get_object_or_404(self.queryset, id=request.user.id)
-        redis_cache.hincrby('users:{}:coins'.format(user_detail.id), user_detail.id, 5)
-        current_coins = redis_cache.hget('users:{}:coins'.format(user_detail.id), user_detail.id)
+        current_coins = ledger.credit(user_detail.id, 5, CoinTransaction.Reason.REWARD)
         resp_obj = dict(
             status=True,
             total_coins=current_coins,
@@ -440,7 +370,7 @@ class GetUserCoinsApiView(views.APIView):
     @swagger_auto_schema(auto_schema=None)
     def get(self, request, *args, **kwargs):
         user_detail = get_object_or_404(self.queryset, id=request.user.id)
-        coins = redis_cache.hget('users:{}:coins'.format(user_detail.id), user_detail.id)
+        coins = ledger.balance(user_detail.id)
         resp_obj = dict(
             status=True,
             coins=coins
@@ -2,6 +2,7 @@ from django.db import models
 
 # Create your models here.
 from common.digitvl_timestamp import BaseTimestampModel
+from common.random_sampler import RandomSampler
 
 
 class Advertisement(BaseTimestampModel):
@@ -17,3 +18,7 @@ class Advertisement(BaseTimestampModel):
     class Meta:
         verbose_name_plural = 'Advertisements'
 
+
+# random advertisement ids, see common.random_sampler
+advertisement_sampler = RandomSampler('advertisements', Advertisement.objects.all())
+advertisement_sampler.watch(Advertisement)
@@ -7,8 +7,10 @@ from rest_framework.decorators import permission_classes
 from rest_framework.generics import ListAPIView, get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
-from advertisement.models import Advertisement
+from advertisement.models import Advertisement, advertisement_sampler
 from advertisement.serializers import AdvertisementSerializer
+from redeemCoins import ledger
+from redeemCoins.models import CoinTransaction
 from rest_framework import permissions, status, views
 
 # connect to redis
@@ -19,10 +21,12 @@ redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
 
 @permission_classes([AllowAny])
 class GetAdvertisementApiView(ListAPIView):
-    queryset = Advertisement.objects.all().order_by('?')[:1]
     serializer_class = AdvertisementSerializer
     schema = None
 
+    def get_queryset(self):
+        return Advertisement.objects.filter(id__in=advertisement_sampler.sample(1))
+
 
 class GiveRewardOnAdvertisement(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -34,8 +38,7 @@ class GiveRewardOnAdvertisement(views.APIView):
             poster_object = get_object_or_404(self.queryset, id=poster_id)
 
             total_views = redis_cache.incr(f'poster:{poster_object.id}:views')
-            redis_cache.hincrby('users:{}:coins'.format(request.user.id), request.user.id, 1)
-            current_coins = redis_cache.hget('users:{}:coins'.format(request.user.id), request.user.id)
+            current_coins = ledger.credit(request.user.id, 1, CoinTransaction.Reason.AD_REWARD)
             return views.Response({'status': True, "message": "you get a reward of 1 Digitvl Coin",
                                    "total_views": total_views, 'current_coins': current_coins}, status=status.HTTP_200_OK)
 
@@ -1,30 +1,144 @@
+import os
 from io import BytesIO
 
-from PIL import Image
-from django.core.files import File
-
-
-def compress(image):
-    im = Image.open(image)
-    # create a BytesIO object
-    im_io = BytesIO()
-    # save image to BytesIO object
-    new_image = im.resize((250, 250))
-    d = new_image.convert('RGB')
-    d.save(im_io, 'JPEG', quality=95, optimize=True)
-    # create a django-friendly Files object
-    new_image = File(im_io, name=image.name)
-    return new_image
-
-
-def compress_cover(image):
-    im = Image.open(image)
-    # create a BytesIO object
-    im_io = BytesIO()
-    # save image to BytesIO object
-    new_image = im.resize((900, 300))
-    d = new_image.convert('RGB')
-    d.save(im_io, 'JPEG', quality=90, optimize=True)
-    # create a django-friendly Files object
-    new_image = File(im_io, name=image.name)
-    return new_image
\ No newline at end of file
+from PIL import Image, ImageOps
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save
+
+# rendition sets: list of (width, height) boxes, the image is cropped to fill each box
+RENDITION_SIZES = {
+    'square': [(96, 96), (250, 250), (500, 500)],
+    'cover': [(450, 150), (900, 300), (1800, 600)],
+}
+# what a plain `photo_main` / `avatar` / `cover_photo` url points to, the size the old
+# synchronous resize produced
+DEFAULT_RENDITION = {'square': 250, 'cover': 900}
+DEFAULT_FORMAT = 'jpeg'
+# format -> (extension, save options); jpeg stays for clients without webp support
+RENDITION_FORMATS = {
+    'webp': ('webp', dict(quality=80, method=4)),
+    'jpeg': ('jpg', dict(quality=85, optimize=True, progressive=True)),
+}
+# EXIF tag holding the rotation/mirroring the camera recorded
+EXIF_ORIENTATION = 0x0112
+# avif needs the pillow-avif plugin; use it when the installed Pillow can write it
+if 'AVIF' in Image.SAVE:
+    RENDITION_FORMATS['avif'] = ('avif', dict(quality=60))
+
+
+def _downscale(im, size):
+    """
+    Crop-resize to `size`, shrinking cheaply first: draft() lets the JPEG decoder skip
+    DCT detail it would throw away, reduce() bins by an integer factor, and only the
+    last step uses a full Lanczos resample.
+    """
+    width, height = size
+    # draft() sees the stored pixels, which orientations 5-8 turn sideways
+    box_width, box_height = (height, width) if im.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8) else size
+    scale = max(box_width / im.width, box_height / im.height)
+    im.draft('RGB', (int(im.width * scale) or 1, int(im.height * scale) or 1))
+    # the factor is taken on the upright image, or a rotated photo is over-reduced and fit() scales it back up
+    im = ImageOps.exif_transpose(im).convert('RGB')
+    factor = int(min(im.width / width, im.height / height))
+    if factor >= 2:
+        im = im.reduce(factor)
+    return ImageOps.fit(im, size, method=Image.LANCZOS)
+
+
+def rendition_name(source_name, size, extension):
+    root, _ = os.path.splitext(source_name)
+    return '{}.{}x{}.{}'.format(root, size[0], size[1], extension)
+
+
+def build_renditions(field_file, kind):
+    """
+    Write every size/format of `kind` next to the original and return the map stored in
+    the model's `*_renditions` field: {'source': name, format: {width: name}}.
+    """
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        data = source.read()
+    renditions = {'source': field_file.name}
+    for size in RENDITION_SIZES[kind]:
+        im = _downscale(Image.open(BytesIO(data)), size)
+        for image_format, (extension, options) in RENDITION_FORMATS.items():
+            buffer = BytesIO()
+            im.save(buffer, image_format.upper(), **options)
+            name = rendition_name(field_file.name, size, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+            renditions.setdefault(image_format, {})[str(size[0])] = name
+    return renditions
+
+
+def delete_renditions(storage, renditions):
+    for image_format in RENDITION_FORMATS:
+        for name in (renditions or {}).get(image_format, {}).values():
+            storage.delete(name)
+
+
+def renditions_field(field_name):
+    return '{}_renditions'.format(field_name)
+
+
+def renditions_of(field_file):
+    """The rendition map of `field_file`, empty while the current upload has not been processed."""
+    renditions = getattr(field_file.instance, renditions_field(field_file.field.name), None) or {}
+    return renditions if renditions.get('source') == field_file.name else {}
+
+
+def rendition_for(field_file, kind, width=None, image_format=DEFAULT_FORMAT):
+    """Storage name of one rendition, falling back to the original upload."""
+    width = str(width or DEFAULT_RENDITION[kind])
+    return renditions_of(field_file).get(image_format, {}).get(width, field_file.name)
+
+
+def render_image_field(instance, field_name, kind):
+    """Build the renditions of `instance.<field_name>` and store the map without a full save."""
+    field_file = getattr(instance, field_name)
+    previous = getattr(instance, renditions_field(field_name)) or {}
+    if not field_file or previous.get('source') == field_file.name:
+        return False
+    renditions = build_renditions(field_file, kind)
+    updated = type(instance).objects.filter(pk=instance.pk, **{field_file.field.attname: field_file.name}) \
+        .update(**{renditions_field(field_name): renditions})
+    if not updated:
+        # the image was replaced while we were rendering, the newer upload has its own job
+        delete_renditions(field_file.storage, renditions)
+        return False
+    delete_renditions(field_file.storage, previous)
+    return True
+
+
+def watch_image_field(model, field_name, kind, skip=()):
+    """
+    Render `model.<field_name>` in celery whenever a save leaves it pointing at a file
+    the stored rendition map was not built from. Names in `skip` (shared defaults) are
+    served as they are.
+    """
+
+    def on_save(sender, instance, update_fields, **kwargs):
+        if update_fields is not None and field_name not in update_fields:
+            return
+        field_file = getattr(instance, field_name)
+        if not field_file or field_file.name in skip:
+            return
+        if (getattr(instance, renditions_field(field_name)) or {}).get('source') == field_file.name:
+            return
+        from beats.tasks import build_image_renditions
+        transaction.on_commit(lambda: build_image_renditions.delay(
+            model._meta.app_label, model._meta.model_name, instance.pk, field_name, kind))
+
+    post_save.connect(on_save, sender=model, weak=False,
+                      dispatch_uid='renditions_{}_{}'.format(model._meta.label_lower, field_name))
+
+
+def render_model_image(app_label, model_name, pk, field_name, kind):
+    model = apps.get_model(app_label, model_name)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return False
+    return render_image_field(instance, field_name, kind)
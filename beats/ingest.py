@@ -0,0 +1,204 @@
+import math
+
+import mutagen
+from django.db import transaction
+from django.db.models import F
+
+from feeds.utils import create_action
+from subscriptions.models import UserMembership
+from .models import Songs, redis_cache, song_sampler
+
+# why an upload was rejected, kept for the status endpoint after the song row is gone
+INGEST_FAILURE_KEY = 'ingest:{}:failure'
+INGEST_FAILURE_TTL = 60 * 60 * 24
+# bitrate assumed when holding quota for an upload (128 kbps), see estimate_duration
+RESERVE_BYTES_PER_SECOND = 16000
+
+
+class InvalidAudioError(Exception):
+    pass
+
+
+def _audio_length(audio_file):
+    try:
+        audio = mutagen.File(audio_file)
+    except (mutagen.MutagenError, OSError) as e:
+        raise InvalidAudioError(str(e))
+    if audio is None or getattr(audio, 'info', None) is None:
+        raise InvalidAudioError("unsupported audio format")
+    if audio.info.length <= 0:
+        raise InvalidAudioError("audio file has no playable length")
+    return int(audio.info.length)
+
+
+def read_duration(storage, name):
+    """Open a stored upload, check that it is a readable audio container and return its length."""
+    try:
+        with storage.open(name, 'rb') as audio_file:
+            return _audio_length(audio_file)
+    except OSError as e:
+        raise InvalidAudioError(str(e))
+
+
+def estimate_duration(upload):
+    """
+    Seconds of quota to hold for an upload that is still in the request, from its size
+    alone: the container is only parsed by the ingest stages, which settle the hold.
+    """
+    return max(math.ceil(upload.size / RESERVE_BYTES_PER_SECOND), 1)
+
+
+def reserve_quota(user_id, seconds):
+    """
+    Take `seconds` from the uploader's quota at request time, in one conditional UPDATE so
+    parallel uploads cannot all pass the check. A user with no quota left gets False.
+    """
+    memberships = UserMembership.objects.filter(user_id=user_id)
+    if seconds > 0:
+        memberships = memberships.filter(volume_remaining__gt=0)
+    return memberships.update(volume_remaining=F('volume_remaining') - seconds) > 0
+
+
+def _refund(user_id, seconds):
+    if seconds:
+        UserMembership.objects.filter(user_id=user_id).update(volume_remaining=F('volume_remaining') + seconds)
+
+
+def _record_failure(song, message):
+    pipe = redis_cache.pipeline()
+    pipe.hset(INGEST_FAILURE_KEY.format(song.id), mapping={'user_id': song.user_id, 'message': message})
+    pipe.expire(INGEST_FAILURE_KEY.format(song.id), INGEST_FAILURE_TTL)
+    pipe.execute()
+
+
+def _processing(song_id):
+    return Songs.objects.select_for_update().filter(id=song_id, processing_status=Songs.ProcessingStatus.PROCESSING)
+
+
+def extract_metadata(song_id, reserved=0, pending_audio=None):
+    """
+    Stage 1: store the duration and settle the quota reserved at request time, or drop
+    the upload if the audio is unusable.
+
+    A new upload is PROCESSING and carries its reservation in duration_seconds. A
+    replacement (`pending_audio`, recorded on the song and stored next to its current
+    file) leaves the song READY with its old audio; it only takes the song's place once
+    it has been read, and a bad one is discarded.
+    """
+    if pending_audio:
+        return _swap_replacement(song_id, reserved, pending_audio)
+    song = Songs.objects.filter(id=song_id, processing_status=Songs.ProcessingStatus.PROCESSING).first()
+    if song is None:
+        return False
+    try:
+        duration = read_duration(song.audio_file.storage, song.audio_file.name)
+    except InvalidAudioError as e:
+        _record_failure(song, str(e))
+        # pre_delete refunds the reservation held in duration_seconds
+        song.delete()
+        return False
+
+    with transaction.atomic():
+        song = _processing(song_id).first()
+        if song is None:
+            return False
+        _refund(song.user_id, song.duration_seconds - duration)
+        Songs.objects.filter(id=song_id).update(duration_seconds=duration)
+    return True
+
+
+def _swap_replacement(song_id, reserved, pending_audio):
+    song = Songs.objects.filter(id=song_id).first()
+    if song is None:
+        abandon_replacement(song_id, reserved, pending_audio)
+        return False
+    if song.audio_file.name == pending_audio:
+        # a retried run already swapped the file in
+        return True
+    storage = song.audio_file.storage
+    try:
+        duration = read_duration(storage, pending_audio)
+    except InvalidAudioError as e:
+        _record_failure(song, str(e))
+        abandon_replacement(song_id, reserved, pending_audio)
+        return False
+
+    with transaction.atomic():
+        song = Songs.objects.select_for_update().filter(id=song_id, pending_audio=pending_audio).first()
+        if song is not None:
+            previous_audio = song.audio_file.name
+            _refund(song.user_id, reserved - (duration - song.duration_seconds))
+            # update() rather than save(): nothing indexed changed, so the save signals have nothing to do
+            Songs.objects.filter(id=song_id).update(duration_seconds=duration, audio_file=pending_audio,
+                                                    pending_audio='')
+    if song is None:
+        # superseded by a newer replacement, or the song was deleted
+        abandon_replacement(song_id, reserved, pending_audio)
+        return False
+    # written with update(), so django_cleanup does not know the old file is gone
+    storage.delete(previous_audio)
+    return True
+
+
+def abandon_replacement(song_id, reserved, pending_audio):
+    """
+    Give back a replacement's reservation and drop its file; the song keeps its current
+    audio. Once the replacement has been swapped in (a later stage failed) it is kept.
+    A song deleted meanwhile has nobody left to refund.
+    """
+    with transaction.atomic():
+        song = Songs.objects.select_for_update().filter(id=song_id).first()
+        if song is not None:
+            if song.audio_file.name == pending_audio:
+                return False
+            _refund(song.user_id, reserved)
+            Songs.objects.filter(id=song_id, pending_audio=pending_audio).update(pending_audio='')
+    Songs.audio_file.field.storage.delete(pending_audio)
+    return True
+
+
+def fail_ingest(song_id, reserved=0, pending_audio=None):
+    """
+    An ingest stage crashed. A replacement is abandoned (the song keeps its old audio unless
+    the new file was already swapped in); a new upload is marked FAILED with its quota
+    refunded, left for the owner to delete.
+    """
+    if pending_audio:
+        return abandon_replacement(song_id, reserved, pending_audio)
+    with transaction.atomic():
+        song = _processing(song_id).first()
+        if song is None:
+            return False
+        _refund(song.user_id, song.duration_seconds)
+        Songs.objects.filter(id=song_id).update(processing_status=Songs.ProcessingStatus.FAILED,
+                                                duration_seconds=0)
+    return True
+
+
+def publish(song_id):
+    """
+    Stage 2: flip a new upload to READY, put it in the random pools and post the feed action.
+
+    The status flip is conditional, so a retried task never posts twice.
+    """
+    updated = Songs.objects.filter(id=song_id, processing_status=Songs.ProcessingStatus.PROCESSING).update(
+        processing_status=Songs.ProcessingStatus.READY)
+    if not updated:
+        return False
+    song = Songs.objects.select_related('user').get(id=song_id)
+    song_sampler.add(song)
+    create_action(song.user, 'posted a song', song, verb_id=1)
+    return True
+
+
+def ingest_status(song_id, user):
+    """Status of an upload owned by `user` as {'processing_status': ..., ...}, or None if unknown."""
+    song = Songs.objects.filter(id=song_id, user=user) \
+        .values('processing_status', 'duration_seconds', 'pending_audio').first()
+    if song is not None:
+        return dict(processing_status=Songs.ProcessingStatus(song['processing_status']).label,
+                    duration_seconds=song['duration_seconds'], replacing_audio=bool(song['pending_audio']))
+    failure = redis_cache.hgetall(INGEST_FAILURE_KEY.format(song_id))
+    if failure and int(failure[b'user_id']) == user.id:
+        return dict(processing_status='failed', message=failure[b'message'].decode())
+    return None
@@ -0,0 +1,306 @@
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.db.models import F, Q
+from rest_framework import serializers
+
+from accounts.models import recount_profiles
+from common.utils import redis_lock
+from feeds.models import Action
+from feeds.utils import register_buffered_check
+from .models import Songs, RELATED_DIRTY_KEY, USER_LIKES_KEY, redis_cache, like_count_expression
+
+# "song_id:user_id" -> 1 (like) / 0 (unlike) not yet written to the through table
+PENDING_LIKES_KEY = 'likes:pending'
+# the batch currently being flushed, kept until the database commit so a crashed flush is retried
+FLUSHING_LIKES_KEY = 'likes:flushing'
+# member that marks a user's like set as built even when they like nothing (song ids start at 1)
+BUILT_MARKER = 0
+# bumped whenever queued changes move from the pending to the flushing hash or leave it; a like
+# set read from the table and the hashes across a bump may have missed a change and is read again
+LIKES_EPOCH_KEY = 'likes:epoch'
+# a like set being built lives here until it is published, in case the builder dies
+BUILDING_LIKES_SECONDS = 60
+FLUSH_BATCH_SIZE = 500
+FLUSH_LOCK_SECONDS = 5 * 60
+# idle like sets expire and are rebuilt from the table on the next read
+USER_LIKES_SECONDS = 24 * 60 * 60
+# songs per UPDATE when reconciling Songs.total_likes
+RECONCILE_BATCH_SIZE = 5000
+# feed verb of a like, see beats.tasks.send_like_notifications
+LIKE_ACTION_VERB = 'like a song'
+
+# flips membership and queues the change in one atomic step; returns 1 when the song ends up
+# liked, or -1 without changing anything when the like set is gone (expired or evicted since
+# it was built) and the direction cannot be told
+TOGGLE_LIKE_SCRIPT = redis_cache.register_script("""
+if redis.call('SISMEMBER', KEYS[1], ARGV[4]) == 0 then
+    return -1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+local field = ARGV[1] .. ':' .. ARGV[2]
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    redis.call('SREM', KEYS[1], ARGV[1])
+    redis.call('HSET', KEYS[2], field, 0)
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], field, 1)
+return 1
+""")
+
+
+# publishes a like set built under KEYS[2] as KEYS[1], unless another request built it first
+# (1, the built set is dropped) or the epoch moved since the build started (0, build again)
+PUBLISH_LIKES_SCRIPT = redis_cache.register_script("""
+if redis.call('SISMEMBER', KEYS[1], ARGV[2]) == 1 then
+    redis.call('DEL', KEYS[2])
+    return 1
+end
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    redis.call('DEL', KEYS[2])
+    return 0
+end
+redis.call('RENAME', KEYS[2], KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+""")
+
+# moves the pending hash aside for a flush and bumps the epoch in the same step
+TAKE_LIKES_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('INCR', KEYS[3])
+return 1
+""")
+
+
+class LikedSongsResolver:
+    """
+    Per-request cache of which songs the current user has liked.
+
+    List serializers prime it with every song id on the page, so the whole
+    page is answered by a single query on the likes through table.
+    """
+
+    def __init__(self, user):
+        self.user_id = user.id if user is not None and user.is_authenticated else None
+        self._resolved = set()
+        self._liked = set()
+
+    @classmethod
+    def for_request(cls, request):
+        resolver = getattr(request, '_liked_songs_resolver', None)
+        if resolver is None:
+            resolver = cls(getattr(request, 'user', None))
+            request._liked_songs_resolver = resolver
+        return resolver
+
+    def prime(self, song_ids):
+        if self.user_id is None:
+            return
+        missing = list({int(song_id) for song_id in song_ids if song_id is not None} - self._resolved)
+        if not missing:
+            return
+        self._liked.update(liked_among(self.user_id, missing))
+        self._resolved.update(missing)
+
+    def is_liked(self, song_id):
+        if self.user_id is None:
+            return False
+        if song_id not in self._resolved:
+            self.prime([song_id])
+        return song_id in self._liked
+
+    def mark(self, song_id, liked):
+        self._resolved.add(song_id)
+        if liked:
+            self._liked.add(song_id)
+        else:
+            self._liked.discard(song_id)
+
+
+class LikedSongsListSerializer(serializers.ListSerializer):
+    """
+    Collects the song ids of a page through the child's `liked_song_ids(obj)`
+    and primes the request resolver before the rows are serialized.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        request = self.context.get('request')
+        if request is not None:
+            iterable = list(iterable)
+            song_ids = [song_id for item in iterable for song_id in self.child.liked_song_ids(item)]
+            LikedSongsResolver.for_request(request).prime(song_ids)
+        return super().to_representation(iterable)
+
+
+def _stored_likes(user_id):
+    return set(Songs.users_like.through.objects.filter(user_id=user_id).values_list('songs_id', flat=True))
+
+
+def _user_likes_key(user_id):
+    key = USER_LIKES_KEY.format(user_id)
+    while not redis_cache.sismember(key, BUILT_MARKER):
+        epoch = redis_cache.get(LIKES_EPOCH_KEY) or b'0'
+        song_ids = _stored_likes(user_id)
+        # changes still waiting for the writer are newer than the table
+        for pending_key in (FLUSHING_LIKES_KEY, PENDING_LIKES_KEY):
+            for field, value in redis_cache.hscan_iter(pending_key, match='*:{}'.format(user_id)):
+                song_id = int(field.split(b':')[0])
+                if int(value):
+                    song_ids.add(song_id)
+                else:
+                    song_ids.discard(song_id)
+        # built aside and published in one step, so the live set is never half built or overwritten
+        building_key = '{}:building:{}'.format(key, uuid.uuid4().hex)
+        song_ids = sorted(song_ids)
+        pipe = redis_cache.pipeline()
+        for start in range(0, len(song_ids), 1000):
+            pipe.sadd(building_key, *song_ids[start:start + 1000])
+        pipe.sadd(building_key, BUILT_MARKER)
+        pipe.expire(building_key, BUILDING_LIKES_SECONDS)
+        pipe.execute()
+        PUBLISH_LIKES_SCRIPT(keys=[key, building_key, LIKES_EPOCH_KEY],
+                             args=[epoch, BUILT_MARKER, USER_LIKES_SECONDS])
+    return key
+
+
+def liked_among(user_id, song_ids):
+    """The ids in `song_ids` that `user_id` likes, in one pipelined round trip."""
+    key = _user_likes_key(user_id)
+    pipe = redis_cache.pipeline(transaction=False)
+    for song_id in song_ids:
+        pipe.sismember(key, song_id)
+    flags = pipe.execute()
+    return {song_id for song_id, liked in zip(song_ids, flags) if liked}
+
+
+def toggle_like(song_id, user_id):
+    """
+    Like or unlike `song_id` for `user_id` and return True when it ends up liked.
+
+    Only Redis is touched: the user's like set is flipped and the change is queued for
+    flush_pending_likes, which persists it together with `total_likes`, the feed action
+    and the notification.
+    """
+    while True:
+        # a set that expires or is evicted between the build and the script is built again
+        liked = TOGGLE_LIKE_SCRIPT(keys=[_user_likes_key(user_id), PENDING_LIKES_KEY],
+                                   args=[song_id, user_id, USER_LIKES_SECONDS, BUILT_MARKER])
+        if liked != -1:
+            return bool(liked)
+
+
+def flush_pending_likes():
+    """
+    Write the queued like changes to the through table in bulk.
+
+    Only the last change of a (song, user) pair counts, so a burst of taps costs one
+    row at most. Returns the (song_id, user_id) pairs that became new likes ([] when
+    another flush is still running).
+    """
+    with redis_lock('likes:flush', FLUSH_LOCK_SECONDS) as locked:
+        if not locked:
+            return []
+        return _flush_batch()
+
+
+def _flush_batch():
+    if not redis_cache.exists(FLUSHING_LIKES_KEY):
+        if not TAKE_LIKES_SCRIPT(keys=[PENDING_LIKES_KEY, FLUSHING_LIKES_KEY, LIKES_EPOCH_KEY]):
+            # nothing was liked since the last flush
+            return []
+
+    likes, unlikes = set(), set()
+    for field, value in redis_cache.hgetall(FLUSHING_LIKES_KEY).items():
+        song_id, user_id = map(int, field.split(b':'))
+        (likes if int(value) else unlikes).add((song_id, user_id))
+
+    through = Songs.users_like.through
+    pairs = sorted(likes | unlikes)
+    # likes of since deleted users would fail the foreign key, and the batch with them forever
+    known_users = set(get_user_model().objects.filter(id__in={user_id for _, user_id in pairs})
+                      .values_list('id', flat=True))
+    created = []
+    with transaction.atomic():
+        for start in range(0, len(pairs), FLUSH_BATCH_SIZE):
+            batch = pairs[start:start + FLUSH_BATCH_SIZE]
+            match = Q()
+            for song_id, user_id in batch:
+                match |= Q(songs_id=song_id, user_id=user_id)
+            existing = set(through.objects.filter(match).values_list('songs_id', 'user_id'))
+            song_ids = {song_id for song_id, _ in batch}
+            # the song may have been deleted since it was liked
+            known_ids = set(Songs.objects.filter(id__in=song_ids).values_list('id', flat=True))
+            new = [pair for pair in batch if pair in likes and pair not in existing and pair[0] in known_ids
+                   and pair[1] in known_users]
+            gone, gone_actions = Q(), Q()
+            for song_id, user_id in batch:
+                if (song_id, user_id) in unlikes and (song_id, user_id) in existing:
+                    gone |= Q(songs_id=song_id, user_id=user_id)
+                    gone_actions |= Q(target_id=song_id, user_id=user_id)
+            through.objects.bulk_create([through(songs_id=song_id, user_id=user_id) for song_id, user_id in new],
+                                        ignore_conflicts=True)
+            if gone:
+                through.objects.filter(gone).delete()
+                # a taken back like leaves no "liked" entry in the feed
+                Action.objects.filter(gone_actions, verb=LIKE_ACTION_VERB,
+                                      target_ct=ContentType.objects.get_for_model(Songs)).delete()
+            # recounted rather than moved by F() +/- n: the count is right whatever part of a
+            # retried batch already landed, and the row is written once per song per flush
+            Songs.objects.filter(id__in=known_ids).update(total_likes=like_count_expression())
+            created.extend(new)
+        recount_profiles(known_users, ['likes_count'])
+        changed_ids = sorted({song_id for song_id, _ in pairs})
+        transaction.on_commit(lambda: _finish_flush(changed_ids))
+    return created
+
+
+def _likes_still_held(entries):
+    """Buffered like actions whose like has not been taken back by the time they are written."""
+    match = Q()
+    for entry in entries:
+        match |= Q(songs_id=entry['target_id'], user_id=entry['user_id'])
+    held = set(Songs.users_like.through.objects.filter(match).values_list('songs_id', 'user_id'))
+    return [entry for entry in entries if (entry['target_id'], entry['user_id']) in held]
+
+
+# beats.tasks imports this module, so every worker that flushes actions has the check
+register_buffered_check(LIKE_ACTION_VERB, _likes_still_held)
+
+
+def _finish_flush(song_ids):
+    pipe = redis_cache.pipeline()
+    pipe.delete(FLUSHING_LIKES_KEY)
+    pipe.incr(LIKES_EPOCH_KEY)
+    if song_ids:
+        pipe.sadd(RELATED_DIRTY_KEY, *song_ids)
+    pipe.execute()
+
+
+def reconcile_like_counts(song_ids=None):
+    """
+    Rewrite `total_likes` of songs whose counter drifted from the through table.
+
+    Runs in id ranges so a full pass never locks the whole table, and only rows
+    that are actually wrong are written.
+    """
+    songs = Songs.objects.all() if song_ids is None else Songs.objects.filter(id__in=song_ids)
+    bounds = songs.order_by('id').values_list('id', flat=True)
+    fixed = 0
+    last_id = 0
+    while True:
+        batch = list(bounds.filter(id__gt=last_id)[:RECONCILE_BATCH_SIZE])
+        if not batch:
+            return fixed
+        last_id = batch[-1]
+        window = Songs.objects.filter(id__gte=batch[0], id__lte=last_id) if song_ids is None \
+            else Songs.objects.filter(id__in=batch)
+        fixed += window.alias(actual=like_count_expression()).exclude(total_likes=F('actual')) \
+            .update(total_likes=like_count_expression())
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Profile, DEFAULT_AVATAR
+from beats.compression import render_image_field, renditions_field
+from beats.models import Songs
+from beats.tasks import build_image_renditions
+
+# (model, field, rendition set, names served as they are)
+IMAGE_FIELDS = [
+    (Songs, 'photo_main', 'square', ()),
+    (Profile, 'avatar', 'square', (DEFAULT_AVATAR,)),
+    (Profile, 'cover_photo', 'cover', ()),
+]
+
+
+class Command(BaseCommand):
+    help = "Build webp/jpeg renditions for uploaded images that do not have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help="hand the images to celery instead of "
+                                                                 "resizing them in this process")
+
+    def handle(self, *args, **options):
+        for model, field_name, kind, skip in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{field_name: ''}).exclude(**{'{}__in'.format(field_name): skip}) \
+                .filter(**{renditions_field(field_name): {}}).order_by('pk')
+            built = failed = 0
+            for instance in rows.iterator():
+                if options['queue']:
+                    build_image_renditions.delay(model._meta.app_label, model._meta.model_name, instance.pk,
+                                                 field_name, kind)
+                    built += 1
+                    continue
+                try:
+                    built += render_image_field(instance, field_name, kind)
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    self.stderr.write(f'{model._meta.label} {instance.pk} {field_name}: {e}')
+            self.stdout.write(self.style.SUCCESS(f'{model._meta.label}.{field_name}: {built} done, {failed} failed'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from beats.models import Songs
+from beats.tasks import compute_song_waveform
+from beats.waveform import build_waveforms, WaveformError, WAVEFORM_RESOLUTIONS
+
+
+class Command(BaseCommand):
+    help = "Compute waveform peaks for songs that do not have them yet (or for every song with --all)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="recompute songs that already have peaks")
+        parser.add_argument('--queue', action='store_true', help="hand the songs to celery instead of "
+                                                                 "decoding them in this process")
+
+    def handle(self, *args, **options):
+        songs = Songs.objects.order_by('id')
+        if not options['all']:
+            songs = songs.exclude(waveforms__resolution=WAVEFORM_RESOLUTIONS[-1])
+        song_ids = list(songs.values_list('id', flat=True))
+
+        if options['queue']:
+            for song_id in song_ids:
+                compute_song_waveform.delay(song_id)
+            self.stdout.write(self.style.SUCCESS(f'queued {len(song_ids)} songs'))
+            return
+
+        failed = 0
+        for song_id in song_ids:
+            try:
+                build_waveforms(song_id)
+            except WaveformError as e:
+                failed += 1
+                self.stderr.write(f'song {song_id}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'built waveforms for {len(song_ids) - failed} songs, {failed} failed'))
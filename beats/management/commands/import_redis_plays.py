@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from beats.models import Songs
+from beats.plays import redis_cache
+
+
+class Command(BaseCommand):
+    help = "Copy the legacy `beat:{id}:plays` Redis counters into Songs.plays (run once after migrating)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="delete the legacy keys once imported")
+
+    def handle(self, *args, **options):
+        imported = 0
+        for key in redis_cache.scan_iter(match='beat:*:plays', count=1000):
+            song_id = key.decode().split(':')[1]
+            count = redis_cache.get(key)
+            if not song_id.isdigit() or count is None:
+                continue
+            imported += Songs.objects.filter(id=int(song_id)).update(plays=F('plays') + int(count))
+            if options['delete']:
+                redis_cache.delete(key)
+        self.stdout.write(self.style.SUCCESS(f'imported play counts for {imported} songs'))
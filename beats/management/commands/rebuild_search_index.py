@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from beats.models import Songs, update_search_vector
+
+
+class Command(BaseCommand):
+    help = "Rebuild Songs.search_vector for every song (backfill after migrating, or after bulk edits)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        song_ids = list(Songs.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(song_ids), batch_size):
+            update_search_vector(song_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'indexed {len(song_ids)} songs'))
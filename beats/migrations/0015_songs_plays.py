@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0014_auto_20220905_2223'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songs',
+            name='plays',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0015_songs_plays'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='songs',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='songs',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='songs_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='songs',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['song_title'], name='songs_title_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+    ]
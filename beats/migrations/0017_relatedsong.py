@@ -0,0 +1,27 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0016_songs_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedSong',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beats.songs')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_songs', to='beats.songs')),
+            ],
+            options={
+                'ordering': ('-score',),
+                'unique_together': {('song', 'related')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0017_relatedsong'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songs',
+            name='processing_status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'processing'), (2, 'ready')], default=2),
+        ),
+        migrations.AlterField(
+            model_name='songs',
+            name='duration_seconds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
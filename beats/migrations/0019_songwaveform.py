@@ -0,0 +1,27 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0018_songs_processing_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongWaveform',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('peaks', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waveforms', to='beats.songs')),
+            ],
+            options={
+                'unique_together': {('song', 'resolution')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0019_songwaveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songs',
+            name='photo_main_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
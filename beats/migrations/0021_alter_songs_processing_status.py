@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0020_songs_photo_main_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='songs',
+            name='processing_status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'processing'), (2, 'ready'), (3, 'failed')], default=2),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0021_alter_songs_processing_status'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='songwaveform',
+            old_name='created_at',
+            new_name='updated_at',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0023_playflush'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='songs',
+            index=models.Index(fields=['created_at', 'id'], name='songs_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beats', '0024_songs_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songs',
+            name='pending_audio',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
@@ -1,18 +1,23 @@
-import mutagen
 import redis
 from django.conf import settings
 from django.contrib.auth.models import Permission, User
 from django.contrib.contenttypes.models import ContentType
-from django.core.files.uploadedfile import UploadedFile
-from django.db import models
-from django.db.models.signals import m2m_changed, pre_save, pre_delete, post_delete
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_delete, post_save
 from django.dispatch import receiver
 from easy_thumbnails.fields import ThumbnailerImageField
 from rest_framework.reverse import reverse as api_reverse
 from sortedm2m.fields import SortedManyToManyField
 from taggit.managers import TaggableManager
 
-from beats.utils import get_unique_slug
+from accounts.models import recount_profiles
+from common.random_sampler import RandomSampler
+from common.utils import allocate_slug
+from .compression import watch_image_field
 from feeds.models import Action
 from subscriptions.models import UserMembership
 from .validators import (
@@ -24,12 +29,26 @@ redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
                                 port=settings.REDIS_PORT,
                                 db=settings.REDIS_DB)
 
+# text search configuration used for Songs.search_vector and the search endpoint
+SEARCH_CONFIG = 'english'
+# fields that feed Songs.search_vector, a save touching none of them keeps the vector
+SEARCH_FIELDS = {'song_title', 'description', 'genre', 'user'}
+# songs whose tags or likes changed since the last beats.tasks.rebuild_related_songs run
+RELATED_DIRTY_KEY = 'related:dirty'
+# ids of the songs a user likes, the source of truth for toggles until beats.likes flushes them
+USER_LIKES_KEY = 'likes:user:{}'
+
 
 class Songs(models.Model):
     class ContentTypeChoices(models.IntegerChoices):
         FREE = 1, "free"
         EXCLUSIVE = 2, "paid members"
 
+    class ProcessingStatus(models.IntegerChoices):
+        PROCESSING = 1, "processing"
+        READY = 2, "ready"
+        FAILED = 3, "failed"
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='beats', on_delete=models.CASCADE)
     slug = models.SlugField(max_length=200, db_index=True)
     song_title = models.CharField(max_length=250)
@@ -37,9 +56,14 @@ class Songs(models.Model):
     tags = TaggableManager()
     description = models.CharField(max_length=300)
     store_link = models.URLField(null=True, blank=True)
-    photo_main = ThumbnailerImageField(upload_to='photos/%Y/%m/%d/', resize_source=dict(size=(250, 250), sharpen=True))
+    photo_main = ThumbnailerImageField(upload_to='photos/%Y/%m/%d/')
+    # resized webp/jpeg copies of photo_main, built by beats.tasks.build_image_renditions
+    photo_main_renditions = models.JSONField(default=dict, blank=True, editable=False)
     audio_file = models.FileField(upload_to='songs/%Y/%m/%d/')
-    duration_seconds = models.PositiveIntegerField()
+    # stored name of a replacement for audio_file that the ingest stages have not swapped in yet;
+    # the song stays READY with its current audio meanwhile, see beats.ingest
+    pending_audio = models.CharField(max_length=100, blank=True, default='', editable=False)
+    duration_seconds = models.PositiveIntegerField(default=0)
     price = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -48,8 +72,17 @@ class Songs(models.Model):
                                         blank=True)
     total_likes = models.PositiveIntegerField(db_index=True,
                                               default=0)
+    # durable play count, fed in bulk by beats.tasks.flush_song_plays
+    plays = models.PositiveIntegerField(db_index=True,
+                                        default=0)
     exclusive_content = models.PositiveSmallIntegerField(choices=ContentTypeChoices.choices,
                                                          default=ContentTypeChoices.FREE)
+    # uploads stay PROCESSING until the beats.tasks ingest stages have read and validated the audio;
+    # only READY songs are public, see published()
+    processing_status = models.PositiveSmallIntegerField(choices=ProcessingStatus.choices,
+                                                         default=ProcessingStatus.READY)
+    # weighted title/tags/artist/genre/description document, maintained by update_search_vector
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.song_title
@@ -57,7 +90,7 @@ class Songs(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             slug_str = f'{self.song_title}'
-            self.slug = get_unique_slug(self, slug_str, Songs.objects)
+            self.slug = allocate_slug(Songs.objects, slug_str)
             # if self.photo_main:
 
         super().save(*args, **kwargs)
@@ -66,6 +99,9 @@ class Songs(models.Model):
         return api_reverse('beat-detail', kwargs={'username_slug': self.user.username_slug, 'slug': self.slug},
                            request=request)
 
+    def get_stream_url(self, request=None):
+        return api_reverse('beat-stream', kwargs={'beat_id': self.id}, request=request)
+
     @property
     def get_slug(self):
         return self.slug
@@ -88,45 +124,176 @@ class Songs(models.Model):
 
     @property
     def plays_count(self):
-        return redis_cache.get('beat:{}:plays'.format(self.id))
+        return self.plays
 
     class Meta:
         ordering = ('-created_at',)
         index_together = (('id', 'slug'),)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='songs_search_vector_gin'),
+            GinIndex(fields=['song_title'], name='songs_title_trgm', opclasses=['gin_trgm_ops']),
+            # keyset pagination, see beats.views.StandardResultsSetPagination
+            models.Index(fields=['created_at', 'id'], name='songs_created_id_idx'),
+        ]
+
+
+def update_search_vector(song_ids):
+    """Rebuild the full-text document of the given songs, one UPDATE per song."""
+    songs = Songs.objects.filter(id__in=song_ids).select_related('user').prefetch_related('tags')
+    for song in songs:
+        tags = ' '.join(tag.name for tag in song.tags.all())
+        vector = (SearchVector(Value(song.song_title), weight='A', config=SEARCH_CONFIG) +
+                  SearchVector(Value(tags), weight='B', config=SEARCH_CONFIG) +
+                  SearchVector(Value(song.user.username), weight='B', config=SEARCH_CONFIG) +
+                  SearchVector(Value(song.genre), weight='C', config=SEARCH_CONFIG) +
+                  SearchVector(Value(song.description), weight='D', config=SEARCH_CONFIG))
+        # update() skips the save signals, so this does not loop back into index_song
+        Songs.objects.filter(id=song.id).update(search_vector=vector)
+
+
+def published(songs):
+    """Narrow a Songs queryset to what anyone may see: uploads that passed ingest."""
+    return songs.filter(processing_status=Songs.ProcessingStatus.READY)
+
+
+def visible_songs(user, songs=None):
+    """Published songs, plus every upload of `user` whatever its processing status."""
+    songs = Songs.objects.all() if songs is None else songs
+    if user is not None and user.is_authenticated:
+        return songs.filter(Q(processing_status=Songs.ProcessingStatus.READY) | Q(user_id=user.id))
+    return published(songs)
+
+
+def song_sample_pools(song):
+    if song.processing_status != Songs.ProcessingStatus.READY:
+        # unpublished uploads stay out of every pool; beats.ingest.publish adds them
+        return []
+    pools = [{}, {'genre': song.genre}, {'exclusive_content': song.exclusive_content}]
+    pools.extend({'tags__name': name} for name in song.tags.names())
+    return pools
+
+
+# random song ids for the home page and related tracks, see common.random_sampler
+song_sampler = RandomSampler('songs', published(Songs.objects.all()), pools_for=song_sample_pools)
+song_sampler.watch(Songs, fields=('genre', 'exclusive_content', 'processing_status'))
+watch_image_field(Songs, 'photo_main', 'square')
+
+
+@receiver(post_save, sender=Songs)
+def index_song(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields is None or SEARCH_FIELDS.intersection(update_fields):
+        update_search_vector([instance.id])
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_username(sender, instance, update_fields, **kwargs):
+    if instance.pk and (update_fields is None or 'username' in update_fields):
+        instance._stored_username = sender.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reindex_artist_songs(sender, instance, created, **kwargs):
+    # the artist name is part of every song's search document
+    stored = instance.__dict__.pop('_stored_username', None)
+    if not created and stored is not None and stored != instance.username:
+        from .tasks import reindex_user_songs
+        transaction.on_commit(lambda: reindex_user_songs.delay(instance.pk))
+
+
+@receiver(m2m_changed, sender=Songs.tags.through)
+def song_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse and isinstance(instance, Songs):
+        update_search_vector([instance.id])
+        song_sampler.reindex(instance)
+        redis_cache.sadd(RELATED_DIRTY_KEY, instance.id)
 
 
 @receiver(m2m_changed, sender=Songs.users_like.through)
-def users_like_changed(sender, instance, **kwargs):
-    instance.total_likes = instance.users_like.count()
-    instance.save()
+def mark_related_dirty(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove'):
+        return
+    song_ids = pk_set if reverse else [instance.id]
+    if song_ids:
+        redis_cache.sadd(RELATED_DIRTY_KEY, *song_ids)
 
 
-@receiver(pre_save, sender=Songs)
-def file_duration(sender, instance, raw, using, update_fields, **kwargs):
-    file_was_updated = False
-    if hasattr(instance.audio_file, 'file') and isinstance(instance.audio_file.file, UploadedFile):
-        file_was_updated = True
+def like_count_expression():
+    """Likes of the outer song counted on the through table, for updates of total_likes."""
+    likes = Songs.users_like.through.objects.filter(songs_id=OuterRef('pk')).order_by() \
+        .values('songs_id').annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(likes), 0)
 
-    if update_fields and "audio_file" in update_fields:
-        file_was_updated = True
 
-    if file_was_updated:
-        # read audio file metadata
-        audio_info = mutagen.File(instance.audio_file).info
-        # set audio duration in seconds, so we can access it in database
-        instance.duration_seconds = int(audio_info.length)
-        try:
-            volume_remaining = instance.user.membership_plan.volume_remaining - instance.duration_seconds
-            if volume_remaining:
-                UserMembership.objects.filter(user=instance.user).update(volume_remaining=volume_remaining)
-            else:
-                pass
-        except:
-            pass
-        print(">> audio duration was was updated")
+@receiver(m2m_changed, sender=Songs.users_like.through)
+def users_like_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # the like endpoint goes through the beats.likes store, this keeps total_likes right
+    # for likes changed via the related managers (admin, shell, user.beats_liked)
+    if action == 'pre_clear' and reverse:
+        instance._cleared_like_song_ids = list(instance.beats_liked.values_list('id', flat=True))
+    elif action == 'post_add' and pk_set:
+        # pk_set of an add only holds pairs that were actually inserted
+        if reverse:
+            Songs.objects.filter(id__in=pk_set).update(total_likes=F('total_likes') + 1)
+        else:
+            Songs.objects.filter(id=instance.id).update(total_likes=F('total_likes') + len(pk_set))
+    elif action in ('post_remove', 'post_clear'):
+        # pk_set of a remove may name pairs that never existed, so recount instead of decrementing
+        song_ids = getattr(instance, '_cleared_like_song_ids', pk_set) if reverse else [instance.id]
+        if song_ids:
+            Songs.objects.filter(id__in=song_ids).update(total_likes=like_count_expression())
+
+
+@receiver(m2m_changed, sender=Songs.users_like.through)
+def user_likes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # likes changed around the beats.likes store: drop the users' like sets so they are
+    # rebuilt, and recount their Profile.likes_count
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_like_user_ids = list(instance.users_like.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        user_ids = [instance.id] if reverse else getattr(instance, '_cleared_like_user_ids', pk_set)
+        if user_ids:
+            redis_cache.delete(*[USER_LIKES_KEY.format(user_id) for user_id in user_ids])
+            recount_profiles(user_ids, ['likes_count'])
+
+
+class RelatedSong(models.Model):
+    """Top neighbours of a song, precomputed by beats.related.build_related_songs."""
+    song = models.ForeignKey(Songs, related_name='related_songs', on_delete=models.CASCADE)
+    related = models.ForeignKey(Songs, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ('-score',)
+        unique_together = (('song', 'related'),)
+
+    def __str__(self):
+        return '{} -> {}'.format(self.song_id, self.related_id)
 
-    else:
-        print(">> file not changed - duration was NOT updated")
+
+class PlayFlush(models.Model):
+    """A batch of play counts written by beats.plays.flush_pending_plays, so a retried batch is not counted twice."""
+    flush_id = models.CharField(max_length=32, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.flush_id
+
+
+class SongWaveform(models.Model):
+    """Min/max peaks of a song at one resolution, as interleaved int8 pairs (see beats.waveform)."""
+    song = models.ForeignKey(Songs, related_name='waveforms', on_delete=models.CASCADE)
+    resolution = models.PositiveIntegerField()
+    peaks = models.BinaryField()
+    # bumped on every rebuild, it versions the ETag of SongWaveformApiView
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('song', 'resolution'),)
+
+    def __str__(self):
+        return 'Waveform {} of {}'.format(self.resolution, self.song_id)
 
 
 class PlayList(models.Model):
@@ -144,7 +311,7 @@ class PlayList(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             slug_str = f'{self.name}'
-            self.slug = get_unique_slug(self, slug_str, PlayList.objects)
+            self.slug = allocate_slug(PlayList.objects, slug_str)
 
         super().save(*args, **kwargs)
 
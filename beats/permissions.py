@@ -16,14 +16,14 @@ class IsPlaylistUserOrReadOnly(permissions.BasePermission):
         # so we'll always allow GET, HEAD or OPTIONS requests.
         if request.method == "POST":
             playlist_obj = get_object_or_404(PlayList, slug=view.kwargs['slug'])
-            return playlist_obj.owner == request.user
+            return playlist_obj.owner_id == request.user.id
 
     def has_object_permission(self, request, view, obj):
         # Read permissions are allowed to any request,
         # so we'll always allow GET, HEAD or OPTIONS requests.
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.owner == request.user
+        return obj.owner_id == request.user.id
 
         # Write permissions are only allowed to the owner of the subscriber.
 
@@ -38,7 +38,7 @@ class IsPlaylistObjectPermissionUserOrReadOnly(permissions.BasePermission):
         # so we'll always allow GET, HEAD or OPTIONS requests.
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.owner == request.user
+        return obj.owner_id == request.user.id
 
 
 # Write permissions are only allowed to the owner of the subscriber.
@@ -52,7 +52,7 @@ class IsSongUserOrReadOnly(permissions.BasePermission):
         # so we'll always allow GET, HEAD or OPTIONS requests.
         if request.method == "POST":
             song_obj = get_object_or_404(Songs, id=view.kwargs['track_id'])
-            return song_obj.user == request.user
+            return song_obj.user_id == request.user.id
 
 
 class ExclusiveContentPermissionMixin:
@@ -67,6 +67,23 @@ class ExclusiveContentPermissionMixin:
         return super().dispatch(request, *args, **kwargs)
 
 
+def has_subscription_badge(user):
+    if not user.is_authenticated:
+        return False
+    # token requests carry the badge in their principal claims
+    badge = getattr(user, 'subscription_badge', None)
+    if badge is None:
+        badge = UserMembership.objects.filter(user_id=user.id).values_list('subscription_badge', flat=True).first()
+    return bool(badge)
+
+
+def can_play(user, song):
+    """Exclusive songs are for members with a subscription badge, and for their uploader."""
+    if song.exclusive_content != Songs.ContentTypeChoices.EXCLUSIVE:
+        return True
+    return song.user_id == user.id or has_subscription_badge(user)
+
+
 class ExclusiveContentPermission(permissions.BasePermission):
     """
     Object-level permission to only allow owners of an object to edit it.
@@ -76,8 +93,4 @@ class ExclusiveContentPermission(permissions.BasePermission):
         # Read permissions are allowed to any request,
         # so we'll always allow GET, HEAD or OPTIONS requests.
         if request.method == "GET":
-            user_membership = UserMembership.objects.get(user=request.user)
-            badge = user_membership.subscription_badge
-            if badge:
-                return badge
-            return False
+            return has_subscription_badge(request.user)
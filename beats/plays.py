@@ -0,0 +1,175 @@
+import uuid
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from common.utils import redis_lock
+from .models import PlayFlush, Songs, song_sampler
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# song id -> plays not yet written to Songs.plays
+PENDING_PLAYS_KEY = 'plays:pending'
+# the batch currently being flushed, kept until the database commit so a crashed flush is retried
+FLUSHING_PLAYS_KEY = 'plays:flushing'
+# id of the batch in FLUSHING_PLAYS_KEY, recorded as a PlayFlush row in the transaction that applies it
+FLUSH_ID_KEY = 'plays:flushing:id'
+FLUSH_LOCK_SECONDS = 5 * 60
+# PlayFlush rows only need to outlive any retry of their batch
+FLUSH_RECORD_DAYS = 2
+PLAYS_RANKING_KEY = 'plays_ranking'
+FLUSH_BATCH_SIZE = 500
+
+# per-bucket rankings: (key format, bucket length, how long a bucket is kept)
+PLAY_BUCKETS = {
+    'hour': ('plays_ranking:hour:{:%Y%m%d%H}', timedelta(hours=1), timedelta(days=2)),
+    'day': ('plays_ranking:day:{:%Y%m%d}', timedelta(days=1), timedelta(days=8)),
+}
+# chart window -> (bucket, number of buckets merged, half-life in buckets)
+TRENDING_WINDOWS = {
+    'hour': ('hour', 2, 1),
+    'day': ('hour', 24, 12),
+    'week': ('day', 7, 3),
+}
+TRENDING_WINDOW_CHOICES = tuple(TRENDING_WINDOWS) + ('all',)
+# merged window rankings are rebuilt at most this often
+TRENDING_CACHE_SECONDS = 60
+
+# moves the pending hash aside under a new batch id, or hands back the batch (and id) a
+# crashed flush left behind; returns nil when nothing was played
+TAKE_BATCH_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('DEL', KEYS[3])
+end
+redis.call('SET', KEYS[3], ARGV[1], 'NX')
+return redis.call('GET', KEYS[3])
+""")
+
+
+# counts a play of a song in the published pool (KEYS[1]); -1 when that pool is not built,
+# 0 for an id outside it. ARGV: song id, pool key, then the ttl of each bucket in KEYS[5..]
+RECORD_PLAY_SCRIPT = redis_cache.register_script("""
+if redis.call('SISMEMBER', KEYS[2], ARGV[2]) == 0 or redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[3], ARGV[1], 1)
+redis.call('ZINCRBY', KEYS[4], 1, ARGV[1])
+for i = 5, #KEYS do
+    redis.call('ZINCRBY', KEYS[i], 1, ARGV[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[i - 2])
+end
+return 1
+""")
+
+
+def record_play(song_id):
+    """
+    Count one play of a published song in a single Redis round trip, no database read.
+    The id is checked against song_sampler's pool of every READY song; an unknown id
+    returns False and must not grow the rankings.
+    """
+    pool_key = song_sampler.pool_key()
+    now = timezone.now()
+    buckets = [(key_format.format(now), int(keep_for.total_seconds()))
+               for key_format, _, keep_for in PLAY_BUCKETS.values()]
+    keys = [pool_key, song_sampler.registry_key, PENDING_PLAYS_KEY, PLAYS_RANKING_KEY]
+    keys += [bucket_key for bucket_key, _ in buckets]
+    args = [song_id, pool_key] + [keep_for for _, keep_for in buckets]
+    counted = RECORD_PLAY_SCRIPT(keys=keys, args=args)
+    if counted == -1:
+        # the pool was never built or redis lost it
+        song_sampler.build()
+        counted = RECORD_PLAY_SCRIPT(keys=keys, args=args)
+    return counted == 1
+
+
+def _window_key(window):
+    bucket, count, half_life = TRENDING_WINDOWS[window]
+    key_format, length, _ = PLAY_BUCKETS[bucket]
+    now = timezone.now()
+    # older buckets count for less, so a hit fades out of the chart instead of dropping off a cliff
+    weights = {key_format.format(now - length * age): 0.5 ** (age / half_life) for age in range(count)}
+    window_key = 'plays_ranking:window:{}'.format(window)
+    pipe = redis_cache.pipeline()
+    pipe.zunionstore(window_key, weights, aggregate='SUM')
+    pipe.expire(window_key, TRENDING_CACHE_SECONDS)
+    pipe.execute()
+    return window_key
+
+
+def trending_song_ids(window='all', limit=15):
+    """Ids of the `limit` most played songs in `window`, best first."""
+    if window == 'all':
+        key = PLAYS_RANKING_KEY
+    else:
+        key = 'plays_ranking:window:{}'.format(window)
+        if not redis_cache.exists(key):
+            key = _window_key(window)
+    return [int(song_id) for song_id in redis_cache.zrevrange(key, 0, limit - 1)]
+
+
+def flush_pending_plays():
+    """
+    Move the accumulated play deltas into `Songs.plays`.
+
+    The pending hash is renamed atomically, so plays recorded during the flush
+    land in a fresh hash and are picked up by the next run. Runs are serialised by a
+    lock, and a batch whose commit landed but whose cleanup did not is only cleaned up.
+    """
+    with redis_lock('plays:flush', FLUSH_LOCK_SECONDS) as locked:
+        if not locked:
+            return 0
+        return _flush_batch()
+
+
+def _flush_batch():
+    flush_id = TAKE_BATCH_SCRIPT(keys=[PENDING_PLAYS_KEY, FLUSHING_PLAYS_KEY, FLUSH_ID_KEY], args=[uuid.uuid4().hex])
+    if flush_id is None:
+        # nothing was played since the last flush
+        return 0
+
+    deltas = {int(song_id): int(count) for song_id, count in redis_cache.hgetall(FLUSHING_PLAYS_KEY).items()}
+    song_ids = sorted(deltas)
+    updated = 0
+    with transaction.atomic():
+        _, created = PlayFlush.objects.get_or_create(flush_id=flush_id.decode())
+        if not created:
+            # applied by a run that died before clearing the batch
+            transaction.on_commit(lambda: _finish_flush([]))
+            return 0
+        PlayFlush.objects.filter(created_at__lt=timezone.now() - timedelta(days=FLUSH_RECORD_DAYS)).delete()
+        for start in range(0, len(song_ids), FLUSH_BATCH_SIZE):
+            batch = song_ids[start:start + FLUSH_BATCH_SIZE]
+            updated += Songs.objects.filter(id__in=batch).update(
+                plays=F('plays') + Case(*[When(id=song_id, then=Value(deltas[song_id])) for song_id in batch],
+                                        default=Value(0)))
+
+        # plays recorded for deleted or unknown songs should not stay in the chart
+        known_ids = set(Songs.objects.filter(id__in=song_ids).values_list('id', flat=True))
+        unknown_ids = [song_id for song_id in song_ids if song_id not in known_ids]
+        transaction.on_commit(lambda: _finish_flush(unknown_ids))
+    return updated
+
+
+def _finish_flush(unknown_ids):
+    pipe = redis_cache.pipeline(transaction=False)
+    pipe.delete(FLUSHING_PLAYS_KEY, FLUSH_ID_KEY)
+    if unknown_ids:
+        pipe.zrem(PLAYS_RANKING_KEY, *unknown_ids)
+        for key_format, _, _ in PLAY_BUCKETS.values():
+            pipe.zrem(key_format.format(timezone.now()), *unknown_ids)
+    pipe.execute()
@@ -0,0 +1,158 @@
+import math
+from collections import Counter, defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count
+from taggit.models import TaggedItem
+
+from common.utils import redis_lock
+from .models import Songs, RelatedSong, RELATED_DIRTY_KEY, redis_cache
+
+# neighbours stored per song
+RELATED_TOP_K = 10
+# added to the cosine score of two songs sharing a genre
+GENRE_BONUS = 0.1
+# tags / likers shared by more songs than this say little about similarity and would make
+# the co-occurrence step quadratic, so they are left out of the postings
+MAX_FEATURE_SONGS = 1000
+
+# songs per step of the full rebuild; each step only loads the features around its songs
+FULL_BATCH_SIZE = 500
+# rows fetched per round trip while reading tags and likes
+ROW_CHUNK_SIZE = 2000
+# dirty ids taken by a run, kept until its build has committed
+RELATED_BUILDING_KEY = 'related:building'
+BUILD_LOCK_SECONDS = 60 * 60
+
+TAG, LIKER = 't', 'u'
+
+# take the dirty ids; a batch a failed run left behind is merged in rather than lost
+TAKE_DIRTY_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SUNIONSTORE', KEYS[2], KEYS[2], KEYS[1])
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('SMEMBERS', KEYS[2])
+""")
+
+
+def _tag_rows(**filters):
+    return TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Songs),
+                                     **filters).values_list('object_id', 'tag_id')
+
+
+def _like_rows(**filters):
+    return Songs.users_like.through.objects.filter(**filters).values_list('songs_id', 'user_id')
+
+
+def _features(tag_rows, like_rows):
+    """Sparse song x feature matrix as {song_id: {(kind, id), ...}}."""
+    features = defaultdict(set)
+    for song_id, tag_id in tag_rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        features[song_id].add((TAG, tag_id))
+    for song_id, user_id in like_rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        features[song_id].add((LIKER, user_id))
+    return features
+
+
+def _document_frequencies(features):
+    tag_ids = {value for feats in features.values() for kind, value in feats if kind == TAG}
+    user_ids = {value for feats in features.values() for kind, value in feats if kind == LIKER}
+    frequencies = Counter()
+    for tag_id, count in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Songs),
+            tag_id__in=tag_ids).values('tag_id').annotate(n=Count('id')).values_list('tag_id', 'n'):
+        frequencies[(TAG, tag_id)] = count
+    for user_id, count in Songs.users_like.through.objects.filter(
+            user_id__in=user_ids).values('user_id').annotate(n=Count('id')).values_list('user_id', 'n'):
+        frequencies[(LIKER, user_id)] = count
+    return frequencies
+
+
+def _candidates(targets):
+    """Features of every song sharing a usable tag or liker with one of `targets`."""
+    frequencies = _document_frequencies(targets)
+    tag_ids = {value for feats in targets.values() for kind, value in feats
+               if kind == TAG and frequencies[(kind, value)] <= MAX_FEATURE_SONGS}
+    user_ids = {value for feats in targets.values() for kind, value in feats
+                if kind == LIKER and frequencies[(kind, value)] <= MAX_FEATURE_SONGS}
+    candidate_ids = {song_id for song_id, _ in _tag_rows(tag_id__in=tag_ids).iterator(chunk_size=ROW_CHUNK_SIZE)}
+    candidate_ids.update(song_id for song_id, _ in _like_rows(user_id__in=user_ids).iterator(chunk_size=ROW_CHUNK_SIZE))
+    candidate_ids.update(targets)
+    return _features(_tag_rows(object_id__in=candidate_ids), _like_rows(songs_id__in=candidate_ids))
+
+
+def build_related_songs(song_ids=None):
+    """
+    Recompute the top RELATED_TOP_K neighbours of `song_ids` (every song when None,
+    FULL_BATCH_SIZE songs at a time).
+
+    Songs are sparse vectors of idf-weighted tag and liker features. Cosine similarity
+    is accumulated through an inverted index, so only pairs that actually share a
+    feature are ever scored. Songs sharing a genre get GENRE_BONUS on top.
+    """
+    if song_ids is None:
+        built, last_id = 0, 0
+        while True:
+            batch = list(Songs.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)
+                         [:FULL_BATCH_SIZE])
+            if not batch:
+                return built
+            built += build_related_songs(batch)
+            last_id = batch[-1]
+
+    targets = list(song_ids)
+    candidates = _candidates(_features(_tag_rows(object_id__in=targets), _like_rows(songs_id__in=targets)))
+    frequencies = _document_frequencies(candidates)
+
+    total_songs = max(Songs.objects.count(), 1)
+    idf = {feature: math.log(1 + total_songs / count) for feature, count in frequencies.items()}
+    norms = {song_id: math.sqrt(sum(idf.get(f, 0) ** 2 for f in feats)) for song_id, feats in candidates.items()}
+    postings = defaultdict(list)
+    for song_id, feats in candidates.items():
+        for feature in feats:
+            if frequencies[feature] <= MAX_FEATURE_SONGS:
+                postings[feature].append(song_id)
+    genres = dict(Songs.objects.filter(id__in=list(candidates)).values_list('id', 'genre'))
+
+    rows = []
+    for song_id in targets:
+        if song_id not in genres:
+            # deleted since it was marked dirty
+            continue
+        scores = Counter()
+        for feature in candidates.get(song_id, ()):
+            weight = idf.get(feature, 0) ** 2
+            for other_id in postings.get(feature, ()):
+                if other_id != song_id:
+                    scores[other_id] += weight
+        for other_id, dot in scores.items():
+            scores[other_id] = dot / ((norms[song_id] * norms[other_id]) or 1)
+            if genres.get(song_id) and genres.get(song_id) == genres.get(other_id):
+                scores[other_id] += GENRE_BONUS
+        rows.extend(RelatedSong(song_id=song_id, related_id=other_id, score=score)
+                    for other_id, score in scores.most_common(RELATED_TOP_K) if other_id in genres)
+
+    with transaction.atomic():
+        RelatedSong.objects.filter(song_id__in=targets).delete()
+        RelatedSong.objects.bulk_create(rows, batch_size=1000)
+    return len(targets)
+
+
+def rebuild_related_songs(full=False):
+    """
+    Rebuild the songs marked dirty since the last run, or every song when `full`.
+
+    Runs are serialised by a lock. The dirty ids are moved aside and only dropped once
+    the build has committed, so a failed run leaves them for the next one.
+    """
+    with redis_lock('related:build', BUILD_LOCK_SECONDS) as locked:
+        if not locked:
+            return 0
+        if full:
+            return build_related_songs()
+        song_ids = [int(song_id) for song_id in TAKE_DIRTY_SCRIPT(keys=[RELATED_DIRTY_KEY, RELATED_BUILDING_KEY])]
+        built = build_related_songs(song_ids) if song_ids else 0
+        redis_cache.delete(RELATED_BUILDING_KEY)
+        return built
@@ -7,6 +7,8 @@ from rest_framework import serializers
 from taggit.serializers import (TagListSerializerField,
                                 TaggitSerializer)
 
+from .compression import RENDITION_FORMATS, RENDITION_SIZES, renditions_of, rendition_for
+from .likes import LikedSongsResolver, LikedSongsListSerializer
 from .models import Songs, PlayList, Comment
 from .validators import (
     FileExtensionValidator
@@ -45,6 +47,49 @@ class NewTagListSerializerField(TagListSerializerField):
         return value
 
 
+class RenditionImageField(serializers.ImageField):
+    """Serves the default jpeg rendition of an image once it is built, the original upload until then."""
+
+    def __init__(self, kind='square', **kwargs):
+        self.kind = kind
+        kwargs.setdefault('read_only', True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        if not self.use_url:
+            return value.name
+        url = value.storage.url(rendition_for(value, self.kind))
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class RenditionSrcsetField(serializers.ReadOnlyField):
+    """`srcset` strings of an image per format, e.g. {'webp': '.../a.96x96.webp 96w, ...'}."""
+
+    def __init__(self, kind='square', **kwargs):
+        self.kind = kind
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        renditions = renditions_of(value) if value else {}
+        request = self.context.get('request')
+        srcsets = {}
+        for image_format in RENDITION_FORMATS:
+            names = renditions.get(image_format, {})
+            candidates = []
+            for width, _ in RENDITION_SIZES[self.kind]:
+                if str(width) in names:
+                    url = value.storage.url(names[str(width)])
+                    if request is not None:
+                        url = request.build_absolute_uri(url)
+                    candidates.append('{} {}w'.format(url, width))
+            if candidates:
+                srcsets[image_format] = ', '.join(candidates)
+        return srcsets
+
+
 class BeatsUploadSerializer(TaggitSerializer, serializers.ModelSerializer):
     slug = serializers.SerializerMethodField()
     tags = NewTagListSerializerField()
@@ -56,7 +101,8 @@ class BeatsUploadSerializer(TaggitSerializer, serializers.ModelSerializer):
         model = Songs
         fields = ['id', 'slug', 'song_title', 'user', 'genre', 'tags', 'description', 'store_link', 'photo_main',
                   'audio_file',
-                  'username', 'limit_remaining', 'get_subscription_badge', 'exclusive_content']
+                  'username', 'limit_remaining', 'get_subscription_badge', 'exclusive_content', 'processing_status']
+        read_only_fields = ['processing_status']
 
     # def __init__(self, user, *args, **kwargs):
     #     super(BeatsUploadSerializer, self).__init__(*args, **kwargs)
@@ -75,40 +121,60 @@ class SongSerializer(TaggitSerializer, serializers.ModelSerializer):
     # photo_main = serializers.ImageField(required=True, validators=[FileExtensionValidator('image')])
     # audio_file = serializers.FileField(required=True, validators=[FileExtensionValidator('audio')])
     url = serializers.SerializerMethodField()
+    stream_url = serializers.SerializerMethodField()
+    photo_main = RenditionImageField()
+    photo_main_srcset = RenditionSrcsetField(source='photo_main')
 
     class Meta:
         model = Songs
-        fields = ['id', 'slug', 'song_title', 'genre', 'tags', 'description', 'store_link', 'photo_main', 'audio_file',
-                  'user_like', 'total_likes', 'plays_count',
+        fields = ['id', 'slug', 'song_title', 'genre', 'tags', 'description', 'store_link', 'photo_main',
+                  'photo_main_srcset', 'audio_file',
+                  'stream_url', 'user_like', 'total_likes', 'plays_count',
                   'url', 'username', 'username_slug', 'get_subscription_badge', 'exclusive_content']
+        list_serializer_class = LikedSongsListSerializer
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return [obj.id]
 
     def get_user_like(self, obj):
         request = self.context.get("request")
-        if request.user.id:
-            return Songs.objects.filter(id=obj.id, users_like=request.user.id).exists()
-        else:
-            return False
+        return LikedSongsResolver.for_request(request).is_liked(obj.id)
 
     def get_url(self, obj):
         # request added to get complete "http://127.0.0.1:8000/api/songs/update/11"
         request = self.context.get("request")
         return obj.get_api_url(request=request)
 
+    def get_stream_url(self, obj):
+        request = self.context.get("request")
+        return obj.get_stream_url(request=request)
+
 
 class ChildSongSerializer(serializers.ModelSerializer):
     user_like = serializers.SerializerMethodField()
+    stream_url = serializers.SerializerMethodField()
+    photo_main = RenditionImageField()
+    photo_main_srcset = RenditionSrcsetField(source='photo_main')
 
     class Meta:
         model = Songs
-        fields = ['id', 'slug', 'song_title', 'description', 'total_likes', 'photo_main', 'audio_file',
+        fields = ['id', 'slug', 'song_title', 'description', 'total_likes', 'photo_main', 'photo_main_srcset',
+                  'audio_file', 'stream_url',
                   'username', 'username_slug', 'get_subscription_badge', 'exclusive_content', 'user_like']
+        list_serializer_class = LikedSongsListSerializer
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return [obj.id]
 
     def get_user_like(self, obj):
         request = self.context.get("request")
-        if request.user.id:
-            return Songs.objects.filter(id=obj.id, users_like=request.user.id).exists()
-        else:
-            return False
+        return LikedSongsResolver.for_request(request).is_liked(obj.id)
+
+    def get_stream_url(self, obj):
+        request = self.context.get("request")
+        return obj.get_stream_url(request=request)
 
 
 class AddPlayListSerializer(serializers.ModelSerializer):
@@ -130,12 +196,19 @@ class UserPlayListSerializer(serializers.ModelSerializer):
     class Meta:
         model = PlayList
         fields = ['id', 'slug', 'name', 'beats', 'is_private', 'beats_count', 'cover_pic']
+        list_serializer_class = LikedSongsListSerializer
+
+    @staticmethod
+    def liked_song_ids(obj):
+        # cheap when the view prefetches `beats`, which it needs for the nested songs anyway
+        return [beat.id for beat in obj.beats.all()]
 
     def get_cover_pic(self, obj):
         request = self.context.get("request")
         playlist_cover = obj.beats.first()
         if playlist_cover:
-            return request.build_absolute_uri(playlist_cover.photo_main.url)
+            photo = playlist_cover.photo_main
+            return request.build_absolute_uri(photo.storage.url(rendition_for(photo, 'square')))
         else:
             return None
 
@@ -148,6 +221,11 @@ class CommentsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = ['id', 'beats', 'body', 'username', 'profile_pic', 'get_subscription_badge']
+        list_serializer_class = LikedSongsListSerializer
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return [obj.beats_id]
 
     def get_username(self, obj):
         return obj.commenter.username
@@ -156,7 +234,8 @@ class CommentsSerializer(serializers.ModelSerializer):
     def get_profile_pic(self, obj):
         request = self.context.get("request")
         if request and obj.commenter.profile.avatar:
-            return request.build_absolute_uri(obj.commenter.profile.avatar.url)
+            avatar = obj.commenter.profile.avatar
+            return request.build_absolute_uri(avatar.storage.url(rendition_for(avatar, 'square')))
         else:
             return None
 
@@ -0,0 +1,104 @@
+import hashlib
+import mimetypes
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+# audio files are never rewritten in place, a replacement gets a new name and so a new ETag
+AUDIO_CACHE_SECONDS = 60 * 60 * 24 * 7
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single `bytes=` range, inclusive, or None to send the whole file.
+    Multi-range and malformed headers are ignored, as RFC 7233 allows.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def file_chunks(field_file, start, length):
+    with field_file.open('rb') as source:
+        source.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = source.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def audio_etag(field_file):
+    storage = field_file.storage
+    modified = storage.get_modified_time(field_file.name).timestamp()
+    key = '{}:{}:{}'.format(field_file.name, storage.size(field_file.name), modified)
+    return '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+
+
+def audio_response(request, field_file):
+    """
+    Serve `field_file` with ETag and Range support.
+
+    With AUDIO_STREAM_OFFLOAD set, Django only answers the conditional request and
+    hands the transfer (ranges included) to the front proxy; otherwise the bytes are
+    streamed from here, which is meant for development.
+    """
+    etag = audio_etag(field_file)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponse(status=304)
+    elif settings.AUDIO_STREAM_OFFLOAD == 'nginx':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.AUDIO_STREAM_ACCEL_PREFIX + field_file.name
+        # let nginx pick the content type from the file
+        del response['Content-Type']
+    elif settings.AUDIO_STREAM_OFFLOAD == 'apache':
+        response = HttpResponse(content_type=mimetypes.guess_type(field_file.name)[0])
+        response['X-Sendfile'] = field_file.path
+    else:
+        response = _stream_in_process(request, field_file)
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'public, max-age={}'.format(AUDIO_CACHE_SECONDS)
+    return response
+
+
+def _stream_in_process(request, field_file):
+    size = field_file.size
+    content_type = mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+
+    if byte_range is None:
+        response = StreamingHttpResponse(file_chunks(field_file, 0, size), content_type=content_type)
+        response['Content-Length'] = str(size)
+        return response
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(file_chunks(field_file, start, length), status=206, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+    return response
@@ -0,0 +1,119 @@
+from __future__ import absolute_import, unicode_literals
+
+from celery import chain, shared_task
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from notifications.signals import notify
+
+from feeds.utils import create_action
+
+from .compression import render_model_image
+from .ingest import extract_metadata, fail_ingest, publish
+from .likes import LIKE_ACTION_VERB, flush_pending_likes, reconcile_like_counts
+from .models import Songs, update_search_vector
+from .plays import flush_pending_plays
+from . import related
+from .waveform import build_waveforms, WaveformError
+
+
+# write-behind for the play counter, scheduled in CELERY_BEAT_SCHEDULE
+@shared_task
+def flush_song_plays():
+    return flush_pending_plays()
+
+
+# related tracks: incremental for songs whose tags or likes changed, full rebuild nightly
+@shared_task
+def rebuild_related_songs(full=False):
+    return related.rebuild_related_songs(full)
+
+
+# the search documents of an artist's songs, after a username change
+@shared_task
+def reindex_user_songs(user_id, batch_size=500):
+    song_ids = list(Songs.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(song_ids), batch_size):
+        update_search_vector(song_ids[start:start + batch_size])
+    return len(song_ids)
+
+
+# write-behind for the like store, scheduled in CELERY_BEAT_SCHEDULE
+@shared_task
+def flush_song_likes():
+    created = flush_pending_likes()
+    if created:
+        send_like_notifications.delay(created)
+    return len(created)
+
+
+@shared_task
+def send_like_notifications(pairs):
+    """Feed action and notification for every newly persisted like, once per like."""
+    # a like taken back (or a pair repeated) since the flush gets nothing
+    held = set(Songs.users_like.through.objects.filter(
+        songs_id__in={song_id for song_id, _ in pairs}, user_id__in={user_id for _, user_id in pairs})
+        .values_list('songs_id', 'user_id'))
+    pairs = sorted({tuple(pair) for pair in pairs} & held)
+    songs = Songs.objects.select_related('user').in_bulk({song_id for song_id, _ in pairs})
+    users = get_user_model().objects.in_bulk({user_id for _, user_id in pairs})
+    for song_id, user_id in pairs:
+        song, user = songs.get(song_id), users.get(user_id)
+        if song is None or user is None:
+            continue
+        create_action(user, LIKE_ACTION_VERB, song, 2, buffered=True)
+        notify.send(user, recipient=song.user, verb='liked', target=song)
+    return len(pairs)
+
+
+# repairs Songs.total_likes drift left by failed or concurrent counter updates
+@shared_task
+def reconcile_song_likes():
+    return reconcile_like_counts()
+
+
+# upload ingest, see beats.ingest; a crash in either stage must not leave the song PROCESSING
+@shared_task
+def extract_song_metadata(song_id, reserved=0, pending_audio=None):
+    try:
+        return extract_metadata(song_id, reserved, pending_audio)
+    except Exception:
+        fail_ingest(song_id, reserved, pending_audio)
+        raise
+
+
+@shared_task
+def publish_song(song_id, pending_audio=None):
+    if pending_audio is not None:
+        # a replacement never took the song off READY, there is nothing to publish
+        return True
+    try:
+        return publish(song_id)
+    except Exception:
+        fail_ingest(song_id, pending_audio=pending_audio)
+        raise
+
+
+@shared_task
+def compute_song_waveform(song_id):
+    try:
+        return build_waveforms(song_id)
+    except WaveformError:
+        # the song itself is fine, clients fall back to a flat waveform
+        return False
+
+
+# resized webp/jpeg/avif copies of uploaded images, see beats.compression.watch_image_field
+@shared_task
+def build_image_renditions(app_label, model_name, pk, field_name, kind):
+    return render_model_image(app_label, model_name, pk, field_name, kind)
+
+
+def start_song_ingest(song_id, reserved=0, pending_audio=None):
+    """
+    Run the ingest stages once the upload is committed. `reserved` is the quota taken at
+    request time; `pending_audio` is the stored name of a replacement for the song's audio.
+    """
+    pipeline = chain(extract_song_metadata.si(song_id, reserved, pending_audio),
+                     publish_song.si(song_id, pending_audio),
+                     compute_song_waveform.si(song_id))
+    transaction.on_commit(pipeline.delay)
@@ -1,3 +1,471 @@
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+from django.http import HttpResponse
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from accounts.models import User
+from common.utils import redis_lock
+from subscriptions.models import UserMembership
+
+from . import compression, ingest, likes, plays, related, tasks
+from .models import RELATED_DIRTY_KEY, USER_LIKES_KEY, RelatedSong, Songs, published, song_sampler, visible_songs
+from .views import CursorResultsSetPagination, SongFilter
+
+
+def make_user(username, volume_remaining=600):
+    user = User.objects.create_user(email='{}@example.com'.format(username), username=username, password='secret')
+    UserMembership.objects.update_or_create(user=user, defaults={'volume_remaining': volume_remaining})
+    return user
+
+
+def make_song(user, **fields):
+    fields.setdefault('processing_status', Songs.ProcessingStatus.READY)
+    return Songs.objects.create(user=user, song_title='Night drive', description='lofi',
+                                photo_main='photos/cover.jpg', audio_file='songs/night-drive.mp3', **fields)
+
+
+def volume_remaining(user):
+    return UserMembership.objects.get(user=user).volume_remaining
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.user = make_user('ingest')
+        self.storage = mock.patch('django.core.files.storage.FileSystemStorage.delete').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_reservation_is_refused_once_the_quota_is_spent(self):
+        self.assertTrue(ingest.reserve_quota(self.user.id, 400))
+        self.assertTrue(ingest.reserve_quota(self.user.id, 400))
+        self.assertFalse(ingest.reserve_quota(self.user.id, 10))
+        self.assertEqual(volume_remaining(self.user), -200)
+
+    def test_reservation_is_estimated_from_the_upload_size(self):
+        upload = mock.Mock(size=ingest.RESERVE_BYTES_PER_SECOND * 180 + 1)
+        self.assertEqual(ingest.estimate_duration(upload), 181)
+        self.assertEqual(ingest.estimate_duration(mock.Mock(size=0)), 1)
+
+    def test_new_upload_settles_the_reservation(self):
+        ingest.reserve_quota(self.user.id, 120)
+        song = make_song(self.user, duration_seconds=120, processing_status=Songs.ProcessingStatus.PROCESSING)
+        with mock.patch.object(ingest, 'read_duration', return_value=100):
+            self.assertTrue(ingest.extract_metadata(song.id, 120))
+            # a retried stage finds nothing left to settle
+            self.assertTrue(ingest.extract_metadata(song.id, 120))
+        song.refresh_from_db()
+        self.assertEqual(song.duration_seconds, 100)
+        self.assertEqual(volume_remaining(self.user), 500)
+
+    def test_invalid_new_upload_is_deleted_and_refunded(self):
+        ingest.reserve_quota(self.user.id, 120)
+        song = make_song(self.user, duration_seconds=120, processing_status=Songs.ProcessingStatus.PROCESSING)
+        with mock.patch.object(ingest, 'read_duration', side_effect=ingest.InvalidAudioError('truncated')):
+            self.assertFalse(ingest.extract_metadata(song.id, 120))
+        self.assertFalse(Songs.objects.filter(id=song.id).exists())
+        self.assertEqual(volume_remaining(self.user), 600)
+        self.assertEqual(ingest.ingest_status(song.id, self.user)['message'], 'truncated')
+
+    def test_invalid_replacement_keeps_the_song(self):
+        song = make_song(self.user, duration_seconds=100, pending_audio='songs/replacement.mp3')
+        ingest.reserve_quota(self.user.id, 50)
+        with mock.patch.object(ingest, 'read_duration', side_effect=ingest.InvalidAudioError('truncated')):
+            self.assertFalse(ingest.extract_metadata(song.id, 50, 'songs/replacement.mp3'))
+        song.refresh_from_db()
+        self.assertEqual(song.processing_status, Songs.ProcessingStatus.READY)
+        self.assertEqual(song.audio_file.name, 'songs/night-drive.mp3')
+        self.assertEqual(song.pending_audio, '')
+        self.assertEqual(song.duration_seconds, 100)
+        self.assertEqual(volume_remaining(self.user), 600)
+        self.storage.assert_called_once_with('songs/replacement.mp3')
+
+    def test_replacement_is_swapped_in_and_the_old_file_removed(self):
+        song = make_song(self.user, duration_seconds=100, pending_audio='songs/replacement.mp3')
+        ingest.reserve_quota(self.user.id, 50)
+        self.assertTrue(published(Songs.objects.filter(id=song.id)).exists())
+        with mock.patch.object(ingest, 'read_duration', return_value=130):
+            self.assertTrue(ingest.extract_metadata(song.id, 50, 'songs/replacement.mp3'))
+            # a retried stage finds the file already in place
+            self.assertTrue(ingest.extract_metadata(song.id, 50, 'songs/replacement.mp3'))
+        song.refresh_from_db()
+        self.assertEqual(song.audio_file.name, 'songs/replacement.mp3')
+        self.assertEqual(song.pending_audio, '')
+        self.assertEqual(song.duration_seconds, 130)
+        self.assertEqual(volume_remaining(self.user), 570)
+        self.storage.assert_called_once_with('songs/night-drive.mp3')
+
+    def test_crashed_new_upload_is_marked_failed(self):
+        ingest.reserve_quota(self.user.id, 120)
+        song = make_song(self.user, duration_seconds=120, processing_status=Songs.ProcessingStatus.PROCESSING)
+        self.assertTrue(ingest.fail_ingest(song.id, 120))
+        self.assertFalse(ingest.fail_ingest(song.id, 120))
+        song.refresh_from_db()
+        self.assertEqual(song.processing_status, Songs.ProcessingStatus.FAILED)
+        self.assertEqual(volume_remaining(self.user), 600)
+
+    def test_crash_after_the_swap_keeps_the_new_audio(self):
+        song = make_song(self.user, duration_seconds=130, audio_file='songs/replacement.mp3')
+        self.assertFalse(ingest.fail_ingest(song.id, 50, 'songs/replacement.mp3'))
+        song.refresh_from_db()
+        self.assertEqual(song.audio_file.name, 'songs/replacement.mp3')
+        self.storage.assert_not_called()
+
+    def test_superseded_replacement_is_dropped_and_refunded(self):
+        song = make_song(self.user, duration_seconds=100, pending_audio='songs/second.mp3')
+        ingest.reserve_quota(self.user.id, 50)
+        with mock.patch.object(ingest, 'read_duration', return_value=150):
+            self.assertFalse(ingest.extract_metadata(song.id, 50, 'songs/first.mp3'))
+        song.refresh_from_db()
+        self.assertEqual(song.audio_file.name, 'songs/night-drive.mp3')
+        self.assertEqual(song.pending_audio, 'songs/second.mp3')
+        self.assertEqual(volume_remaining(self.user), 600)
+        self.storage.assert_called_once_with('songs/first.mp3')
+
+    def test_unpublished_songs_are_only_visible_to_their_owner(self):
+        song = make_song(self.user, processing_status=Songs.ProcessingStatus.PROCESSING)
+        other = make_user('listener')
+        self.assertFalse(published(Songs.objects.all()).filter(id=song.id).exists())
+        self.assertFalse(visible_songs(other).filter(id=song.id).exists())
+        self.assertTrue(visible_songs(self.user).filter(id=song.id).exists())
+
+
+class SongStreamTests(TestCase):
+    def setUp(self):
+        self.owner = make_user('uploader')
+        self.listener = make_user('listener')
+
+    def stream(self, song, user=None):
+        if user is not None:
+            self.client.force_login(user)
+        with mock.patch('beats.views.audio_response', return_value=HttpResponse(b'audio')):
+            return self.client.get(reverse('beat-stream', args=[song.id]))
+
+    def test_processing_songs_are_hidden(self):
+        song = make_song(self.owner, processing_status=Songs.ProcessingStatus.PROCESSING)
+        self.assertEqual(self.stream(song, self.listener).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.stream(song, self.owner).status_code, 200)
+
+    def test_exclusive_songs_need_a_subscription_badge(self):
+        song = make_song(self.owner, exclusive_content=Songs.ContentTypeChoices.EXCLUSIVE)
+        self.assertEqual(self.stream(song).status_code, 403)
+        self.assertEqual(self.stream(song, self.listener).status_code, 403)
+        UserMembership.objects.filter(user=self.listener).update(subscription_badge=True)
+        self.assertEqual(self.stream(song, self.listener).status_code, 200)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        user = make_user('pager')
+        self.songs = [make_song(user) for _ in range(5)]
+        # three songs share a timestamp, so the pages have to break ties on id
+        Songs.objects.filter(id__in=[song.id for song in self.songs[1:4]]).update(created_at=timezone.now())
+
+    def page(self, queryset, **params):
+        paginator = CursorResultsSetPagination()
+        request = Request(APIRequestFactory().get('/', dict(page_size=2, **params)))
+        rows = paginator.paginate_queryset(queryset, request)
+        return paginator, [song.id for song in rows]
+
+    def test_pages_cover_every_row_once_across_ties(self):
+        queryset = Songs.objects.order_by('-created_at')
+        paginator, seen = self.page(queryset)
+        while paginator.get_next_link():
+            paginator, rows = self.page(queryset, cursor=paginator.get_next_link())
+            seen += rows
+        expected = list(queryset.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_previous_link_returns_the_same_page(self):
+        queryset = Songs.objects.order_by('-created_at')
+        first, first_rows = self.page(queryset)
+        second, _ = self.page(queryset, cursor=first.get_next_link())
+        _, rows = self.page(queryset, cursor=second.get_previous_link())
+        self.assertEqual(rows, first_rows)
+
+    def test_oldest_first_lists_keep_page_numbers(self):
+        queryset = Songs.objects.order_by('created_at', 'id')
+        paginator, rows = self.page(queryset)
+        self.assertIsNone(paginator.cursor_field)
+        self.assertEqual(rows, list(queryset.values_list('id', flat=True)[:2]))
+
+
+class SongSearchTests(TestCase):
+    def setUp(self):
+        self.artist = make_user('nightowl')
+        self.song = make_song(self.artist, song_title='Moonlight sonata')
+
+    def search(self, term):
+        request = Request(APIRequestFactory().get('/', {'search': term}))
+        return list(SongFilter().filter_queryset(request, Songs.objects.all(), None).values_list('id', flat=True))
+
+    def test_matches_by_document_title_typo_and_artist(self):
+        self.assertEqual(self.search('moonlight'), [self.song.id])
+        self.assertEqual(self.search('Moonlite sonata'), [self.song.id])
+        self.assertEqual(self.search('nightowel'), [self.song.id])
+        self.assertEqual(self.search('symphony'), [])
+
+    def test_username_change_reindexes_the_artist_songs(self):
+        with mock.patch.object(tasks.reindex_user_songs, 'delay', side_effect=tasks.reindex_user_songs) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.artist.save()
+            delay.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.artist.username = 'daybreak'
+                self.artist.save()
+        delay.assert_called_once_with(self.artist.id)
+        self.assertTrue(Songs.objects.filter(id=self.song.id, search_vector='daybreak').exists())
+
+
+class SongSamplerTests(TestCase):
+    def setUp(self):
+        keys = plays.redis_cache.keys('random:songs*')
+        if keys:
+            plays.redis_cache.delete(*keys)
+        self.song = make_song(make_user('sampled'), genre='trap')
+
+    def test_evicted_pool_is_rebuilt(self):
+        self.assertEqual(song_sampler.sample(5, genre='trap'), [self.song.id])
+        plays.redis_cache.delete(song_sampler.pool_key(genre='trap'))
+        self.assertEqual(song_sampler.sample(5, genre='trap'), [self.song.id])
+
+    def test_reindex_moves_the_song_between_the_pools_it_was_in(self):
+        song_sampler.sample(5, genre='trap')
+        song_sampler.sample(5, genre='house')
+        self.song.genre = 'house'
+        self.song.save()
+        self.assertEqual(song_sampler.sample(5, genre='trap'), [])
+        self.assertEqual(song_sampler.sample(5, genre='house'), [self.song.id])
+        self.assertEqual(plays.redis_cache.smembers(song_sampler.member_key(self.song.id)),
+                         {song_sampler.pool_key(genre='house').encode()})
+
+    def test_random_list_keeps_the_sampled_order(self):
+        newer = make_song(self.song.user)
+        with mock.patch.object(song_sampler, 'sample', return_value=[self.song.id, newer.id]):
+            response = self.client.get(reverse('random-song-list'))
+        self.assertEqual([row['id'] for row in response.data['random_song_list']], [self.song.id, newer.id])
+
+    def test_deleted_song_leaves_every_pool(self):
+        song_sampler.sample(5)
+        song_sampler.sample(5, genre='trap')
+        self.song.delete()
+        self.assertEqual(song_sampler.sample(5), [])
+        self.assertEqual(song_sampler.sample(5, genre='trap'), [])
+        self.assertFalse(plays.redis_cache.exists(song_sampler.member_key(self.song.id)))
+
+
+class RenditionTests(TestCase):
+    def photo(self, width, height, orientation=None, format='JPEG'):
+        exif = Image.Exif()
+        if orientation:
+            exif[compression.EXIF_ORIENTATION] = orientation
+        data = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(data, format, exif=exif)
+        data.seek(0)
+        return Image.open(data)
+
+    def test_rotated_photo_is_reduced_by_its_upright_size(self):
+        # stored 1800x600, shown 600x1800: reducing by the stored size would leave 150x450
+        with mock.patch.object(Image.Image, 'reduce', autospec=True, side_effect=Image.Image.reduce) as reduce:
+            rendition = compression._downscale(self.photo(1800, 600, orientation=6), (450, 150))
+        reduce.assert_not_called()
+        self.assertEqual(rendition.size, (450, 150))
+
+    def test_large_photo_is_reduced_before_the_resample(self):
+        # png has no draft mode, so reduce() does the shrinking
+        with mock.patch.object(Image.Image, 'reduce', autospec=True, side_effect=Image.Image.reduce) as reduce:
+            rendition = compression._downscale(self.photo(2000, 2000, format='PNG'), (250, 250))
+        self.assertEqual(rendition.size, (250, 250))
+        self.assertGreaterEqual(reduce.call_args[0][1], 2)
+
+
+class RelatedSongTests(TestCase):
+    def setUp(self):
+        user = make_user('related')
+        self.songs = [make_song(user) for _ in range(3)]
+        for song in self.songs:
+            song.tags.add('lofi')
+        # the tag signal marks the songs dirty; start every test from a clean set
+        related.redis_cache.delete(RELATED_DIRTY_KEY, related.RELATED_BUILDING_KEY)
+
+    def neighbours(self, song):
+        return set(RelatedSong.objects.filter(song=song).values_list('related_id', flat=True))
+
+    def test_failed_build_keeps_the_dirty_songs(self):
+        related.redis_cache.sadd(RELATED_DIRTY_KEY, self.songs[0].id)
+        with mock.patch.object(related, 'build_related_songs', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                related.rebuild_related_songs()
+        related.redis_cache.sadd(RELATED_DIRTY_KEY, self.songs[1].id)
+        self.assertEqual(related.rebuild_related_songs(), 2)
+        self.assertEqual(self.neighbours(self.songs[0]), {self.songs[1].id, self.songs[2].id})
+        self.assertFalse(related.redis_cache.exists(RELATED_DIRTY_KEY, related.RELATED_BUILDING_KEY))
+
+    def test_overlapping_run_does_nothing(self):
+        related.redis_cache.sadd(RELATED_DIRTY_KEY, self.songs[0].id)
+        with redis_lock('related:build', 60):
+            self.assertEqual(related.rebuild_related_songs(), 0)
+        self.assertEqual(related.rebuild_related_songs(), 1)
+
+    def test_full_rebuild_runs_in_batches(self):
+        with mock.patch.object(related, 'FULL_BATCH_SIZE', 2):
+            self.assertEqual(related.rebuild_related_songs(full=True), 3)
+        for song in self.songs:
+            self.assertEqual(self.neighbours(song), {other.id for other in self.songs} - {song.id})
+
+
+class PlayCounterTests(TestCase):
+    def setUp(self):
+        plays.redis_cache.delete(plays.PENDING_PLAYS_KEY, plays.FLUSHING_PLAYS_KEY, plays.FLUSH_ID_KEY,
+                                 plays.PLAYS_RANKING_KEY, *plays.redis_cache.keys('random:songs*'))
+        self.song = make_song(make_user('player'))
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return plays.flush_pending_plays()
+
+    def test_unknown_songs_are_not_counted(self):
+        self.assertFalse(plays.record_play(self.song.id + 1000))
+        self.assertIsNone(plays.redis_cache.zscore(plays.PLAYS_RANKING_KEY, self.song.id + 1000))
+
+    def test_plays_are_counted_without_a_database_read(self):
+        plays.record_play(self.song.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(plays.record_play(self.song.id))
+        self.assertEqual(plays.redis_cache.zscore(plays.PLAYS_RANKING_KEY, self.song.id), 2)
+
+    def test_lost_song_pool_is_rebuilt(self):
+        plays.redis_cache.delete(song_sampler.pool_key())
+        self.assertTrue(plays.record_play(self.song.id))
+        unpublished = make_song(self.song.user, processing_status=Songs.ProcessingStatus.PROCESSING)
+        self.assertFalse(plays.record_play(unpublished.id))
+
+    def test_batch_applied_before_a_crash_is_not_counted_again(self):
+        plays.record_play(self.song.id)
+        plays.record_play(self.song.id)
+        # the first run commits, then dies before clearing the batch
+        with mock.patch.object(plays, '_finish_flush'):
+            self.assertEqual(self.flush(), 1)
+        plays.record_play(self.song.id)
+        self.assertEqual(self.flush(), 0)
+        self.assertEqual(self.flush(), 1)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.plays, 3)
+
+    def test_overlapping_flush_does_nothing(self):
+        plays.record_play(self.song.id)
+        with redis_lock('plays:flush', 60):
+            self.assertEqual(self.flush(), 0)
+        self.assertEqual(self.flush(), 1)
+
+
+class LikeStoreTests(TestCase):
+    def setUp(self):
+        likes.redis_cache.delete(likes.PENDING_LIKES_KEY, likes.FLUSHING_LIKES_KEY)
+        self.song = make_song(make_user('artist'))
+        self.fan = make_user('fan')
+        likes.redis_cache.delete(USER_LIKES_KEY.format(self.fan.id))
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return likes.flush_pending_likes()
+
+    def test_like_set_lost_before_the_toggle_is_rebuilt(self):
+        self.song.users_like.add(self.fan)
+        build = likes._user_likes_key
+        builds = []
+
+        def evict_first_build(user_id):
+            key = build(user_id)
+            if not builds:
+                likes.redis_cache.delete(key)
+            builds.append(key)
+            return key
+
+        with mock.patch.object(likes, '_user_likes_key', side_effect=evict_first_build):
+            self.assertFalse(likes.toggle_like(self.song.id, self.fan.id))
+        self.assertGreater(likes.redis_cache.ttl(USER_LIKES_KEY.format(self.fan.id)), 0)
+
+    def test_like_set_built_across_a_flush_is_read_again(self):
+        likes.toggle_like(self.song.id, self.fan.id)
+        likes.redis_cache.delete(USER_LIKES_KEY.format(self.fan.id))
+        stored = likes._stored_likes
+        reads = []
+
+        def flush_during_first_read(user_id):
+            reads.append(user_id)
+            if len(reads) == 1:
+                # the table is read before the flush commits, the hashes after it cleared them
+                self.flush()
+                return set()
+            return stored(user_id)
+
+        with mock.patch.object(likes, '_stored_likes', side_effect=flush_during_first_read):
+            self.assertEqual(likes.liked_among(self.fan.id, [self.song.id]), {self.song.id})
+        self.assertEqual(len(reads), 2)
+
+    def test_like_set_built_elsewhere_is_kept(self):
+        key = USER_LIKES_KEY.format(self.fan.id)
+        stored = likes._stored_likes
+
+        def built_by_another_request(user_id):
+            likes.redis_cache.sadd(key, likes.BUILT_MARKER, self.song.id)
+            return stored(user_id)
+
+        with mock.patch.object(likes, '_stored_likes', side_effect=built_by_another_request):
+            self.assertEqual(likes._user_likes_key(self.fan.id), key)
+        self.assertEqual(likes.redis_cache.smembers(key), {b'0', str(self.song.id).encode()})
+        self.assertEqual(likes.redis_cache.keys(key + ':building:*'), [])
+
+    def test_retried_flush_counts_each_like_once(self):
+        likes.toggle_like(self.song.id, self.fan.id)
+        with mock.patch.object(likes, '_finish_flush'):
+            self.assertEqual(self.flush(), [(self.song.id, self.fan.id)])
+        self.assertEqual(self.flush(), [])
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.total_likes, 1)
+
+    def test_likes_of_deleted_users_are_dropped(self):
+        likes.toggle_like(self.song.id, self.fan.id)
+        self.fan.delete()
+        self.assertEqual(self.flush(), [])
+        self.assertFalse(likes.redis_cache.exists(likes.FLUSHING_LIKES_KEY))
+
+    def test_overlapping_flush_does_nothing(self):
+        likes.toggle_like(self.song.id, self.fan.id)
+        with redis_lock('likes:flush', 60):
+            self.assertEqual(self.flush(), [])
+        self.assertEqual(len(self.flush()), 1)
+
+
+class LikeNotificationTests(TestCase):
+    def setUp(self):
+        likes.redis_cache.delete(likes.PENDING_LIKES_KEY, likes.FLUSHING_LIKES_KEY)
+        self.song = make_song(make_user('artist'))
+        self.fan = make_user('fan')
+        likes.redis_cache.delete(USER_LIKES_KEY.format(self.fan.id))
+
+    def test_like_that_already_exists_is_not_announced_again(self):
+        likes.toggle_like(self.song.id, self.fan.id)
+        # persisted by another path before the flush runs
+        self.song.users_like.through.objects.create(songs_id=self.song.id, user_id=self.fan.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(likes.flush_pending_likes(), [])
+
+    def test_each_like_is_announced_once(self):
+        self.song.users_like.through.objects.create(songs_id=self.song.id, user_id=self.fan.id)
+        pair = [self.song.id, self.fan.id]
+        with mock.patch('beats.tasks.create_action') as create_action, mock.patch('beats.tasks.notify') as notify:
+            self.assertEqual(tasks.send_like_notifications([pair, pair]), 1)
+        self.assertEqual(create_action.call_count, 1)
+        self.assertEqual(notify.send.call_count, 1)
 
-# Create your tests here.
+    def test_like_taken_back_before_the_notification_is_not_announced(self):
+        with mock.patch('beats.tasks.notify') as notify:
+            self.assertEqual(tasks.send_like_notifications([[self.song.id, self.fan.id]]), 0)
+        notify.send.assert_not_called()
@@ -2,7 +2,8 @@ from django.urls import path
 from .views import SongCreate, SongListView, SongUpdate, BeatsLikeView, SongPlayCounterApiView, \
     BeatsDetailApiView, PlayListBeatAddedView, ChildPlaylistView, BeatsSearchEngine, \
     CommentApiView, ChillListApiView, BeatsUserLikesList, SongsRankingPlaysApiView, RandomSongList,\
-    RelatedBeatsApiView, ExclusiveSongListView
+    RelatedBeatsApiView, ExclusiveSongListView, SongIngestStatusApiView, SongWaveformApiView, \
+    SongStreamView
 
 urlpatterns = [
     # change from songs to beats
@@ -10,10 +11,13 @@ urlpatterns = [
     path('beats/tags/<str:tags>/', ChillListApiView.as_view(), name='chills-beats'),
     path('beats/comments/<int:beat_id>/', CommentApiView.as_view(), name="comments-detail"),
     path('beats/upload/', SongCreate.as_view(), name='upload-api'),
+    path('beats/upload/<int:beat_id>/status/', SongIngestStatusApiView.as_view(), name='upload-status'),
     path('beats/', SongListView.as_view(), name='songs-api'),
     path('beats/search/', BeatsSearchEngine.as_view(), name='beats-search-engine'),
     path('beats/create/playlist/', ChildPlaylistView.as_view(), name='create-playlist'),
     path('beats/<int:beat_id>/likes/', BeatsLikeView.as_view(), name="beat-likes"),
+    path('beats/<int:beat_id>/stream/', SongStreamView.as_view(), name="beat-stream"),
+    path('beats/<int:beat_id>/waveform/<int:resolution>/', SongWaveformApiView.as_view(), name="beat-waveform"),
 
     path('beats/<str:username_slug>/<str:slug>/', BeatsDetailApiView.as_view(), name="beat-detail"),
     path('beats/users/<str:slug>/<int:beat_id>/added/', PlayListBeatAddedView.as_view(), name="beat-added-playlist"),
@@ -1,25 +0,0 @@
-from django.utils.text import slugify
-
-
-def get_unique_slug(id, title, obj):
-    slug = slugify(title.replace('ı', 'i'))
-    unique_slug = slug
-    counter = 1
-    while obj.filter(slug=unique_slug).exists():
-        if obj.filter(slug=unique_slug).values('id')[0]['id'] == id:
-            break
-        unique_slug = '{}-{}'.format(slug, counter)
-        counter += 1
-    return unique_slug
-
-
-def get_username_unique_slug(id, title, obj):
-    slug = slugify(title.replace('ı', 'i'))
-    unique_slug = slug
-    counter = 1
-    while obj.filter(username_slug=unique_slug).exists():
-        if obj.filter(username_slug=unique_slug).values('id')[0]['id'] == id:
-            break
-        unique_slug = '{}-{}'.format(slug, counter)
-        counter += 1
-    return unique_slug
\ No newline at end of file
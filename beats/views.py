@@ -1,10 +1,18 @@
 # Create your views here.
 
+import json
+from collections import OrderedDict
+
 import redis
 from django.conf import settings
-from django.db.models import Q
-from django.contrib.postgres.search import TrigramSimilarity
+from django.contrib.auth import get_user_model
+from django.http import Http404, HttpResponse
+from django.db.models import F, Q, QuerySet
+from django.db.models.functions import Greatest
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
@@ -13,6 +21,7 @@ from rest_framework import status, response, filters, generics
 from rest_framework import (
     views
 )
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.decorators import permission_classes, api_view, parser_classes
 from rest_framework.filters import SearchFilter
 from rest_framework.generics import ListAPIView, RetrieveAPIView
@@ -25,10 +34,18 @@ from rest_framework.response import Response
 from taggit.models import Tag
 
 from accounts.permission import IsOwnerOrReadOnly
+from accounts.models import User, with_listing_data
 from accounts.serializers import ChildFullUserSerializer
 from feeds.utils import create_action, delete_action
-from .models import Songs, PlayList, Comment
-from .permissions import ExclusiveContentPermissionMixin, ExclusiveContentPermission
+from .models import Songs, PlayList, Comment, RelatedSong, SongWaveform, SEARCH_CONFIG, song_sampler, published, \
+    visible_songs
+from .ingest import estimate_duration, ingest_status, reserve_quota
+from .likes import toggle_like
+from .streaming import audio_response
+from .waveform import WAVEFORM_RESOLUTIONS
+from .plays import record_play, trending_song_ids, TRENDING_WINDOW_CHOICES
+from .permissions import ExclusiveContentPermissionMixin, ExclusiveContentPermission, can_play
+from .tasks import start_song_ingest
 from .serializers import SongSerializer, AddPlayListSerializer, BeatsUploadSerializer, CommentsSerializer, \
     ChildSongSerializer
 
@@ -37,19 +54,108 @@ redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
                                 port=settings.REDIS_PORT,
                                 db=settings.REDIS_DB)
 
+# waveforms only change when the audio is replaced, and then the ETag changes with them
+WAVEFORM_CACHE_SECONDS = 60 * 60 * 24 * 30
+
 
 class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Page-number pages by default. With `?cursor=` (empty for the first page) or
+    `mode = 'cursor'` on a subclass, querysets ordered newest first are paged by
+    keyset on (created, id) instead: no COUNT, no OFFSET, `next`/`previous` are
+    opaque tokens and `count` is null.
+    """
     page_size = 8
     page_size_query_param = 'page_size'
     max_page_size = 1000
+    cursor_query_param = 'cursor'
+    mode = 'page'
+    # timestamp fields a keyset page can be ordered on, in order of preference
+    cursor_fields = ('created_at', 'created')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_field = self.get_cursor_field(queryset, request)
+        if self.cursor_field is None:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_cursor(queryset, request)
+
+    def get_cursor_field(self, queryset, request):
+        wanted = self.cursor_query_param in request.query_params or (
+                self.mode == 'cursor' and self.page_query_param not in request.query_params)
+        if not wanted or not isinstance(queryset, QuerySet):
+            return None
+        field_names = {field.name for field in queryset.model._meta.get_fields()}
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        for name in self.cursor_fields:
+            # keyset pages run newest first, so an oldest-first list would come back reversed
+            if name in field_names and (not ordering or str(ordering[0]) == '-' + name):
+                return name
+        # ranked, oldest-first or otherwise ordered lists keep page numbers
+        return None
+
+    def paginate_cursor(self, queryset, request):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        position = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+        field = self.cursor_field
+        self.reverse = bool(position and position['r'])
+        if position:
+            value = parse_datetime(position['t'])
+            if self.reverse:
+                queryset = queryset.filter(Q(**{field + '__gt': value}) | Q(**{field: value, 'id__gt': position['i']}))
+            else:
+                queryset = queryset.filter(Q(**{field + '__lt': value}) | Q(**{field: value, 'id__lt': position['i']}))
+        ordering = (field, 'id') if self.reverse else ('-' + field, '-id')
+        rows = list(queryset.order_by(*ordering)[:self.page_size_value + 1])
+        has_more = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        if self.reverse:
+            rows.reverse()
+        # going back always leaves a next page, going forward past a cursor always leaves a previous one
+        self.has_next = has_more if not self.reverse else True
+        self.has_previous = has_more if self.reverse else position is not None
+        self.cursor_rows = rows
+        return rows
+
+    def encode_cursor(self, row, reverse):
+        position = {'t': getattr(row, self.cursor_field).isoformat(), 'i': row.id, 'r': int(reverse)}
+        return urlsafe_base64_encode(json.dumps(position, separators=(',', ':')).encode())
+
+    @staticmethod
+    def decode_cursor(token):
+        if not token:
+            return None
+        try:
+            position = json.loads(urlsafe_base64_decode(token))
+            return {'t': position['t'], 'i': int(position['i']), 'r': int(position.get('r', 0))}
+        except (ValueError, KeyError, TypeError):
+            raise NotFound('Invalid cursor')
+
+    def get_paginated_response(self, data):
+        if getattr(self, 'cursor_field', None) is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
 
     def get_next_link(self):
+        if getattr(self, 'cursor_field', None) is not None:
+            if not self.has_next or not self.cursor_rows:
+                return None
+            return self.encode_cursor(self.cursor_rows[-1], reverse=False)
         if not self.page.has_next():
             return None
         page_number = self.page.next_page_number()
         return page_number
 
     def get_previous_link(self):
+        if getattr(self, 'cursor_field', None) is not None:
+            if not self.has_previous or not self.cursor_rows:
+                return None
+            return self.encode_cursor(self.cursor_rows[0], reverse=True)
         if not self.page.has_previous():
             return None
         page_number = self.page.previous_page_number()
@@ -65,31 +171,59 @@ class StandardResultsSetPagination(PageNumberPagination):
         return self.get_paginated_response(serialized_page.data)
 
 
+class CursorResultsSetPagination(StandardResultsSetPagination):
+    """Keyset pages unless the client asks for `?page=`."""
+    mode = 'cursor'
+
+
 @permission_classes([AllowAny])
 class SongListView(ListAPIView):
     pagination_class = StandardResultsSetPagination
-    queryset = Songs.objects.select_related('user')
+    queryset = published(Songs.objects.select_related('user'))
     serializer_class = ChildSongSerializer
 
 
 # custom search filter
 class SongFilter(filters.BaseFilterBackend):
+    """
+    Full-text search over Songs.search_vector, with trigram matching on the title and
+    artist name to catch typos. Each condition is its own subquery: OR-ed together in
+    one WHERE across the user join, Postgres cannot use the GIN indexes and scans.
+    """
+    search_param = 'search'
+
     def filter_queryset(self, request, queryset, view):
-        queryset = Songs.objects.annotate(
-            similarity=TrigramSimilarity('song_title', request.GET.get["search"]),
-        ).filter(similarity__gt=0.1).order_by('-similarity')
-        return queryset
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        query = SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+        by_document = Songs.objects.filter(search_vector=query).values('id')
+        by_title = Songs.objects.filter(song_title__trigram_similar=term).values('id')
+        by_artist = get_user_model().objects.filter(username__trigram_similar=term).values('id')
+        return queryset.filter(
+            Q(id__in=by_document) | Q(id__in=by_title) | Q(user_id__in=by_artist)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=Greatest(TrigramSimilarity('song_title', term), TrigramSimilarity('user__username', term)),
+        ).order_by('-rank', '-similarity', '-created_at')
 
 
 # search
 @permission_classes([AllowAny])
 class BeatsSearchEngine(ListAPIView):
     pagination_class = StandardResultsSetPagination
-    queryset = Songs.objects.all()
+    queryset = published(Songs.objects.select_related('user'))
 
     serializer_class = SongSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
-    search_fields = ['song_title', 'description', 'tags__name', 'genre', 'user__username']
+    filter_backends = [DjangoFilterBackend, SongFilter]
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('search', openapi.IN_QUERY, description="words to search for in title, tags, artist, "
+                                                                  "genre and description",
+                          type=openapi.TYPE_STRING, required=False)
+    ])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
 
 @permission_classes([IsAuthenticated])
@@ -104,35 +238,49 @@ class SongCreate(views.APIView):
         serializer = BeatsUploadSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
 
-            if self.request.user.membership_plan.volume_remaining <= 0:
+            # the quota is reserved here from the upload's size, so parallel uploads cannot
+            # overdraw it; the ingest stages settle it against the real length
+            reserved = estimate_duration(serializer.validated_data['audio_file'])
+            if not reserve_quota(self.request.user.id, reserved):
 
                 content = {'status': False, 'message': {'limit_error': ["your free uploaded limit is finished"]},
                            'result': error_result}
                 return Response(content, status=status.HTTP_200_OK)
 
             else:
-                new_songs = serializer.save(user=self.request.user)
-                new_songs.save()
-                # update remaining limit of the user when user uploaded the songs.
-                # add this on next update
-                # remaining_limit = UserMembership.objects.filter(user=request.user).values('volume_remaining')
+                # only the raw upload is stored here; duration, validation and the feed action run
+                # in the beats.tasks ingest stages, poll SongIngestStatusApiView for the outcome
+                new_songs = serializer.save(user=self.request.user, duration_seconds=reserved,
+                                            processing_status=Songs.ProcessingStatus.PROCESSING)
+                start_song_ingest(new_songs.id, reserved)
                 output = "Successfully song uploaded"
                 content = {'status': True, 'message': output, 'result': serializer.data,
                            }
-                # feeds handling
-                create_action(request.user, 'posted a song', new_songs, verb_id=1)
                 return Response(content, status=status.HTTP_200_OK)
         content = {'status': False, 'message': serializer.errors, 'result': error_result}
         return Response(content, status=status.HTTP_200_OK)
 
 
+class SongIngestStatusApiView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Processing status of an uploaded song: processing, ready or failed.")
+    def get(self, request, beat_id, *args, **kwargs):
+        result = ingest_status(beat_id, request.user)
+        if result is None:
+            return Response({'status': False, 'message': "song not found", 'result': {}},
+                            status=status.HTTP_200_OK)
+        return Response({'status': True, 'message': "Success", 'result': result}, status=status.HTTP_200_OK)
+
+
 @permission_classes([AllowAny])
 class BeatsDetailView(RetrieveAPIView):
     lookup_field = 'slug'
     serializer_class = SongSerializer
 
     def get_queryset(self, *args, **kwargs):
-        return Songs.objects.all()
+        # the owner can open an upload that is still processing or failed
+        return visible_songs(self.request.user)
 
 
 # view for user song update,
@@ -151,7 +299,22 @@ class SongUpdate(RetrieveUpdateDestroyAPIView):
                                            partial=True, context={'request': request})  # set partial=True to
         # update a data partially
         if serializer.is_valid():
-            serializer.save()
+            if 'audio_file' in serializer.validated_data:
+                # a new audio file is stored aside and goes through the ingest stages, which swap it
+                # in once it has been read; the song keeps its current audio if it is rejected
+                upload = serializer.validated_data.pop('audio_file')
+                reserved = max(estimate_duration(upload) - instance.duration_seconds, 0)
+                if not reserve_quota(instance.user_id, reserved):
+                    content = {'status': False,
+                               'message': {'limit_error': ["your free uploaded limit is finished"]}, 'result': {}}
+                    return Response(content, status=status.HTTP_200_OK)
+                field = instance.audio_file.field
+                pending_audio = field.storage.save(field.generate_filename(instance, upload.name), upload)
+                # the song stays READY, and public, with its current audio until the swap
+                serializer.save(pending_audio=pending_audio)
+                start_song_ingest(instance.id, reserved, pending_audio)
+            else:
+                serializer.save()
             content = {'status': True, 'message': {"Successfully song updated"}, 'result': serializer.data}
             return Response(content, status=status.HTTP_200_OK)
         else:
@@ -185,24 +348,19 @@ class BeatsLikeView(views.APIView):
     )
 
     def post(self, request, beat_id, format=None):
-        beat = get_object_or_404(Songs, id=beat_id)
+        owner_id = Songs.objects.filter(id=beat_id).values_list('user_id', flat=True).first()
+        if owner_id is None:
+            raise Http404
 
-        if beat.user == request.user:
+        if owner_id == request.user.id:
             resp = {"error": "can_not_like_own_post"}
             return response.Response(resp, status=status.HTTP_200_OK)
 
         else:
-            if Songs.objects.filter(id=beat_id, users_like=request.user):
-                beat.users_like.remove(request.user)
-                # redis_cache.decr('beat:{}:likes'.format(beat.id))
-
+            # feed action and notification are sent by beats.tasks.flush_song_likes
+            if not toggle_like(beat_id, request.user.id):
                 resp = {"status": "unliked", "like": False}
             else:
-                beat.users_like.add(request.user)
-                create_action(request.user, 'like a song', beat, 2)
-                notify.send(request.user, recipient=beat.user, verb='liked', target=beat)
-                # redis_cache.incr('beat:{}:likes'.format(beat.id))
-                # redis_cache.zincrby('beats_ranking', 1, beat.id)
                 resp = {"status": "liked", "like": True}
 
             return response.Response(resp, status=status.HTTP_200_OK)
@@ -215,7 +373,7 @@ class ChildPlaylistView(views.APIView):
     # create_serializer_class = CreateInviteBrandSerializer
 
     def get(self, request, *args, **kwargs):
-        playlist = PlayList.objects.filter(owner=request.user)
+        playlist = PlayList.objects.filter(owner_id=request.user.id)
         resp_obj = dict(
             playlist=self.serializer_class(playlist, context={"request": request}, many=True).data,
 
@@ -290,7 +448,7 @@ class ChildPlaylistView(generics.GenericAPIView):
     # create_serializer_class = CreateInviteBrandSerializer
 
     def get(self, request, *args, **kwargs):
-        playlist = PlayList.objects.filter(owner=request.user)
+        playlist = PlayList.objects.filter(owner_id=request.user.id)
         resp_obj = dict(
             playlist=self.serializer_class(playlist, context={"request": request}, many=True).data,
 
@@ -363,7 +521,7 @@ class BeatsDetailApiView(views.APIView):
 
     @swagger_auto_schema(operation_description=" Get Beats Details By passing username_slug and beat_slug. \n\n")
     def get(self, request, slug, *args, **kwargs):
-        beats_detail = Songs.objects.filter(slug__iexact=slug).first()
+        beats_detail = visible_songs(request.user).filter(slug__iexact=slug).first()
         resp_obj = dict(
             beats_detail=self.serializer_class(beats_detail, context={"request": request}).data)
         return views.Response(resp_obj, status=status.HTTP_200_OK)
@@ -377,7 +535,7 @@ class ChillListApiView(views.APIView):
 
     @swagger_auto_schema(operation_description="pass tag value to fetch songs by tags. \n\n")
     def get(self, request, tags, *args, **kwargs):
-        object_list = Songs.objects.all()
+        object_list = published(Songs.objects.all())
         tag = get_object_or_404(Tag, name=tags)
         beats_list = object_list.filter(tags__in=[tag])
         page = self.pagination_class()
@@ -387,16 +545,13 @@ class ChillListApiView(views.APIView):
 
 class SongPlayCounterApiView(views.APIView):
     permission_classes = [AllowAny]
-    serializer_class = SongSerializer
 
     @swagger_auto_schema(auto_schema=None)
     def post(self, request, beat_id, *args, **kwargs):
-        beats_detail = get_object_or_404(Songs, id=beat_id)
-        redis_cache.incr('beat:{}:plays'.format(beats_detail.id))
-        redis_cache.zincrby('plays_ranking', 1, beats_detail.id)
+        # plays are buffered in redis and written to Songs.plays by the flush_song_plays task
         resp_obj = dict(
-            beats_detail=self.serializer_class(beats_detail, context={"request": request}).data,
-
+            status=record_play(beat_id),
+            beat_id=beat_id,
         )
         return views.Response(resp_obj, status=status.HTTP_200_OK)
 
@@ -410,13 +565,23 @@ class SongsRankingPlaysApiView(views.APIView):
     permission_classes = [AllowAny]
     serializer_class = SongSerializer
 
+    @swagger_auto_schema(
+        operation_description="Most played songs. Optional `window`: hour, day, week or all (default).",
+        manual_parameters=[
+            openapi.Parameter('window', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              enum=list(TRENDING_WINDOW_CHOICES), required=False)
+        ])
     def get(self, request, *args, **kwargs):
-        # get songs ranking dictionary
-        plays_ranking = redis_cache.zrange('plays_ranking', 0, -1, desc=True)[:15]
-        plays_ranking_ids = [int(id) for id in plays_ranking]
-        # get most viewed images
-        most_played = list(Songs.objects.filter(id__in=plays_ranking_ids))
-        most_played.sort(key=lambda x: plays_ranking_ids.index(x.id))
+        window = request.GET.get('window', 'all')
+        if window not in TRENDING_WINDOW_CHOICES:
+            return views.Response({'status': False, 'message': 'window must be one of: {}'.format(
+                ', '.join(TRENDING_WINDOW_CHOICES))}, status=status.HTTP_200_OK)
+
+        # only the top ids are read from redis, and their rank orders the rows
+        plays_ranking_ids = trending_song_ids(window, limit=15)
+        position = {song_id: index for index, song_id in enumerate(plays_ranking_ids)}
+        most_played = sorted(published(Songs.objects.select_related('user')).filter(id__in=plays_ranking_ids),
+                             key=lambda song: position[song.id])
 
         resp_obj = dict(
             beats_detail=self.serializer_class(most_played, context={"request": request}, many=True).data,
@@ -425,6 +590,44 @@ class SongsRankingPlaysApiView(views.APIView):
         return views.Response(resp_obj, status=status.HTTP_200_OK)
 
 
+class SongWaveformApiView(views.APIView):
+    """
+    Precomputed waveform peaks: `2 * resolution` bytes of interleaved int8 (min, max) pairs.
+    """
+    permission_classes = [AllowAny]
+    schema = None
+
+    def get(self, request, beat_id, resolution, *args, **kwargs):
+        if resolution not in WAVEFORM_RESOLUTIONS:
+            return Response({'status': False, 'message': 'resolution must be one of: {}'.format(
+                ', '.join(str(r) for r in WAVEFORM_RESOLUTIONS))}, status=status.HTTP_200_OK)
+        waveform = get_object_or_404(SongWaveform.objects.values('peaks', 'updated_at'),
+                                     song_id=beat_id, resolution=resolution)
+        etag = '"{}-{}-{}"'.format(beat_id, resolution, int(waveform['updated_at'].timestamp()))
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(bytes(waveform['peaks']), content_type='application/octet-stream')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age={}'.format(WAVEFORM_CACHE_SECONDS)
+        return response
+
+
+class SongStreamView(views.APIView):
+    """Audio with Range/206 and ETag support, offloaded to the front proxy when configured."""
+    # an APIView so token-authenticated players are recognised for exclusive and unpublished songs
+    permission_classes = [AllowAny]
+    schema = None
+
+    def get(self, request, beat_id, *args, **kwargs):
+        # the detail view's rules: unpublished songs only for their owner, exclusive ones for members
+        song = get_object_or_404(visible_songs(request.user, Songs.objects.only(
+            'id', 'user_id', 'audio_file', 'exclusive_content')), id=beat_id)
+        if not can_play(request.user, song):
+            raise PermissionDenied("this song is exclusive to subscribed members")
+        return audio_response(request, song.audio_file)
+
+
 # list of all users that like specific songs
 class BeatsUserLikesList(views.APIView):
     pagination_class = StandardResultsSetPagination
@@ -433,24 +636,24 @@ class BeatsUserLikesList(views.APIView):
 
     @swagger_auto_schema(operation_description="API For Fetching Songs Likes. :Parameter song_slug. \n\n")
     def get(self, request, slug, *args, **kwargs):
-        users_like_list = []
-        current_beat = get_object_or_404(Songs, slug=slug)
-        users_like = current_beat.users_like.all()
-        for users_like_ids in users_like:
-            users_like_list.append(users_like_ids)
+        current_beat = get_object_or_404(published(Songs.objects.only('id')), slug=slug)
+        users_like = with_listing_data(User.objects.filter(beats_liked=current_beat)).order_by('-id')
 
         page = self.pagination_class()
-        resp_obj = page.generate_response(users_like_list, ChildFullUserSerializer, request)
+        resp_obj = page.generate_response(users_like, ChildFullUserSerializer, request)
         return resp_obj
 
 
 # Random Songs List
 class RandomSongList(views.APIView):
     serializer_class = ChildSongSerializer
-    queryset = Songs.objects.select_related('user')
+    queryset = published(Songs.objects.select_related('user'))
 
     def get(self, request, *args, **kwargs):
-        songs_by_tags = self.queryset.all().order_by('?')[:50]
+        sampled_ids = song_sampler.sample(50)
+        # in_bulk rather than filter(), which would put the sample back in -created_at order
+        songs = self.queryset.in_bulk(sampled_ids)
+        songs_by_tags = [songs[song_id] for song_id in sampled_ids if song_id in songs]
         resp_obj = dict(
             random_song_list=self.serializer_class(songs_by_tags, context={"request": request}, many=True).data,
 
@@ -462,12 +665,22 @@ class RandomSongList(views.APIView):
 class RelatedBeatsApiView(views.APIView):
     permission_classes = [AllowAny]
     serializer_class = ChildSongSerializer
-    queryset = Songs.objects.select_related('user')
+    queryset = published(Songs.objects.select_related('user'))
     schema = None
 
     def get(self, request, slug, *args, **kwargs):
-        song = get_object_or_404(Songs, slug__iexact=slug)
-        songs_by_tags = self.queryset.filter(Q(genre=song.genre) | Q(genre='love')).order_by('?')[:3]
+        song = get_object_or_404(visible_songs(request.user), slug__iexact=slug)
+        # neighbours precomputed by beats.tasks.rebuild_related_songs
+        songs_by_tags = [related.related for related in
+                         RelatedSong.objects.filter(
+                             song=song, related__processing_status=Songs.ProcessingStatus.READY).select_related('related__user')[:3]]
+        if len(songs_by_tags) < 3:
+            # new or untagged songs have no neighbours yet, pad with random songs of the same genre
+            known_ids = {song.id}.union(related.id for related in songs_by_tags)
+            random_ids = [song_id for song_id in song_sampler.sample(3 + len(known_ids), genre=song.genre)
+                          if song_id not in known_ids][:3 - len(songs_by_tags)]
+            songs = self.queryset.in_bulk(random_ids)
+            songs_by_tags += [songs[song_id] for song_id in random_ids if song_id in songs]
         resp_obj = dict(
             related_song_list=self.serializer_class(songs_by_tags, context={"request": request}, many=True).data,
 
@@ -479,6 +692,6 @@ class RelatedBeatsApiView(views.APIView):
 @permission_classes([IsAuthenticated, ExclusiveContentPermission])
 class ExclusiveSongListView(ListAPIView):
     pagination_class = StandardResultsSetPagination
-    queryset = Songs.objects.select_related('user').filter(exclusive_content=2)
+    queryset = published(Songs.objects.select_related('user')).filter(exclusive_content=2)
     # queryset = Songs.objects.select_related('user')
     serializer_class = ChildSongSerializer
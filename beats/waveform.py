@@ -0,0 +1,55 @@
+import subprocess
+
+import numpy as np
+
+from .models import Songs, SongWaveform
+
+# number of min/max pairs stored per song: track cards, the player bar and the detail page
+WAVEFORM_RESOLUTIONS = (256, 1024, 4096)
+# mono PCM rate the audio is decoded at, plenty for drawing peaks
+WAVEFORM_SAMPLE_RATE = 8000
+
+
+class WaveformError(Exception):
+    pass
+
+
+def decode_samples(audio_file):
+    """Decode an audio file object to mono int16 samples with ffmpeg."""
+    with audio_file.open('rb') as source:
+        data = source.read()
+    try:
+        result = subprocess.run(['ffmpeg', '-v', 'error', '-i', 'pipe:0', '-ac', '1',
+                                 '-ar', str(WAVEFORM_SAMPLE_RATE), '-f', 's16le', 'pipe:1'],
+                                input=data, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise WaveformError(str(e))
+    return np.frombuffer(result.stdout, dtype='<i2')
+
+
+def compute_peaks(samples, resolution):
+    """
+    Split `samples` into `resolution` equal buckets and return the min and max of each
+    bucket as interleaved int8 pairs, `2 * resolution` bytes in total.
+    """
+    width = max(-(-samples.size // resolution), 1)
+    padded = np.zeros(width * resolution, dtype=np.int16)
+    padded[:samples.size] = samples
+    buckets = padded.reshape(resolution, width)
+    peaks = np.empty((resolution, 2), dtype=np.int8)
+    # keep the high byte, 8 bits are more than a waveform can show
+    peaks[:, 0] = buckets.min(axis=1) >> 8
+    peaks[:, 1] = buckets.max(axis=1) >> 8
+    return peaks.tobytes()
+
+
+def build_waveforms(song_id):
+    """Decode a song once and store its peaks at every resolution."""
+    song = Songs.objects.filter(id=song_id).only('id', 'audio_file').first()
+    if song is None:
+        return False
+    samples = decode_samples(song.audio_file)
+    for resolution in WAVEFORM_RESOLUTIONS:
+        SongWaveform.objects.update_or_create(song_id=song_id, resolution=resolution,
+                                              defaults={'peaks': compute_peaks(samples, resolution)})
+    return True
@@ -2,7 +2,7 @@ from django.contrib.humanize.templatetags import humanize
 from django.db import models
 
 from accounts.models import User
-from common.utils import get_unique_slug
+from common.utils import allocate_slug
 from common.digitvl_timestamp import BaseTimestampModel
 
 
@@ -34,7 +34,7 @@ class Blogs(BaseTimestampModel):
     def save(self, *args, **kwargs):
         if not self.slug:
             slug_str = f'{self.blog_title}'
-            self.slug = get_unique_slug(self, slug_str, Blogs.objects)
+            self.slug = allocate_slug(Blogs.objects, slug_str)
             # if self.photo_main:
 
         super().save(*args, **kwargs)
@@ -1,3 +1,32 @@
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import User
+from common.utils import SLUG_COUNTER_KEY, allocate_slug, redis_cache
+
+from .models import Blogs
+
+
+class SlugAllocationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(email='writer@example.com', username='writer', password='secret')
+        counters = redis_cache.keys(SLUG_COUNTER_KEY.format(Blogs._meta.db_table, 'slug', '*'))
+        if counters:
+            redis_cache.delete(*counters)
+
+    def post(self, title):
+        return Blogs.objects.create(blog_title=title, blog_body='...', added_by=self.author).slug
+
+    def test_repeated_titles_get_numbered(self):
+        self.assertEqual([self.post('Release notes') for _ in range(3)],
+                         ['release-notes', 'release-notes-1', 'release-notes-2'])
+
+    def test_lost_counter_is_reseeded_past_the_slugs_in_use(self):
+        self.post('Release notes')
+        self.post('Release notes')
+        redis_cache.delete(SLUG_COUNTER_KEY.format(Blogs._meta.db_table, 'slug', 'release-notes'))
+        self.assertEqual(self.post('Release notes'), 'release-notes-2')
+
+    def test_title_without_sluggable_characters_gets_a_random_base(self):
+        slug = allocate_slug(Blogs.objects, '!!!')
+        self.assertEqual(len(slug), 8)
+        self.assertNotEqual(slug, allocate_slug(Blogs.objects, '!!!'))
@@ -0,0 +1,118 @@
+import random
+
+import redis
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+
+class RandomSampler:
+    """
+    Keeps the ids of a model in Redis sets ("pools") so that k random ids cost
+    O(k) with SRANDMEMBER instead of an `ORDER BY random()` over the whole table.
+
+    A pool is a filter on the base queryset, e.g. `{}` for every row or
+    `{'genre': 'trap'}`. Pools are built from the database the first time they
+    are sampled (and again if redis loses them) and are kept in sync by the
+    save/delete signals connected in `watch`. `pools_for(instance)` returns the
+    filters an instance currently matches.
+    """
+
+    def __init__(self, label, queryset, pools_for=None):
+        self.label = label
+        self.queryset = queryset
+        self.pools_for = pools_for or (lambda instance: [{}])
+        # every pool that has been built, so sync code can tell them apart from unbuilt ones;
+        # pools listed under the older 'random:{}:pools' have no member index and are rebuilt
+        self.registry_key = 'random:{}:built'.format(label)
+
+    def pool_key(self, **lookup):
+        return 'random:{}'.format(self.label) + ''.join(
+            ':{}={}'.format(field, value) for field, value in sorted(lookup.items()))
+
+    def member_key(self, obj_id):
+        # the pools an id was put in, so removing it touches only those
+        return 'random:{}:in:{}'.format(self.label, obj_id)
+
+    def sample(self, k, **lookup):
+        """Up to `k` distinct random ids from the pool matching `lookup`."""
+        key = self.pool_key(**lookup)
+        pipe = redis_cache.pipeline(transaction=False)
+        pipe.sismember(self.registry_key, key)
+        pipe.exists(key)
+        pipe.srandmember(key, k)
+        built, exists, ids = pipe.execute()
+        # a pool redis evicted is rebuilt even though the registry still lists it
+        if not built or not exists:
+            ids = self.build(**lookup)
+            return random.sample(ids, min(k, len(ids)))
+        ids = [int(obj_id) for obj_id in ids]
+        # SRANDMEMBER picks members at random but a small pool comes back in hash order
+        random.shuffle(ids)
+        return ids
+
+    def build(self, **lookup):
+        key = self.pool_key(**lookup)
+        ids = list(self.queryset.filter(**lookup).order_by().values_list('id', flat=True).distinct())
+        pipe = redis_cache.pipeline()
+        pipe.delete(key)
+        for start in range(0, len(ids), 1000):
+            pipe.sadd(key, *ids[start:start + 1000])
+        pipe.sadd(self.registry_key, key)
+        pipe.execute()
+        pipe = redis_cache.pipeline(transaction=False)
+        for start in range(0, len(ids), 1000):
+            for obj_id in ids[start:start + 1000]:
+                pipe.sadd(self.member_key(obj_id), key)
+            pipe.execute()
+        return ids
+
+    def add(self, instance):
+        """Add an instance to every built pool it matches; unbuilt pools pick it up when built."""
+        keys = [self.pool_key(**lookup) for lookup in self.pools_for(instance)]
+        pipe = redis_cache.pipeline(transaction=False)
+        for key in keys:
+            pipe.sismember(self.registry_key, key)
+        built = [key for key, is_built in zip(keys, pipe.execute()) if is_built]
+        if built:
+            pipe = redis_cache.pipeline(transaction=False)
+            for key in built:
+                pipe.sadd(key, instance.pk)
+            pipe.sadd(self.member_key(instance.pk), *built)
+            pipe.execute()
+
+    def discard(self, obj_id):
+        member_key = self.member_key(obj_id)
+        keys = redis_cache.smembers(member_key)
+        pipe = redis_cache.pipeline(transaction=False)
+        for key in keys:
+            pipe.srem(key, obj_id)
+        pipe.delete(member_key)
+        pipe.execute()
+
+    def reindex(self, instance):
+        self.discard(instance.pk)
+        self.add(instance)
+
+    def watch(self, model, fields=None):
+        """
+        Keep the pools in sync with `model`. Updates only move an instance between
+        pools when a save may have touched one of `fields` (the pool filters).
+        """
+
+        def on_save(sender, instance, created, update_fields, **kwargs):
+            if created:
+                self.add(instance)
+            elif fields and (update_fields is None or set(fields).intersection(update_fields)):
+                self.reindex(instance)
+
+        def on_delete(sender, instance, **kwargs):
+            self.discard(instance.pk)
+
+        post_save.connect(on_save, sender=model, weak=False, dispatch_uid='random_sampler_save_{}'.format(self.label))
+        post_delete.connect(on_delete, sender=model, weak=False,
+                            dispatch_uid='random_sampler_delete_{}'.format(self.label))
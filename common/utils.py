@@ -1,13 +1,82 @@
+import re
+import uuid
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
 from django.utils.text import slugify
 
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+LOCK_KEY = 'lock:{}'
+
+# compare-and-delete, so a holder whose lock already expired cannot release the next holder's
+RELEASE_LOCK_SCRIPT = redis_cache.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# last suffix handed out per base slug; reseeded from the table when it expires
+SLUG_COUNTER_KEY = 'slug:{}:{}:{}'
+SLUG_COUNTER_SECONDS = 24 * 60 * 60
+
+# increments the counter, seeding it with ARGV[1] when it does not exist; without a seed
+# a missing counter returns nil so the caller can read one from the table. Checking and
+# incrementing in one step keeps a counter that expires in between from restarting at 1.
+NEXT_SLUG_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if ARGV[1] == '' then
+        return false
+    end
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+local counter = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return counter
+""")
+
+
+def allocate_slug(queryset, title, field='slug'):
+    """
+    Next free `title` slug of `queryset.model`: `beat`, then `beat-1`, `beat-2`, ...
+
+    The highest suffix in use is read with one prefix query the first time a base slug
+    is seen; after that every allocation is a single Redis INCR, which also keeps two
+    concurrent saves from picking the same slug. An empty base becomes a random one.
+    """
+    # titles with nothing sluggable in them (emoji, punctuation only) still need a non-empty slug
+    base = slugify(title.replace('ı', 'i')) or uuid.uuid4().hex[:8]
+    key = SLUG_COUNTER_KEY.format(queryset.model._meta.db_table, field, base)
+    counter = NEXT_SLUG_SCRIPT(keys=[key], args=['', SLUG_COUNTER_SECONDS])
+    if counter is None:
+        suffix = re.compile(r'^{}(?:-(\d+))?$'.format(re.escape(base)))
+        highest = -1
+        for slug in queryset.filter(**{'{}__startswith'.format(field): base}).values_list(field, flat=True):
+            match = suffix.match(slug or '')
+            if match:
+                highest = max(highest, int(match.group(1) or 0))
+        # whoever seeds first wins, the others just increment
+        counter = NEXT_SLUG_SCRIPT(keys=[key], args=[highest, SLUG_COUNTER_SECONDS])
+    return base if counter == 0 else '{}-{}'.format(base, counter)
+
 
-def get_unique_slug(id, title, obj):
-    slug = slugify(title.replace('ı', 'i'))
-    unique_slug = slug
-    counter = 1
-    while obj.filter(slug=unique_slug).exists():
-        if obj.filter(slug=unique_slug).values('id')[0]['id'] == id:
-            break
-        unique_slug = '{}-{}'.format(slug, counter)
-        counter += 1
-    return unique_slug
+@contextmanager
+def redis_lock(name, timeout):
+    """
+    Hold the lock `name` for the block, expiring after `timeout` seconds in case the holder
+    dies. Does not wait: yields False when someone else holds it, and the block should skip
+    its work. Used to keep overlapping celery beat runs of a job apart.
+    """
+    key = LOCK_KEY.format(name)
+    token = uuid.uuid4().hex
+    acquired = redis_cache.set(key, token, nx=True, ex=timeout)
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            RELEASE_LOCK_SCRIPT(keys=[key], args=[token])
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.contrib.humanize.templatetags import humanize
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
@@ -29,4 +31,36 @@ class Action(models.Model):
 
     @property
     def get_created(self):
-        return humanize.naturaltime(self.created)
\ No newline at end of file
+        return humanize.naturaltime(self.created)
+
+
+class NotificationWatermark(models.Model):
+    """Notifications of `user` up to `last_read_id` count as read, see feeds.unread."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                related_name='notification_watermark',
+                                on_delete=models.CASCADE)
+    last_read_id = models.PositiveBigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id} read up to {self.last_read_id}'
+
+
+@receiver(post_save, sender='notifications.Notification')
+def notification_sent(sender, instance, created, **kwargs):
+    if created:
+        from .unread import count_new_notification
+        transaction.on_commit(lambda: count_new_notification(instance.recipient_id))
+
+
+@receiver(post_save, sender='accounts.Contact')
+def contact_followed(sender, instance, created, **kwargs):
+    if created:
+        from .tasks import follow_timeline
+        transaction.on_commit(lambda: follow_timeline.delay(instance.user_from_id, instance.user_to_id))
+
+
+@receiver(post_delete, sender='accounts.Contact')
+def contact_unfollowed(sender, instance, **kwargs):
+    from .tasks import unfollow_timeline
+    transaction.on_commit(lambda: unfollow_timeline.delay(instance.user_from_id, instance.user_to_id))
@@ -1,9 +1,14 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
 from notifications.models import Notification
 from rest_framework import serializers
 from django.contrib.humanize.templatetags import humanize
 
-from accounts.models import User
+from accounts.models import User, with_listing_data
 from accounts.serializers import ChildFullUserSerializer
+from beats.likes import LikedSongsListSerializer
 from beats.models import Songs, Comment
 from beats.serializers import ChildSongSerializer, CommentsSerializer
 from tweets.models import Tweets
@@ -11,6 +16,16 @@ from tweets.serializers import TweetsSerializer
 from .models import Action
 
 
+# target model -> (serializer, how to load a batch of it)
+ACTIVITY_TARGETS = {
+    Songs: (ChildSongSerializer, lambda objects: objects.select_related('user__membership_plan')),
+    User: (ChildFullUserSerializer, with_listing_data),
+    Tweets: (TweetsSerializer, lambda objects: objects),
+    Comment: (CommentsSerializer, lambda objects: objects.select_related(
+        'beats__user__membership_plan', 'commenter__profile')),
+}
+
+
 class ActivityObjectRelatedField(serializers.RelatedField):
 
     def _get_request(self):
@@ -24,19 +39,70 @@ class ActivityObjectRelatedField(serializers.RelatedField):
         Serialize bookmark instances using a bookmark serializer,
         and note instances using a note serializer.
         """
-        if isinstance(value, Songs):
-            serializer = ChildSongSerializer(value, context=self.context)
-
-        elif isinstance(value, User):
-            serializer = ChildFullUserSerializer(value, context=self.context)
-        elif isinstance(value, Tweets):
-            serializer = TweetsSerializer(value, context=self.context)
-        elif isinstance(value, Comment):
-            serializer = CommentsSerializer(value, context=self.context)
-        else:
-            raise Exception('Unexpected type of tagged object')
-
-        return serializer.data
+        # pages go through ActivityListSerializer, which renders every target up front
+        rendered = getattr(self.root, 'rendered_targets', {}).get((type(value), value.pk))
+        if rendered is not None:
+            return rendered
+        for model, (serializer_class, _) in ACTIVITY_TARGETS.items():
+            if isinstance(value, model):
+                return serializer_class(value, context=self.context).data
+        raise Exception('Unexpected type of tagged object')
+
+
+class ActivityListSerializer(LikedSongsListSerializer):
+    """
+    Loads the generic foreign keys named in the child's `Meta.generic_fields` for a
+    whole page, one query per content type with the joins its serializer needs, and
+    renders the ActivityObjectRelatedField ones in one bulk serializer pass per type.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        iterable = list(iterable)
+        self.rendered_targets = {}
+        if iterable:
+            for name in self.child.Meta.generic_fields:
+                self.load_generic_field(iterable, name)
+        return super().to_representation(iterable)
+
+    def load_generic_field(self, items, name):
+        generic_field = type(items[0])._meta.get_field(name)
+
+        def key(item):
+            ct_id = getattr(item, generic_field.ct_field + '_id')
+            object_id = getattr(item, generic_field.fk_field)
+            if ct_id is None or object_id is None:
+                return None
+            return ct_id, int(object_id)
+
+        wanted = defaultdict(set)
+        for item in items:
+            if key(item) is not None:
+                ct_id, object_id = key(item)
+                wanted[ct_id].add(object_id)
+
+        render = isinstance(self.child.fields.get(name), ActivityObjectRelatedField)
+        loaded = {}
+        for ct_id, object_ids in wanted.items():
+            model = ContentType.objects.get_for_id(ct_id).model_class()
+            serializer_class, load = ACTIVITY_TARGETS.get(model, (None, lambda objects: objects))
+            objects = list(load(model.objects.filter(pk__in=object_ids)))
+            loaded.update(((ct_id, obj.pk), obj) for obj in objects)
+            if render and serializer_class is not None:
+                rendered = serializer_class(objects, context=self.context, many=True).data
+                self.rendered_targets.update(((model, obj.pk), obj_data) for obj, obj_data in zip(objects, rendered))
+
+        for item in items:
+            if key(item) is not None:
+                # a deleted object is cached as None, so the field does not look it up again
+                generic_field.set_cached_value(item, loaded.get(key(item)))
+
+
+def song_target_ids(target_ct_id, target_id):
+    # only song targets carry a `user_like` flag, so only they need priming
+    if target_id is not None and target_ct_id == ContentType.objects.get_for_model(Songs).id:
+        return [int(target_id)]
+    return []
 
 
 class FeedsSerializer(serializers.ModelSerializer):
@@ -46,6 +112,12 @@ class FeedsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Action
         fields = ['id', 'user', 'verb', 'verb_id', 'target', 'get_created']
+        list_serializer_class = ActivityListSerializer
+        generic_fields = ['target']
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return song_target_ids(obj.target_ct_id, obj.target_id)
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -56,6 +128,12 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'actor', 'verb', 'target', 'timestamp']
+        list_serializer_class = ActivityListSerializer
+        generic_fields = ['actor', 'target']
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return song_target_ids(obj.target_content_type_id, obj.target_object_id)
 
     def get_timestamp(self, obj):
         return humanize.naturaltime(obj.timestamp)
@@ -68,3 +146,9 @@ class FeaturedSongSerializer(serializers.ModelSerializer):
     class Meta:
         model = Action
         fields = ['id', 'user', 'verb', 'verb_id', 'target']
+        list_serializer_class = ActivityListSerializer
+        generic_fields = ['target']
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return song_target_ids(obj.target_ct_id, obj.target_id)
@@ -0,0 +1,47 @@
+from __future__ import absolute_import, unicode_literals
+
+from celery import shared_task
+
+from . import timelines
+from .models import Action
+from .unread import clear_read_flags
+from .utils import flush_pending_actions
+
+
+# timeline fan-out, see feeds.timelines
+@shared_task
+def fan_out_action(action_id):
+    action = Action.objects.filter(id=action_id).first()
+    if action is None:
+        return 0
+    return timelines.fan_out(action)
+
+
+@shared_task
+def fan_out_actions(action_ids):
+    return sum(timelines.fan_out(action) for action in Action.objects.filter(id__in=action_ids))
+
+
+# write-behind for create_action(buffered=True), scheduled in CELERY_BEAT_SCHEDULE
+@shared_task
+def flush_buffered_actions():
+    action_ids = flush_pending_actions()
+    if action_ids:
+        fan_out_actions.delay(action_ids)
+    return len(action_ids)
+
+
+@shared_task
+def follow_timeline(user_id, author_id):
+    timelines.follow(user_id, author_id)
+
+
+@shared_task
+def unfollow_timeline(user_id, author_id):
+    timelines.unfollow(user_id, author_id)
+
+
+# keeps Notification.unread in line with the read watermark, see feeds.unread
+@shared_task
+def sync_read_flags(user_id):
+    return clear_read_flags(user_id)
@@ -1,3 +1,156 @@
+from unittest import mock
+
+from django.db import transaction
 from django.test import TestCase
+from django.urls import reverse
+from notifications.models import Notification
+from notifications.signals import notify
+
+from accounts.models import Contact, Profile, User
+from beats.likes import LIKE_ACTION_VERB
+from beats.models import Songs
+from common.utils import redis_lock
+from subscriptions.models import UserMembership
+
+from . import timelines, unread, utils
+from .models import Action
+
+
+class BufferedActionTests(TestCase):
+    def setUp(self):
+        utils.redis_cache.delete(utils.PENDING_ACTIONS_KEY, utils.FLUSHING_ACTIONS_KEY,
+                                 *utils.redis_cache.keys(utils.ACTION_DEDUPE_KEY.format('*', '*', '*', '*', '*')))
+        self.owner = User.objects.create_user(email='owner@example.com', username='owner', password='secret')
+        self.fan = User.objects.create_user(email='fan@example.com', username='fan', password='secret')
+        self.song = Songs.objects.create(user=self.owner, song_title='Night drive', description='lofi',
+                                         photo_main='photos/cover.jpg', audio_file='songs/night-drive.mp3')
+
+    def like(self, buffered=True):
+        with self.captureOnCommitCallbacks(execute=True):
+            return utils.create_action(self.fan, LIKE_ACTION_VERB, self.song, 2, buffered=buffered)
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return utils.flush_pending_actions()
+
+    def test_rolled_back_action_does_not_block_the_next_one(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    utils.create_action(self.fan, LIKE_ACTION_VERB, self.song, 2)
+                    raise RuntimeError
+        self.assertTrue(self.like(buffered=False))
+        self.assertFalse(self.like(buffered=False))
+
+    def test_like_taken_back_before_the_flush_leaves_no_action(self):
+        self.song.users_like.add(self.fan)
+        self.like()
+        self.song.users_like.remove(self.fan)
+        self.assertEqual(self.flush(), [])
+        self.assertFalse(Action.objects.filter(verb=LIKE_ACTION_VERB).exists())
+
+    def test_actions_on_deleted_targets_are_dropped(self):
+        self.song.users_like.add(self.fan)
+        self.like()
+        self.song.delete()
+        self.assertEqual(self.flush(), [])
+        self.assertFalse(utils.redis_cache.exists(utils.FLUSHING_ACTIONS_KEY))
+
+    def test_overlapping_flush_does_nothing(self):
+        self.song.users_like.add(self.fan)
+        self.like()
+        with redis_lock('actions:flush', 60):
+            self.assertEqual(self.flush(), [])
+        self.assertEqual(len(self.flush()), 1)
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        self.author = User.objects.create_user(email='author@example.com', username='author', password='secret')
+        timelines.redis_cache.delete(timelines.TIMELINE_KEY.format(self.reader.id),
+                                     timelines.AUTHORED_KEY.format(self.author.id))
+
+    def post(self, count):
+        return [Action.objects.create(user=self.author, verb='posted a song').id for _ in range(count)]
+
+    def test_empty_timeline_is_not_rebuilt_on_every_read(self):
+        self.assertEqual(timelines.timeline_ids(self.reader.id, 0, 9), [])
+        with mock.patch.object(timelines, '_build') as build:
+            self.assertEqual(timelines.timeline_ids(self.reader.id, 0, 9), [])
+        build.assert_not_called()
+
+    def test_first_action_replaces_the_empty_marker(self):
+        timelines.timeline_ids(self.reader.id, 0, 9)
+        Contact.objects.create(user_from=self.reader, user_to=self.author)
+        action_id, = self.post(1)
+        timelines.fan_out(Action.objects.get(id=action_id))
+        self.assertEqual(timelines.timeline_ids(self.reader.id, 0, 9), [action_id])
+
+    def test_marker_takes_no_slot_in_a_page(self):
+        timelines.timeline_ids(self.reader.id, 0, 9)
+        Contact.objects.create(user_from=self.reader, user_to=self.author)
+        action_ids = self.post(3)
+        for action in Action.objects.filter(id__in=action_ids):
+            timelines.fan_out(action)
+        key = timelines.TIMELINE_KEY.format(self.reader.id)
+        self.assertEqual(timelines.redis_cache.zcard(key), 4)
+        self.assertEqual(timelines.timeline_ids(self.reader.id, 0, 3), action_ids[::-1])
+        self.assertEqual(timelines.timeline_ids(self.reader.id, 2, 3), action_ids[:1])
+
+    def test_author_who_became_popular_is_listed_once(self):
+        Contact.objects.create(user_from=self.reader, user_to=self.author)
+        action_ids = self.post(3)
+        timelines.timeline_ids(self.reader.id, 0, 9)
+        Profile.objects.filter(user=self.author).update(followers_count=timelines.FAN_OUT_LIMIT)
+        self.assertEqual(timelines.timeline_ids(self.reader.id, 0, 9), action_ids[::-1])
+
+    def test_pages_past_the_cached_length_come_from_the_database(self):
+        Contact.objects.create(user_from=self.reader, user_to=self.author)
+        action_ids = self.post(4)[::-1]
+        with mock.patch.object(timelines, 'TIMELINE_LENGTH', 2):
+            self.assertEqual(timelines.timeline_ids(self.reader.id, 0, 1), action_ids[:2])
+            self.assertEqual(timelines.timeline_ids(self.reader.id, 2, 3), action_ids[2:])
+
+
+class UnreadNotificationTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(email='reader@example.com', username='reader', password='secret')
+        self.sender = User.objects.create_user(email='sender@example.com', username='sender', password='secret')
+        for user in (self.reader, self.sender):
+            UserMembership.objects.update_or_create(user=user)
+        unread.redis_cache.delete(unread.UNREAD_COUNT_KEY.format(self.reader.id))
+        for _ in range(3):
+            notify.send(self.sender, recipient=self.reader, verb='follows')
+        self.notification_ids = list(Notification.objects.filter(recipient=self.reader).order_by('id')
+                                     .values_list('id', flat=True))
+
+    def mark_read_up_to(self, notification_id):
+        with mock.patch('feeds.tasks.sync_read_flags.delay', side_effect=unread.clear_read_flags):
+            with self.captureOnCommitCallbacks(execute=True):
+                return unread.mark_read_up_to(self.reader.id, notification_id)
+
+    def test_watermark_only_moves_forward(self):
+        self.assertEqual(self.mark_read_up_to(self.notification_ids[1]), self.notification_ids[1])
+        self.assertEqual(self.mark_read_up_to(self.notification_ids[0]), self.notification_ids[1])
+        self.assertEqual(unread.unread_count(self.reader.id), 1)
+
+    def test_read_flags_follow_the_watermark(self):
+        self.mark_read_up_to(self.notification_ids[1])
+        self.assertEqual(list(self.reader.notifications.unread().values_list('id', flat=True)),
+                         [self.notification_ids[2]])
+
+    def test_unread_list_keeps_its_envelope(self):
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('notification'))
+        self.assertEqual(set(response.data), {'notification', 'user_notification_count', 'next', 'previous'})
+        self.assertEqual(len(response.data['notification']), 3)
+        self.assertEqual(response.data['user_notification_count'], 3)
 
-# Create your tests here.
+    def test_unread_list_is_paged_by_default(self):
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('notification'), {'page_size': 2})
+        self.assertEqual([row['id'] for row in response.data['notification']], self.notification_ids[:0:-1])
+        response = self.client.get(reverse('notification'), {'cursor': response.data['next'], 'page_size': 2})
+        self.assertEqual([row['id'] for row in response.data['notification']], self.notification_ids[:1])
+        self.assertIsNone(response.data['next'])
@@ -0,0 +1,159 @@
+import heapq
+
+import redis
+from django.conf import settings
+
+from accounts.models import Contact, Profile
+from .models import Action
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# action ids of the people a user follows, scored by creation time (fan-out on write)
+TIMELINE_KEY = 'timeline:{}'
+# action ids of one author, merged into followers' pages at read time for popular authors
+AUTHORED_KEY = 'timeline:author:{}'
+TIMELINE_LENGTH = 800
+# authors with at least this many followers are not fanned out, their followers pull them on read
+FAN_OUT_LIMIT = 10000
+FAN_OUT_BATCH_SIZE = 1000
+# verbs that have their own endpoints and stay out of the following feed
+EXCLUDED_VERBS = ('featured songs',)
+# member of a timeline built with nothing in it, so an empty feed is not rebuilt on every read;
+# it scores 0 and reads range over scores above it, so it never takes a slot in a page
+EMPTY_TIMELINE = 0
+ABOVE_MARKER = '(0'
+
+
+# only timelines that already exist get the new id; the others are built from the database on first read
+PUSH_IF_BUILT_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+end
+""")
+
+
+def _score(action):
+    return action.created.timestamp()
+
+
+def _push(pipe, key, entries):
+    """ZADD `entries` ({action_id: score}) and trim `key` to the newest TIMELINE_LENGTH."""
+    if entries:
+        pipe.zadd(key, entries)
+        pipe.zremrangebyrank(key, 0, -TIMELINE_LENGTH - 1)
+
+
+def is_fanned_out(author_id):
+    followers = Profile.objects.filter(user_id=author_id).values_list('followers_count', flat=True).first()
+    return (followers or 0) < FAN_OUT_LIMIT
+
+
+def _authored_entries(author_id):
+    key = AUTHORED_KEY.format(author_id)
+    if not redis_cache.exists(key):
+        rows = Action.objects.filter(user_id=author_id).exclude(verb__in=EXCLUDED_VERBS) \
+                   .order_by('-created').values_list('id', 'created')[:TIMELINE_LENGTH]
+        pipe = redis_cache.pipeline()
+        _push(pipe, key, {action_id: created.timestamp() for action_id, created in rows})
+        pipe.execute()
+    return {int(action_id): score for action_id, score in redis_cache.zrange(key, 0, -1, withscores=True)}
+
+
+def fan_out(action):
+    """Push a new action to its author's list and, unless the author is popular, to every follower."""
+    if action.verb in EXCLUDED_VERBS:
+        return 0
+    pipe = redis_cache.pipeline(transaction=False)
+    _push(pipe, AUTHORED_KEY.format(action.user_id), {action.id: _score(action)})
+    pipe.execute()
+    if not is_fanned_out(action.user_id):
+        return 0
+
+    follower_ids = Contact.objects.filter(user_to_id=action.user_id).values_list('user_from_id', flat=True)
+    pushed = 0
+    pipe = redis_cache.pipeline(transaction=False)
+    for follower_id in follower_ids.iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        PUSH_IF_BUILT_SCRIPT(keys=[TIMELINE_KEY.format(follower_id)],
+                             args=[_score(action), action.id, TIMELINE_LENGTH], client=pipe)
+        pushed += 1
+        if pushed % FAN_OUT_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+    return pushed
+
+
+def follow(user_id, author_id):
+    """Backfill a newly followed author into the follower's timeline."""
+    key = TIMELINE_KEY.format(user_id)
+    if not redis_cache.exists(key) or not is_fanned_out(author_id):
+        return
+    pipe = redis_cache.pipeline()
+    _push(pipe, key, _authored_entries(author_id))
+    pipe.execute()
+
+
+def unfollow(user_id, author_id):
+    key = TIMELINE_KEY.format(user_id)
+    action_ids = list(_authored_entries(author_id))
+    if action_ids and redis_cache.exists(key):
+        redis_cache.zrem(key, *action_ids)
+
+
+def _followed_actions(user_id, author_ids=None):
+    if author_ids is None:
+        author_ids = Contact.objects.filter(user_from_id=user_id).values('user_to_id')
+    return Action.objects.filter(user_id__in=author_ids).exclude(verb__in=EXCLUDED_VERBS).order_by('-created', '-id')
+
+
+def _build(user_id):
+    key = TIMELINE_KEY.format(user_id)
+    author_ids = [author_id for author_id in Contact.objects.filter(user_from_id=user_id)
+                  .filter(user_to__profile__followers_count__lt=FAN_OUT_LIMIT).values_list('user_to_id', flat=True)]
+    rows = _followed_actions(user_id, author_ids).values_list('id', 'created')[:TIMELINE_LENGTH]
+    entries = {action_id: created.timestamp() for action_id, created in rows}
+    pipe = redis_cache.pipeline()
+    pipe.delete(key)
+    # the marker scores lowest, so the trim drops it once the timeline fills up
+    _push(pipe, key, entries or {EMPTY_TIMELINE: 0})
+    pipe.execute()
+
+
+def timeline_ids(user_id, start, stop):
+    """
+    Action ids `start`..`stop` (inclusive, newest first) of the accounts `user_id`
+    follows: the pushed timeline merged with the lists of followed popular authors.
+    Every list holds the newest TIMELINE_LENGTH entries, deeper pages come from the database.
+    """
+    if stop >= TIMELINE_LENGTH:
+        return list(_followed_actions(user_id).values_list('id', flat=True)[start:stop + 1])
+    key = TIMELINE_KEY.format(user_id)
+    if not redis_cache.exists(key):
+        _build(user_id)
+    popular_ids = list(Contact.objects.filter(user_from_id=user_id,
+                                              user_to__profile__followers_count__gte=FAN_OUT_LIMIT)
+                       .values_list('user_to_id', flat=True))
+    if not popular_ids:
+        return [int(action_id) for action_id in
+                redis_cache.zrevrangebyscore(key, '+inf', ABOVE_MARKER, start=start, num=stop - start + 1)]
+
+    for author_id in popular_ids:
+        # make sure the author lists exist before reading them in one round trip
+        if not redis_cache.exists(AUTHORED_KEY.format(author_id)):
+            _authored_entries(author_id)
+    pipe = redis_cache.pipeline(transaction=False)
+    for source in [key] + [AUTHORED_KEY.format(author_id) for author_id in popular_ids]:
+        # every source's best `stop + 1` entries are enough for the merged range
+        pipe.zrevrangebyscore(source, '+inf', ABOVE_MARKER, start=0, num=stop + 1, withscores=True)
+    merged = heapq.merge(*[[(-score, int(action_id)) for action_id, score in rows] for rows in pipe.execute()])
+    # an author who crossed FAN_OUT_LIMIT is still in the pushed timeline as well
+    seen = set()
+    action_ids = []
+    for _, action_id in merged:
+        if action_id not in seen:
+            seen.add(action_id)
+            action_ids.append(action_id)
+    return action_ids[start:stop + 1]
@@ -0,0 +1,83 @@
+import redis
+from django.conf import settings
+from django.db import transaction
+from notifications.models import Notification
+
+from .models import NotificationWatermark
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# cached unread count per user; recounted from the database when missing
+UNREAD_COUNT_KEY = 'notifications:unread:{}'
+UNREAD_COUNT_SECONDS = 24 * 60 * 60
+
+# bump only counters that exist, a missing one is recounted on the next read
+INCR_IF_CACHED_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return nil
+""")
+
+
+def last_read_id(user_id):
+    return NotificationWatermark.objects.filter(user_id=user_id).values_list('last_read_id', flat=True).first() or 0
+
+
+def unread_notifications(user_id):
+    """Unread notifications: not marked read, and newer than the user's watermark."""
+    return Notification.objects.filter(recipient_id=user_id, unread=True, id__gt=last_read_id(user_id))
+
+
+def unread_count(user_id):
+    key = UNREAD_COUNT_KEY.format(user_id)
+    count = redis_cache.get(key)
+    if count is None:
+        count = unread_notifications(user_id).count()
+        redis_cache.set(key, count, ex=UNREAD_COUNT_SECONDS)
+    return int(count)
+
+
+def count_new_notification(user_id):
+    INCR_IF_CACHED_SCRIPT(keys=[UNREAD_COUNT_KEY.format(user_id)])
+
+
+def mark_read_up_to(user_id, notification_id):
+    """
+    Move the user's read watermark forward to `notification_id`. Calling it again with
+    the same or an older id changes nothing. The rows' own unread flags are cleared
+    afterwards by feeds.tasks.sync_read_flags, outside the request.
+    """
+    watermark, _ = NotificationWatermark.objects.get_or_create(user_id=user_id)
+    moved = NotificationWatermark.objects.filter(id=watermark.id, last_read_id__lt=notification_id) \
+        .update(last_read_id=notification_id)
+    if moved:
+        redis_cache.delete(UNREAD_COUNT_KEY.format(user_id))
+        from .tasks import sync_read_flags
+        transaction.on_commit(lambda: sync_read_flags.delay(user_id))
+    return max(watermark.last_read_id, notification_id)
+
+
+def mark_all_read(user_id):
+    latest_id = Notification.objects.filter(recipient_id=user_id).order_by('-id') \
+        .values_list('id', flat=True).first()
+    if latest_id is not None:
+        mark_read_up_to(user_id, latest_id)
+
+
+def clear_read_flags(user_id, batch_size=1000):
+    """
+    Clear the unread flag of the user's notifications under the watermark, a batch at
+    a time, so django-notifications' own unread() and read() agree with it.
+    """
+    up_to = last_read_id(user_id)
+    cleared = 0
+    while True:
+        batch = list(Notification.objects.filter(recipient_id=user_id, unread=True, id__lte=up_to)
+                     .values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return cleared
+        cleared += Notification.objects.filter(id__in=batch).update(unread=False)
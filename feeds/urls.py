@@ -1,12 +1,14 @@
 from django.urls import path
 from .views import UserFeeds, NotificationUnreadListApiView, NotificationReadApiView, GetFeaturedSongApiView, \
-    CurrentUserActionFeeds
+    CurrentUserActionFeeds, NotificationUnreadCountApiView, NotificationMarkReadApiView
 
 urlpatterns = [
     path('feeds/', UserFeeds.as_view(), name='user-feeds'),
     path('feeds/current-user/', CurrentUserActionFeeds.as_view(), name='user-feeds'),
     path('notification/', NotificationUnreadListApiView.as_view(), name='notification'),
     path('notification/read/', NotificationReadApiView.as_view(), name='notification-read'),
+    path('notification/unread-count/', NotificationUnreadCountApiView.as_view(), name='notification-unread-count'),
+    path('notification/mark-read/', NotificationMarkReadApiView.as_view(), name='notification-mark-read'),
 
     # featured songs
     path('featured/songs/', GetFeaturedSongApiView.as_view(), name='featured-songs'),
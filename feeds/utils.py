@@ -1,29 +1,135 @@
-import datetime
-from django.utils import timezone
+import json
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from common.utils import redis_lock
 from .models import Action
 
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# one key per (user, verb, verb_id, target content type, target id), alive for the dedupe window
+ACTION_DEDUPE_KEY = 'action:dedupe:{}:{}:{}:{}:{}'
+ACTION_DEDUPE_SECONDS = 60
+# JSON rows queued by create_action(buffered=True)
+PENDING_ACTIONS_KEY = 'actions:pending'
+# the batch currently being flushed, kept until the database commit so a crashed flush is retried
+FLUSHING_ACTIONS_KEY = 'actions:flushing'
+FLUSH_BATCH_SIZE = 500
+FLUSH_LOCK_SECONDS = 5 * 60
+
+# claims the dedupe key and queues the row in one step, run once the caller has committed
+QUEUE_ACTION_SCRIPT = redis_cache.register_script("""
+if redis.call('SET', KEYS[1], 1, 'NX', 'EX', tonumber(ARGV[2])) then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+""")
+
+# verb -> check(entries) returning the queued entries that still hold at flush time,
+# e.g. a like that was taken back before its action was written
+_buffered_checks = {}
+
 
-def create_action(user, verb, target=None, verb_id=None):
-    # check for any similar action made in the last minute
-    now = timezone.now()
-    last_minute = now - datetime.timedelta(seconds=60)
-    similar_actions = Action.objects.filter(user_id=user.id,
-                                            verb=verb,
-                                            verb_id=verb_id,
-                                            created__gte=last_minute)
-    if target:
-        target_ct = ContentType.objects.get_for_model(target)
-        similar_actions = similar_actions.filter(
-            target_ct=target_ct,
-            target_id=target.id)
-    if not similar_actions:
-        # no existing actions found
-        action = Action(user=user, verb=verb, target=target, verb_id=verb_id)
-
-        action.save()
+def register_buffered_check(verb, check):
+    _buffered_checks[verb] = check
+
+
+def create_action(user, verb, target=None, verb_id=None, buffered=False):
+    """
+    Record `user` doing `verb` (on `target`), at most once a minute per (user, verb, target).
+
+    The minute window is a SET EX key in Redis instead of a query on Action. It is only
+    set once the caller's transaction commits, so a rolled back action blocks nothing.
+    With `buffered=True` the row is queued and written by the flush_buffered_actions
+    task in bulk; use it for high-volume actions nobody reads back straight away.
+    """
+    target_ct_id = ContentType.objects.get_for_model(target).id if target else None
+    target_id = target.id if target else None
+    dedupe_key = ACTION_DEDUPE_KEY.format(user.id, verb, verb_id, target_ct_id, target_id)
+    if redis_cache.exists(dedupe_key):
+        # a similar action was recorded in the last minute
+        return False
+
+    if buffered:
+        entry = json.dumps({'user_id': user.id, 'verb': verb, 'verb_id': verb_id, 'target_ct_id': target_ct_id,
+                            'target_id': target_id})
+        transaction.on_commit(lambda: QUEUE_ACTION_SCRIPT(keys=[dedupe_key, PENDING_ACTIONS_KEY],
+                                                          args=[entry, ACTION_DEDUPE_SECONDS]))
         return True
-    return False
+
+    from .tasks import fan_out_action
+    action = Action(user=user, verb=verb, target=target, verb_id=verb_id)
+    action.save()
+
+    def committed():
+        redis_cache.set(dedupe_key, 1, ex=ACTION_DEDUPE_SECONDS)
+        # pushed to the followers' timelines once the action is committed
+        fan_out_action.delay(action.id)
+
+    transaction.on_commit(committed)
+    return True
+
+
+def _live_entries(entries):
+    """Drop queued rows whose actor or target was deleted, or whose registered check no longer holds."""
+    users = set(get_user_model().objects.filter(id__in={entry['user_id'] for entry in entries})
+                .values_list('id', flat=True))
+    target_ids = defaultdict(set)
+    for entry in entries:
+        if entry['target_ct_id'] is not None:
+            target_ids[entry['target_ct_id']].add(entry['target_id'])
+    targets = set()
+    for ct_id, ids in target_ids.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is not None:
+            targets.update((ct_id, pk) for pk in model._default_manager.filter(pk__in=ids).values_list('pk', flat=True))
+    entries = [entry for entry in entries if entry['user_id'] in users and
+               (entry['target_ct_id'] is None or (entry['target_ct_id'], entry['target_id']) in targets)]
+
+    by_verb = defaultdict(list)
+    for entry in entries:
+        by_verb[entry['verb']].append(entry)
+    live = []
+    for verb, verb_entries in by_verb.items():
+        check = _buffered_checks.get(verb)
+        live.extend(check(verb_entries) if check else verb_entries)
+    return live
+
+
+def flush_pending_actions():
+    """
+    bulk_create the actions queued by create_action(buffered=True); returns the new ids
+    ([] when another flush is still running).
+    """
+    with redis_lock('actions:flush', FLUSH_LOCK_SECONDS) as locked:
+        if not locked:
+            return []
+        return _flush_batch()
+
+
+def _flush_batch():
+    if not redis_cache.exists(FLUSHING_ACTIONS_KEY):
+        try:
+            redis_cache.rename(PENDING_ACTIONS_KEY, FLUSHING_ACTIONS_KEY)
+        except redis.ResponseError:
+            # nothing was queued since the last flush
+            return []
+
+    entries = [json.loads(entry) for entry in redis_cache.lrange(FLUSHING_ACTIONS_KEY, 0, -1)]
+    actions = [Action(**entry) for entry in _live_entries(entries)]
+    with transaction.atomic():
+        created = Action.objects.bulk_create(actions, batch_size=FLUSH_BATCH_SIZE)
+        transaction.on_commit(lambda: redis_cache.delete(FLUSHING_ACTIONS_KEY))
+    return [action.id for action in created]
 
 
 def delete_action(target, target_id):
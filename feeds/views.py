@@ -1,13 +1,19 @@
+from collections import OrderedDict
+
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from notifications.models import Notification
 from rest_framework import status
 from rest_framework.generics import ListAPIView, get_object_or_404
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.response import Response
 
 from accounts import views
 from accounts.models import User
-from beats.views import StandardResultsSetPagination
+from beats.views import CursorResultsSetPagination, StandardResultsSetPagination
 from .models import Action
+from .timelines import timeline_ids
+from .unread import mark_all_read, mark_read_up_to, unread_count, unread_notifications
 from .serializers import FeedsSerializer, NotificationSerializer, FeaturedSongSerializer
 
 
@@ -18,25 +24,30 @@ class UserFeeds(ListAPIView):
     queryset = Action.objects.all()
 
     def get(self, request, *args, **kwargs):
-        # Display all actions by default
-        # actions = self.queryset.exclude(user=self.request.user)
-
-        # following_ids = self.request.user.following.values_list('id', flat=True)
-        # if following_ids:
-        #     # If user is following others, retrieve only their actions
-        #     actions = actions.filter(user_id__in=following_ids)
-
-        actions = self.queryset.select_related('user__profile').prefetch_related('target', 'user__beats',
-                                                                           'user__following').exclude(
-            verb='featured songs')[:10]
-
-        #
-        # for user_actions in actions:
-        #     action_users.append(user_actions)
-
+        # ids come from the user's timeline (feeds.timelines), only the page itself is read from the database
         page = self.pagination_class()
-        resp_obj = page.generate_response(actions, FeedsSerializer, request)
-        return resp_obj
+        page_size = page.get_page_size(request)
+        try:
+            page_number = max(int(request.query_params.get(page.page_query_param, 1)), 1)
+        except ValueError:
+            return Response({"error": "No results found for the requested page"}, status=status.HTTP_400_BAD_REQUEST)
+        start = (page_number - 1) * page_size
+        # one extra id tells whether there is a next page
+        action_ids = timeline_ids(request.user.id, start, start + page_size)
+        has_next = len(action_ids) > page_size
+        action_ids = action_ids[:page_size]
+
+        # targets are loaded per content type by ActivityListSerializer
+        actions = self.queryset.select_related('user__profile', 'user__user_xrp_wallet',
+                                               'user__membership_plan').in_bulk(action_ids)
+        actions = [actions[action_id] for action_id in action_ids if action_id in actions]
+        data = FeedsSerializer(actions, context={'request': request}, many=True).data
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', page_number + 1 if has_next else None),
+            ('previous', page_number - 1 if page_number > 1 else None),
+            ('results', data),
+        ]))
 
 
 # current user action
@@ -48,35 +59,71 @@ class CurrentUserActionFeeds(ListAPIView):
 
     def get(self, request, *args, **kwargs):
         # Display all actions by default
-        actions = self.queryset.filter(user=self.request.user)
-        actions = actions.select_related('user__profile').prefetch_related('target', 'user__beats',
-                                                                           'user__following')[:10]
+        actions = self.queryset.filter(user_id=self.request.user.id)
+        actions = actions.select_related('user__profile', 'user__user_xrp_wallet', 'user__membership_plan')[:10]
 
         page = self.pagination_class()
         resp_obj = page.generate_response(actions, FeedsSerializer, request)
         return resp_obj
 
 
+class NotificationCursorPagination(CursorResultsSetPagination):
+    cursor_fields = ('timestamp',)
+
+
 class NotificationUnreadListApiView(views.APIView):
+    pagination_class = NotificationCursorPagination
     permission_classes = [IsAuthenticated]
     serializer_class = NotificationSerializer
     queryset = Notification.objects.all()
 
-    @swagger_auto_schema(operation_description="API For Getting Users Notification. \n\n")
+    @swagger_auto_schema(operation_description="API For Getting Users Notification, a page at a time, newest "
+                                               "first. Send the `next` token back as `?cursor=` for the following "
+                                               "page.\n\n")
     def get(self, request, *args, **kwargs):
-        # get user object
-        user = User.objects.get(pk=request.user.id)
-        user_notification = user.notifications.unread()
-        user_notification_count = user_notification.count()
+        page = self.pagination_class()
+        user_notification = page.paginate_queryset(unread_notifications(request.user.id), request)
         resp_obj = dict(
             notification=self.serializer_class(user_notification, context={"request": request}, many=True).data,
-            user_notification_count=user_notification_count
-
+            user_notification_count=unread_count(request.user.id),
+            next=page.get_next_link(),
+            previous=page.get_previous_link(),
         )
 
         return views.Response(resp_obj, status=status.HTTP_200_OK)
 
 
+class NotificationUnreadCountApiView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Unread notification count for the badge, served from cache.")
+    def get(self, request, *args, **kwargs):
+        return views.Response({'status': True, 'message': 'unread notifications',
+                               'result': {'unread_count': unread_count(request.user.id)}},
+                              status=status.HTTP_200_OK)
+
+
+class NotificationMarkReadApiView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Mark every notification up to `notification_id` as read. "
+                                               "Repeating the call, or sending an older id, changes nothing.",
+                         request_body=openapi.Schema(type=openapi.TYPE_OBJECT, required=['notification_id'],
+                                                     properties={'notification_id': openapi.Schema(
+                                                         type=openapi.TYPE_INTEGER)}))
+    def post(self, request, *args, **kwargs):
+        try:
+            notification_id = int(request.data.get('notification_id'))
+        except (TypeError, ValueError):
+            return views.Response({'status': False, 'message': 'notification_id is required', 'result': {}},
+                                  status=status.HTTP_200_OK)
+        last_read = mark_read_up_to(request.user.id, notification_id)
+        return views.Response({'status': True, 'message': 'notifications marked as read',
+                               'result': {'last_read_id': last_read,
+                                          'unread_count': unread_count(request.user.id)}},
+                              status=status.HTTP_200_OK)
+
+
 class NotificationReadApiView(views.APIView):
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
@@ -85,20 +132,13 @@ class NotificationReadApiView(views.APIView):
     schema = None
 
     def get(self, request, *args, **kwargs):
-        # get user object
-        user = User.objects.get(pk=request.user.id)
-        user_all_notification = user.notifications.all().exclude(actor_object_id=user.id)
-        user.notifications.mark_all_as_read(user)
-        #
-        # resp_obj = dict(
-        #     notification=self.serializer_class(user_all_notification, context={"request": request}, many=True).data,
-        #     user_notification_mark_as_read=user_notification_mark_as_read
-        #
-        # )
+        user_all_notification = self.queryset.filter(recipient_id=request.user.id) \
+            .exclude(actor_object_id=str(request.user.id))
+        # a watermark move instead of an UPDATE over every unread row
+        mark_all_read(request.user.id)
         page = self.pagination_class()
         resp_obj = page.generate_response(user_all_notification, NotificationSerializer, request)
         return resp_obj
-        # return views.Response(resp_obj, status=status.HTTP_200_OK)
 
 
 class GetFeaturedSongApiView(views.APIView):
@@ -108,8 +148,8 @@ class GetFeaturedSongApiView(views.APIView):
     queryset = Action.objects.all()
 
     def get(self, request, *args, **kwargs):
-        actions = self.queryset.select_related('user__profile').prefetch_related('target', 'user__beats', ).filter(
-            verb='featured songs')[:10]
+        actions = self.queryset.select_related('user__profile', 'user__user_xrp_wallet',
+                                               'user__membership_plan').filter(verb='featured songs')[:10]
 
         page = self.pagination_class()
         resp_obj = page.generate_response(actions, self.serializer_class, request)
@@ -19,6 +19,7 @@ class InvitedUserApiView(views.APIView):
             serializer.save(inviter=self.request.user)
             user_data = serializer.data
             data = {'inviter': request.user.username, 'invited_user': user_data['invited_user']}
+            # appends to the email outbox, nothing is sent while the request waits
             send_email_to_invite_user(data)
             content = {'status': True, 'message': 'Invitation Sent', 'result': serializer.data}
 
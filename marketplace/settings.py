@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    'django.contrib.postgres',
     'rest_framework',
     'accounts',
     'announcement',
@@ -153,7 +154,7 @@ REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
 
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.PrincipalJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -180,7 +181,7 @@ SIMPLE_JWT = {
 }
 
 AUTHENTICATION_BACKENDS = (
-    'django.contrib.auth.backends.ModelBackend',
+    'accounts.backends.LoginBackend',
 )
 
 # Database
@@ -237,6 +238,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# audio streaming: '' streams from Django (development), 'nginx' hands the transfer to the
+# front proxy with X-Accel-Redirect, 'apache' with X-Sendfile
+AUDIO_STREAM_OFFLOAD = os.getenv('AUDIO_STREAM_OFFLOAD', '')
+# internal nginx location aliased to MEDIA_ROOT
+AUDIO_STREAM_ACCEL_PREFIX = '/protected-media/'
+
 # # Redis Support
 
 REDIS_HOST = 'localhost'
@@ -283,6 +290,43 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'accounts.tasks.send_email_to_non_verify_account',
         'schedule': crontab(hour=12, minute=30),
     },
+    'flush_song_plays': {
+        'task': 'beats.tasks.flush_song_plays',
+        'schedule': 60.0,
+    },
+    'rebuild_related_songs': {
+        'task': 'beats.tasks.rebuild_related_songs',
+        'schedule': crontab(minute='*/15'),
+    },
+    'rebuild_all_related_songs': {
+        'task': 'beats.tasks.rebuild_related_songs',
+        'schedule': crontab(hour=4, minute=0),
+        'kwargs': {'full': True},
+    },
+    'flush_song_likes': {
+        'task': 'beats.tasks.flush_song_likes',
+        'schedule': 5.0,
+    },
+    'flush_buffered_actions': {
+        'task': 'feeds.tasks.flush_buffered_actions',
+        'schedule': 5.0,
+    },
+    'deliver_queued_email': {
+        'task': 'accounts.tasks.deliver_queued_email',
+        'schedule': 5.0,
+    },
+    'flush_coin_ledger': {
+        'task': 'redeemCoins.tasks.flush_coin_ledger',
+        'schedule': 5.0,
+    },
+    'reconcile_song_likes': {
+        'task': 'beats.tasks.reconcile_song_likes',
+        'schedule': crontab(minute=30),
+    },
+    'reconcile_profile_counters': {
+        'task': 'accounts.tasks.reconcile_profile_counters',
+        'schedule': crontab(hour=3, minute=30),
+    },
 }
 
 # santry setting for production error handle
@@ -1,3 +1,11 @@
 from django.contrib import admin
 
 # Register your models here.
+from .models import CoinTransaction
+
+
+@admin.register(CoinTransaction)
+class CoinTransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'amount', 'balance', 'reason', 'created')
+    list_filter = ('reason', 'created')
+    readonly_fields = ('reference', 'user', 'amount', 'balance', 'reason', 'created')
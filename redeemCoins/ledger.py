@@ -0,0 +1,173 @@
+import json
+import uuid
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from common.utils import redis_lock
+from .models import CoinTransaction
+
+# connect to redis
+redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
+                                port=settings.REDIS_PORT,
+                                db=settings.REDIS_DB)
+
+# balance of a user, a one-field hash {user_id: coins} (the layout the app has always used)
+COINS_KEY = 'users:{}:coins'
+# ledger entries not yet written to CoinTransaction
+PENDING_COINS_KEY = 'coins:pending'
+# the batch currently being flushed, kept until the database commit so a crashed flush is retried
+FLUSHING_COINS_KEY = 'coins:flushing'
+FLUSH_BATCH_SIZE = 1000
+FLUSH_LOCK_SECONDS = 5 * 60
+REBUILD_BATCH_SIZE = 1000
+
+# applies one ledger entry: refuses to go below zero on a spend, otherwise moves the
+# balance and queues the entry (with the balance it produced) in the same atomic step.
+# returns {status, balance}: 1 applied, 0 insufficient coins, -1 balance not loaded
+APPLY_SCRIPT = redis_cache.register_script("""
+local balance = redis.call('HGET', KEYS[1], ARGV[1])
+if not balance then
+    return {-1, 0}
+end
+local amount = tonumber(ARGV[2])
+if amount < 0 and tonumber(balance) + amount < 0 then
+    return {0, tonumber(balance)}
+end
+balance = redis.call('HINCRBY', KEYS[1], ARGV[1], amount)
+local entry = cjson.decode(ARGV[3])
+entry['balance'] = balance
+redis.call('RPUSH', KEYS[2], cjson.encode(entry))
+return {1, balance}
+""")
+
+
+def ledger_totals(user_ids):
+    """
+    {user_id: (Redis balance or None, ledger total)} where the ledger total counts the
+    CoinTransaction rows plus the queued entries not written yet.
+
+    The balances and both queues are read in one MULTI, so they are from the same instant.
+    The rows are read afterwards, and the same aggregate sums the queued entries that a
+    concurrent flush has already written. Those are subtracted, so no entry counts twice.
+    """
+    user_ids = [int(user_id) for user_id in user_ids]
+    pipe = redis_cache.pipeline()
+    for user_id in user_ids:
+        pipe.hget(COINS_KEY.format(user_id), user_id)
+    pipe.lrange(FLUSHING_COINS_KEY, 0, -1)
+    pipe.lrange(PENDING_COINS_KEY, 0, -1)
+    *coins, flushing, pending = pipe.execute()
+
+    queued = {user_id: 0 for user_id in user_ids}
+    references = []
+    for raw in flushing + pending:
+        entry = json.loads(raw)
+        if int(entry['user_id']) in queued:
+            queued[int(entry['user_id'])] += entry['amount']
+            references.append(entry['reference'])
+    rows = CoinTransaction.objects.filter(user_id__in=user_ids).order_by().values('user_id').annotate(
+        total=Sum('amount'), written=Sum('amount', filter=Q(reference__in=references)))
+    persisted = {row['user_id']: (row['total'] or 0) - (row['written'] or 0) for row in rows}
+    return {user_id: (None if balance is None else int(balance), persisted.get(user_id, 0) + queued[user_id])
+            for user_id, balance in zip(user_ids, coins)}
+
+
+def _load_balance(user_id):
+    """Seed a missing Redis balance from the ledger rows and queued entries; a concurrent seed wins."""
+    _, total = ledger_totals([user_id])[int(user_id)]
+    redis_cache.hsetnx(COINS_KEY.format(user_id), user_id, total)
+
+
+def balance(user_id):
+    coins = redis_cache.hget(COINS_KEY.format(user_id), user_id)
+    if coins is None:
+        _load_balance(user_id)
+        coins = redis_cache.hget(COINS_KEY.format(user_id), user_id)
+    return int(coins or 0)
+
+
+def _apply(user_id, amount, reason):
+    entry = json.dumps({'reference': str(uuid.uuid4()), 'user_id': user_id, 'amount': amount,
+                        'reason': reason, 'created': timezone.now().isoformat()})
+    keys = [COINS_KEY.format(user_id), PENDING_COINS_KEY]
+    applied, coins = APPLY_SCRIPT(keys=keys, args=[user_id, amount, entry])
+    if applied == -1:
+        _load_balance(user_id)
+        applied, coins = APPLY_SCRIPT(keys=keys, args=[user_id, amount, entry])
+    return applied == 1, int(coins)
+
+
+def credit(user_id, amount, reason):
+    """Add `amount` coins; returns the new balance."""
+    if amount <= 0:
+        raise ValueError('credit amount must be positive')
+    _, coins = _apply(user_id, amount, reason)
+    return coins
+
+
+def spend(user_id, amount, reason):
+    """
+    Take `amount` coins if the user has them, atomically with the balance check.
+    Returns the new balance, or None when the balance is too low (nothing changes).
+    """
+    if amount <= 0:
+        raise ValueError('spend amount must be positive')
+    applied, coins = _apply(user_id, -amount, reason)
+    return coins if applied else None
+
+
+def flush_pending_coins():
+    """
+    Write the queued ledger entries to CoinTransaction; returns how many were written
+    (0 when another flush is still running).
+    """
+    with redis_lock('coins:flush', FLUSH_LOCK_SECONDS) as locked:
+        if not locked:
+            return 0
+        return _flush_batch()
+
+
+def _flush_batch():
+    if not redis_cache.exists(FLUSHING_COINS_KEY):
+        try:
+            redis_cache.rename(PENDING_COINS_KEY, FLUSHING_COINS_KEY)
+        except redis.ResponseError:
+            # nothing was queued since the last flush
+            return 0
+
+    rows = [CoinTransaction(**json.loads(entry)) for entry in redis_cache.lrange(FLUSHING_COINS_KEY, 0, -1)]
+    # entries of since deleted users would fail the foreign key, and the batch with them forever
+    known = set(get_user_model().objects.filter(id__in={row.user_id for row in rows}).values_list('id', flat=True))
+    rows = [row for row in rows if row.user_id in known]
+    with transaction.atomic():
+        # references are unique, so a batch retried after a crash is not written twice
+        CoinTransaction.objects.bulk_create(rows, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+        transaction.on_commit(lambda: redis_cache.delete(FLUSHING_COINS_KEY))
+    return len(rows)
+
+
+def rebuild_balances(user_ids=None):
+    """
+    Reset Redis balances to the sum of the ledger for `user_ids` (everyone in the
+    ledger when None). Queued entries are flushed first; coins moved while this runs
+    can be overwritten, so pause spending (maintenance mode) around a full rebuild.
+    """
+    flush_pending_coins()
+    totals = CoinTransaction.objects.all()
+    if user_ids is not None:
+        totals = totals.filter(user_id__in=user_ids)
+    totals = totals.order_by('user_id').values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total')
+    rebuilt = 0
+    pipe = redis_cache.pipeline(transaction=False)
+    for user_id, total in totals.iterator():
+        pipe.hset(COINS_KEY.format(user_id), user_id, total)
+        rebuilt += 1
+        if rebuilt % REBUILD_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+    return rebuilt
@@ -0,0 +1,45 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import User
+from redeemCoins.ledger import ledger_totals, redis_cache
+from redeemCoins.models import CoinTransaction
+
+IMPORT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Record the current `users:{id}:coins` balances as opening ledger entries (run once after migrating)."
+
+    def handle(self, *args, **options):
+        user_ids = []
+        for key in redis_cache.scan_iter(match='users:*:coins', count=1000):
+            user_id = key.decode().split(':')[1]
+            if user_id.isdigit():
+                user_ids.append(int(user_id))
+
+        imported = 0
+        for start in range(0, len(user_ids), IMPORT_BATCH_SIZE):
+            imported += self.import_batch(user_ids[start:start + IMPORT_BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f'imported opening balances for {imported} users'))
+
+    def import_batch(self, user_ids):
+        existing_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        # a second run must not open anyone twice
+        opened = set(CoinTransaction.objects.filter(user_id__in=user_ids, reason=CoinTransaction.Reason.OPENING)
+                     .values_list('user_id', flat=True))
+        now = timezone.now()
+        rows = []
+        for user_id, (coins, total) in ledger_totals(user_ids).items():
+            if coins is None or user_id not in existing_users or user_id in opened:
+                continue
+            # spends and credits made since the ledger went live are already in `total`,
+            # whether written or still queued; the opening entry is whatever predates them
+            opening = coins - total
+            if opening:
+                rows.append(CoinTransaction(reference=uuid.uuid4(), user_id=user_id, amount=opening,
+                                            balance=opening, reason=CoinTransaction.Reason.OPENING, created=now))
+        CoinTransaction.objects.bulk_create(rows, batch_size=IMPORT_BATCH_SIZE)
+        return len(rows)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from redeemCoins.ledger import rebuild_balances
+
+
+class Command(BaseCommand):
+    help = "Reset the Redis coin balances from the CoinTransaction ledger, e.g. after Redis lost its data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help="only these users (default: everyone)")
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_balances(options['user_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'rebuilt coin balances for {rebuilt} users'))
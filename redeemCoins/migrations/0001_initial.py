@@ -0,0 +1,36 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoinTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.UUIDField(unique=True)),
+                ('amount', models.IntegerField()),
+                ('balance', models.IntegerField()),
+                ('reason', models.CharField(choices=[('opening', 'opening balance'), ('purchase', 'coins purchase'), ('ad_reward', 'advertisement reward'), ('reward', 'reward'), ('featured_song', 'featured song'), ('featured_playlist', 'featured playlist'), ('tweet', 'tweet'), ('refund', 'refund')], max_length=30)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coin_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='cointransaction',
+            index=models.Index(fields=['user', '-created'], name='coin_txn_user_created_idx'),
+        ),
+    ]
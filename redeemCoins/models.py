@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import models
+
+
+class CoinTransaction(models.Model):
+    """
+    Append-only coin ledger. Balances are served from Redis (see redeemCoins.ledger),
+    rows are written in batches and are what balances are rebuilt from.
+    """
+
+    class Reason(models.TextChoices):
+        OPENING = 'opening', 'opening balance'
+        PURCHASE = 'purchase', 'coins purchase'
+        AD_REWARD = 'ad_reward', 'advertisement reward'
+        REWARD = 'reward', 'reward'
+        FEATURED_SONG = 'featured_song', 'featured song'
+        FEATURED_PLAYLIST = 'featured_playlist', 'featured playlist'
+        TWEET = 'tweet', 'tweet'
+        REFUND = 'refund', 'refund'
+
+    reference = models.UUIDField(unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             related_name='coin_transactions',
+                             on_delete=models.CASCADE)
+    amount = models.IntegerField()
+    # balance right after this transaction
+    balance = models.IntegerField()
+    reason = models.CharField(max_length=30, choices=Reason.choices)
+    created = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [models.Index(fields=['user', '-created'], name='coin_txn_user_created_idx')]
+
+    def __str__(self):
+        return f'{self.user_id} {self.amount:+d} ({self.reason})'
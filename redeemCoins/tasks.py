@@ -4,6 +4,7 @@ from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
 
 from accounts.models import User
+from .ledger import flush_pending_coins
 
 
 app = Celery('marketplace', broker='redis://localhost:6379/0')
@@ -30,3 +31,9 @@ def send_email_after_buying_coins(data):
     )
     email.attach_alternative(html_content, 'text/html')
     email.send(fail_silently=True)
+
+
+# write-behind for the coin ledger, scheduled in CELERY_BEAT_SCHEDULE
+@shared_task
+def flush_coin_ledger():
+    return flush_pending_coins()
@@ -1,3 +1,77 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import User
+from common.utils import redis_lock
+
+from . import ledger
+from .models import CoinTransaction
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='coins@example.com', username='coins', password='secret')
+        self.coins_key = ledger.COINS_KEY.format(self.user.id)
+        ledger.redis_cache.delete(self.coins_key, ledger.PENDING_COINS_KEY, ledger.FLUSHING_COINS_KEY)
+
+    def amounts(self):
+        return sorted(CoinTransaction.objects.filter(user=self.user).values_list('amount', flat=True))
+
+    def test_spend_is_refused_below_zero(self):
+        ledger.credit(self.user.id, 50, CoinTransaction.Reason.REWARD)
+        self.assertIsNone(ledger.spend(self.user.id, 80, CoinTransaction.Reason.TWEET))
+        self.assertEqual(ledger.spend(self.user.id, 30, CoinTransaction.Reason.TWEET), 20)
+
+    def test_retried_flush_writes_each_entry_once(self):
+        ledger.credit(self.user.id, 50, CoinTransaction.Reason.REWARD)
+        # a flush that died after its commit leaves the batch behind
+        ledger.redis_cache.rename(ledger.PENDING_COINS_KEY, ledger.FLUSHING_COINS_KEY)
+        CoinTransaction.objects.bulk_create([CoinTransaction(**json.loads(entry)) for entry in
+                                             ledger.redis_cache.lrange(ledger.FLUSHING_COINS_KEY, 0, -1)])
+        ledger.credit(self.user.id, 5, CoinTransaction.Reason.REWARD)
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.flush_pending_coins()
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.flush_pending_coins()
+        self.assertEqual(self.amounts(), [5, 50])
+
+    def test_overlapping_flush_does_nothing(self):
+        ledger.credit(self.user.id, 50, CoinTransaction.Reason.REWARD)
+        with redis_lock('coins:flush', 60):
+            self.assertEqual(ledger.flush_pending_coins(), 0)
+        self.assertEqual(self.amounts(), [])
+
+    def test_entries_of_deleted_users_are_dropped(self):
+        ghost = User.objects.create_user(email='ghost@example.com', username='ghost', password='secret')
+        ledger.credit(ghost.id, 10, CoinTransaction.Reason.REWARD)
+        ledger.credit(self.user.id, 20, CoinTransaction.Reason.REWARD)
+        ghost.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ledger.flush_pending_coins(), 1)
+        self.assertEqual(self.amounts(), [20])
+        self.assertFalse(ledger.redis_cache.exists(ledger.FLUSHING_COINS_KEY))
+
+    def test_lost_balance_is_reloaded_with_queued_entries(self):
+        ledger.credit(self.user.id, 50, CoinTransaction.Reason.REWARD)
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.flush_pending_coins()
+        ledger.spend(self.user.id, 20, CoinTransaction.Reason.TWEET)
+        ledger.redis_cache.delete(self.coins_key)
+        self.assertEqual(ledger.balance(self.user.id), 30)
+
+    def test_import_opens_with_the_balance_that_predates_the_ledger(self):
+        ledger.redis_cache.hset(self.coins_key, self.user.id, 100)
+        ledger.spend(self.user.id, 30, CoinTransaction.Reason.TWEET)
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.flush_pending_coins()
+        ledger.spend(self.user.id, 10, CoinTransaction.Reason.TWEET)
+        call_command('import_redis_coins', stdout=StringIO())
+        call_command('import_redis_coins', stdout=StringIO())
+        self.assertEqual(self.amounts(), [-30, 100])
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.flush_pending_coins()
+        ledger.redis_cache.delete(self.coins_key)
+        self.assertEqual(ledger.balance(self.user.id), 60)
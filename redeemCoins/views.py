@@ -1,7 +1,6 @@
 # Create your views here.
 import os
 
-import redis
 import stripe
 from django.conf import settings
 from django.shortcuts import get_object_or_404
@@ -9,17 +8,14 @@ from rest_framework import views, status
 from rest_framework.permissions import IsAuthenticated
 
 from accounts.models import User
-from beats.models import Songs, PlayList
+from beats.models import Songs, PlayList, published
 from beats.permissions import IsSongUserOrReadOnly, IsPlaylistUserOrReadOnly
 from feeds.utils import create_action
+from . import ledger
+from .models import CoinTransaction
 from .serializers import RedeemCoinsSerializer
 from redeemCoins.tasks import send_email_after_buying_coins
 
-# connect to redis
-redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
-                                port=settings.REDIS_PORT,
-                                db=settings.REDIS_DB)
-
 
 # class RedeemCoinsFeaturedAPIView(ListAPIView):
 #     pagination_class = StandardResultsSetPagination
@@ -39,7 +35,7 @@ redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
 class RedeemCoinsForFeaturedSong(views.APIView):
     permission_classes = [IsSongUserOrReadOnly]
     serializer_class = RedeemCoinsSerializer
-    queryset = Songs.objects.all()
+    queryset = published(Songs.objects.all())
     schema = None
 
     def post(self, request, *args, track_id, **kwargs):
@@ -48,18 +44,17 @@ class RedeemCoinsForFeaturedSong(views.APIView):
             coins = int(request.POST.get('coins'))
             song_object = get_object_or_404(self.queryset, id=track_id, user=request.user.id)
 
-            current_coins = redis_cache.hget('users:{}:coins'.format(request.user.id), request.user.id)
             # if user coins is 100, he can feature his track on featured tab view
-            if int(current_coins) >= coins:
+            current_coins = ledger.spend(request.user.id, coins, CoinTransaction.Reason.FEATURED_SONG)
+            if current_coins is not None:
                 create_action(request.user, 'featured songs', song_object, 4)
-                redis_cache.hincrby('users:{}:coins'.format(request.user.id), request.user.id, -coins)
                 return views.Response({'status': True, "message": "song is added on featured"},
                                       status=status.HTTP_200_OK)
             else:
                 return views.Response(
                     {'status': False, "message": "your coins are insufficient for this.", 'result': {}},
                     status=status.HTTP_200_OK)
-        except TypeError:
+        except (TypeError, ValueError):
             return views.Response({'status': False, "message": "something wrong or may be you don't have any coin",
                                    'result': {}}, status=status.HTTP_200_OK)
 
@@ -75,15 +70,13 @@ class RedeemCoinsForFeaturedPlaylist(views.APIView):
         try:
             coins = int(request.POST.get('coins'))
             playlist_object = get_object_or_404(self.queryset, slug=slug, owner=request.user.id)
-            current_coins = redis_cache.hget('users:{}:coins'.format(request.user.id), request.user.id)
             # if user coins is 100, he can featured his track on featured tab view
-            if int(current_coins) >= coins:
+            current_coins = ledger.spend(request.user.id, coins, CoinTransaction.Reason.FEATURED_PLAYLIST)
+            if current_coins is not None:
                 create_action(request.user, 'featured playlist', playlist_object, 5)
-                current_coins = redis_cache.hincrby('users:{}:coins'.format(request.user.id), request.user.id, -coins)
-
-                user = get_object_or_404(User, email=request.user.email)
 
-                data = {'username': user.username, 'email': user.email, 'current_coins': int(current_coins)}
+                data = {'username': request.user.username, 'email': request.user.email,
+                        'current_coins': current_coins}
 
                 send_email_after_buying_coins.delay(data)
 
@@ -93,7 +86,7 @@ class RedeemCoinsForFeaturedPlaylist(views.APIView):
                 return views.Response(
                     {'status': False, "message": "your coins are insufficient for this.", 'result': {}},
                     status=status.HTTP_200_OK)
-        except TypeError:
+        except (TypeError, ValueError):
             return views.Response({'status': False, "message": "something wrong or may be you don't have any coin.",
                                    'result': {}}, status=status.HTTP_200_OK)
 
@@ -1,7 +1,6 @@
 import os
 
 import djstripe
-import redis
 import stripe
 from django.conf import settings
 from django.http import HttpResponse
@@ -14,18 +13,16 @@ from rest_framework import views, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from accounts.models import User
+from accounts.models import User, forget_principals
 from accounts.serializers import GetFullUserSerializer
 from subscriptions.models import UserSubscription, UserMembership, Membership
 from subscriptions.serializers import UserSubscriptionSerializer
 from subscriptions.tasks import send_email_after_subscription
+from redeemCoins import ledger
+from redeemCoins.models import CoinTransaction
 from redeemCoins.tasks import send_email_after_buying_coins
 
 stripe.api_version = '2020-08-27'
-# connect to redis
-redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
-                                port=settings.REDIS_PORT,
-                                db=settings.REDIS_DB)
 
 
 # getting details of the user subscription plan
@@ -241,9 +238,13 @@ def webhook_received(request):
 
         djstripe_customer = djstripe.models.Customer.sync_from_stripe_data(stripe_customer)
 
-        user_membership = UserMembership.objects.filter(customer__id=data_object.customer).update(
+        memberships = UserMembership.objects.filter(customer__id=data_object.customer)
+        user_ids = list(memberships.values_list('user_id', flat=True))
+        user_membership = memberships.update(
             membership=free_membership, volume_remaining=free_membership.storage_size,
             customer=djstripe_customer, subscription_badge=False)
+        # update() skips the post_save receivers, drop the cached badge claims by hand
+        forget_principals(user_ids)
         print(user_membership)
 
         stripe_subscription = stripe.Subscription.modify(
@@ -265,19 +266,19 @@ def webhook_received(request):
 
         if data_object.metadata.product_id == os.getenv('COIN_PRODUCT_100'):
             user = get_object_or_404(User, email=data_object.customer_email)
-            coin_amount = redis_cache.hincrby('users:{}:coins'.format(user.id), user.id, 100)
+            coin_amount = ledger.credit(user.id, 100, CoinTransaction.Reason.PURCHASE)
             data = {'username': user.username, 'current_coin': coin_amount, 'email': user.email}
             send_email_after_buying_coins.delay(data)
 
         if data_object.metadata.product_id == os.getenv('COIN_PRODUCT_250'):
             user = get_object_or_404(User, email=data_object.customer_email)
-            coin_amount = redis_cache.hincrby('users:{}:coins'.format(user.id), user.id, 250)
+            coin_amount = ledger.credit(user.id, 250, CoinTransaction.Reason.PURCHASE)
             data = {'username': user.username, 'current_coin': coin_amount, 'email': user.email}
             send_email_after_buying_coins.delay(data)
 
         if data_object.metadata.product_id == os.getenv('COIN_PRODUCT_500'):
             user = get_object_or_404(User, email=data_object.customer_email)
-            coin_amount = redis_cache.hincrby('users:{}:coins'.format(user.id), user.id, 500)
+            coin_amount = ledger.credit(user.id, 500, CoinTransaction.Reason.PURCHASE)
             data = {'username': user.username, 'current_coin': coin_amount, 'email': user.email}
             send_email_after_buying_coins.delay(data)
 
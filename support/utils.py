@@ -1,5 +1,6 @@
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives, send_mail
+
+from accounts.outbox import queue_email
 
 
 class Util:
@@ -10,9 +11,6 @@ class Util:
             subject, from_email, to = 'Support Help', sender, settings.DEFAULT_FROM_EMAIL
             text_content = data['support_message']
             html_content = 'I am + :{} \n \n, {} \n \n, User Email {} '.format(data['name'], data['support_message'], data['email'])
-            msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
-
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
+            queue_email(subject, [to], body=text_content, html=html_content, from_email=from_email)
         except Exception as e:
             print(e)
@@ -1,20 +1,15 @@
 # Create your views here.
-import redis
-from django.conf import settings
 from django.shortcuts import get_object_or_404
 from rest_framework import views, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from feeds.utils import create_action
+from redeemCoins import ledger
+from redeemCoins.models import CoinTransaction
 from .models import Tweets
 from .serializers import TweetsSerializer
 
-# connect to redis
-redis_cache = redis.StrictRedis(host=settings.REDIS_HOST,
-                                port=settings.REDIS_PORT,
-                                db=settings.REDIS_DB)
-
 
 class TweetsCreateApiView(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -22,17 +17,10 @@ class TweetsCreateApiView(views.APIView):
     def post(self, request, *args, **kwargs):
         error_result = {}
         serializer = TweetsSerializer(data=request.data, context={'request': request})
-        current_coins = redis_cache.hget('users:{}:coins'.format(request.user.id), request.user.id)
-        print(current_coins)
 
         if serializer.is_valid():
-            if current_coins is None:
-                content = {'status': False,
-                           'message': "you don't have sufficient coins to post a tweet, you must have 50 coins to "
-                                      "post a tweet.",
-                           'result': error_result}
-                return Response(content, status=status.HTTP_200_OK)
-            if int(current_coins) < 50:
+            # the 50 coins are taken together with the balance check, so parallel posts cannot overspend
+            if ledger.spend(request.user.id, 50, CoinTransaction.Reason.TWEET) is None:
 
                 content = {'status': False,
                            'message': "you don't have sufficient coins to post a tweet, you must have 50 coins to "
@@ -41,10 +29,13 @@ class TweetsCreateApiView(views.APIView):
                 return Response(content, status=status.HTTP_200_OK)
 
             else:
-                new_tweets = serializer.save(added_by=self.request.user)
-                new_tweets.save()
+                try:
+                    new_tweets = serializer.save(added_by=self.request.user)
+                    new_tweets.save()
+                except Exception:
+                    ledger.credit(request.user.id, 50, CoinTransaction.Reason.REFUND)
+                    raise
                 output = "your tweet was sent"
-                redis_cache.hincrby('users:{}:coins'.format(request.user.id), request.user.id, -50)
                 create_action(request.user, 'tweeted', new_tweets, 7)
                 content = {'status': True, 'message': output, 'result': serializer.data,
                            }
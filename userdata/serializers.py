@@ -3,6 +3,7 @@
 from rest_framework import serializers
 
 from accounts.serializers import ChildFullUserSerializer
+from beats.likes import LikedSongsListSerializer
 from beats.serializers import ChildSongSerializer
 from .models import ListenedSong, SearchedSong
 
@@ -12,6 +13,11 @@ class RecentlyListenedSongSerializer(serializers.ModelSerializer):
     class Meta:
         model = ListenedSong
         fields = '__all__'
+        list_serializer_class = LikedSongsListSerializer
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return [obj.song_id]
 
 class SearchedSongSerializer(serializers.ModelSerializer):
     user =  ChildFullUserSerializer(read_only=True)
@@ -19,3 +25,8 @@ class SearchedSongSerializer(serializers.ModelSerializer):
     class Meta:
         model = SearchedSong
         fields = '__all__'
+        list_serializer_class = LikedSongsListSerializer
+
+    @staticmethod
+    def liked_song_ids(obj):
+        return [obj.song_id]
@@ -1,3 +1,37 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from accounts.models import Contact, User, redis_cache
+from subscriptions.models import UserMembership
+
+
+def make_user(username):
+    user = User.objects.create_user(email='{}@example.com'.format(username), username=username, password='secret')
+    UserMembership.objects.update_or_create(user=user)
+    # the slug is allocated on the first save that has a pk
+    user.save()
+    return user
+
+
+class WhoToFollowTests(TestCase):
+    def setUp(self):
+        keys = redis_cache.keys('random:users*')
+        if keys:
+            redis_cache.delete(*keys)
+        self.reader = make_user('reader')
+        self.friend = make_user('friend')
+        self.stranger = make_user('stranger')
+        self.client.force_login(self.reader)
+
+    def suggestions(self):
+        response = self.client.get(reverse('who-to-follow', args=[self.reader.username_slug]))
+        return {row['id'] for row in response.data['result']}
+
+    def test_followed_users_and_the_reader_are_not_suggested(self):
+        Contact.objects.create(user_from=self.reader, user_to=self.friend)
+        Contact.objects.create(user_from=self.friend, user_to=self.reader)
+        Contact.objects.create(user_from=self.friend, user_to=self.stranger)
+        self.assertEqual(self.suggestions(), {self.stranger.id})
+
+    def test_users_following_nobody_get_random_suggestions(self):
+        self.assertTrue(self.suggestions() <= {self.friend.id, self.stranger.id})
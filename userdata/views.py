@@ -1,5 +1,7 @@
 # Create your views here.
+import random
 
+from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from rest_framework import views, status
@@ -7,9 +9,9 @@ from rest_framework.generics import ListAPIView, DestroyAPIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
-from accounts.models import Profile, User, Contact
+from accounts.models import Profile, User, Contact, user_sampler, with_listing_data
 from accounts.serializers import ProfileSerializer, ChildFullUserSerializer
-from beats.models import Songs, PlayList
+from beats.models import Songs, PlayList, published, visible_songs
 from beats.permissions import IsPlaylistUserOrReadOnly, IsPlaylistObjectPermissionUserOrReadOnly
 from beats.serializers import ChildSongSerializer, UserPlayListSerializer
 from beats.views import StandardResultsSetPagination
@@ -45,7 +47,7 @@ class UserProfileBeatsView(views.APIView):
     def get(self, request, *args, **kwargs):
         username_slug = kwargs.get('username_slug')
         try:
-            tracks = self.queryset.filter(user__username_slug__iexact=username_slug)
+            tracks = visible_songs(request.user, self.queryset).filter(user__username_slug__iexact=username_slug)
             page = self.pagination_class()
             resp_obj = page.generate_response(tracks, ChildSongSerializer, request)
             return resp_obj
@@ -61,7 +63,8 @@ class UserProfilePlaylistView(views.APIView):
     def get(self, request, *args, **kwargs):
         username_slug = kwargs.get('username_slug')
         try:
-            playlist = self.queryset.filter(owner__username_slug__iexact=username_slug, is_private=False)
+            playlist = self.queryset.filter(owner__username_slug__iexact=username_slug,
+                                            is_private=False).prefetch_related('beats')
             page = self.pagination_class()
             resp_obj = page.generate_response(playlist, self.serializer_class, request)
             return resp_obj
@@ -78,7 +81,7 @@ class CurrentUserBeats(ListAPIView):
     serializer_class = ChildSongSerializer
 
     def get_queryset(self, *args, **kwargs):
-        return Songs.objects.filter(user=self.request.user)
+        return Songs.objects.filter(user_id=self.request.user.id)
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -94,7 +97,7 @@ class UserlikeDetail(ListAPIView):
     serializer_class = ChildSongSerializer
 
     def get_queryset(self, *args, **kwargs):
-        return Songs.objects.filter(users_like=self.request.user)
+        return published(Songs.objects.filter(users_like=self.request.user.id))
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -110,7 +113,7 @@ class PlaylistView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        queryset = PlayList.objects.filter(owner=request.user)
+        queryset = PlayList.objects.filter(owner_id=request.user.id).prefetch_related('beats')
         page = self.pagination_class()
         resp_obj = page.generate_response(queryset, UserPlayListSerializer, request)
         return resp_obj
@@ -124,7 +127,7 @@ class PlaylistDetailView(views.APIView):
 
     def get(self, request, slug, *args, **kwargs):
         username_slug = kwargs.get('username_slug')
-        playlist = self.queryset.filter(slug=slug, owner__username_slug=username_slug)
+        playlist = self.queryset.filter(slug=slug, owner__username_slug=username_slug).prefetch_related('beats')
         resp_obj = dict(
             playlist=self.serializer_class(playlist, context={"request": request}, many=True).data,
 
@@ -199,8 +202,10 @@ class FollowUserView(views.APIView):
         # if request.user.following(to_follow):
         if Contact.objects.filter(user_from=request.user, user_to=to_follow).exists():
             try:
-                Contact.objects.filter(user_from=request.user,
-                                       user_to=to_follow).delete()
+                # the follower/following counters are bumped by the Contact signals in the same transaction
+                with transaction.atomic():
+                    Contact.objects.filter(user_from=request.user,
+                                           user_to=to_follow).delete()
                 response['status'] = True
                 response['message'] = "unfollowed"
                 response['user'] = ChildFullUserSerializer(request.user, context={'request': request}).data
@@ -208,9 +213,10 @@ class FollowUserView(views.APIView):
                 response['status'] = False
                 response['error'] = 'Something went wrong'
         else:
-            obj_id = Contact.objects.get_or_create(
-                user_from=request.user,
-                user_to=to_follow)
+            with transaction.atomic():
+                obj_id = Contact.objects.get_or_create(
+                    user_from=request.user,
+                    user_to=to_follow)
             notify.send(request.user, recipient=to_follow, verb='follows', target=to_follow)
             # notify.send(request.user, recipient=to_follow, verb='follows')
             # notification.add_follow(request.user.id, to_follow.id, obj_id, datetime.utcnow())
@@ -228,15 +234,12 @@ class ListFollowingView(views.APIView):
 
     def get(self, request, *args, **kwargs):
         username_slug = kwargs.get('username_slug')
-        user = get_object_or_404(User, username_slug=username_slug)
-        following_list = []
-        following = user.following.all()
-
-        for f in following:
-            following_list.append(f)
+        user = get_object_or_404(User.objects.only('id'), username_slug=username_slug)
+        following = with_listing_data(User.objects.filter(rel_to_set__user_from=user)) \
+            .order_by('-rel_to_set__created', '-id')
 
         page = self.pagination_class()
-        resp_obj = page.generate_response(following_list, ChildFullUserSerializer, request)
+        resp_obj = page.generate_response(following, ChildFullUserSerializer, request)
         return resp_obj
 
 
@@ -248,17 +251,12 @@ class ListFollowersView(views.APIView):
     def get(self, request, *args, **kwargs):
         username_slug = kwargs.get('username_slug')
 
-        user = get_object_or_404(User, username_slug=username_slug)
-
-        followers_list = []
-        followers = user.followers.all()
-
-        for f in followers:
-            followers_list.append(f)
+        user = get_object_or_404(User.objects.only('id'), username_slug=username_slug)
+        followers = with_listing_data(User.objects.filter(rel_from_set__user_to=user)) \
+            .order_by('-rel_from_set__created', '-id')
 
         page = self.pagination_class()
-        resp_obj = page.generate_response(followers_list, ChildFullUserSerializer, request)
-        # profile_detail = self.serializer_class(resp_obj, context={'request': request}).data
+        resp_obj = page.generate_response(followers, ChildFullUserSerializer, request)
         return resp_obj
 
 
@@ -277,34 +275,37 @@ class WhoToFollowList(views.APIView):
                             status=status.HTTP_200_OK)
 
         following_list = []
-        mutual_following_list = []
-        # fetch current user following by using order by
-        current_user_following_ids = current_user.following.values_list('id', flat=True).order_by('?')[:10]
-        all_users = self.queryset.values_list('id', flat=True).exclude(id__in=current_user_following_ids).order_by('?')[
-                    :10]
+        # sample in python / redis instead of ORDER BY random() over the users table; only a
+        # random window of 10 followings is read, not everyone the user follows
+        following = Contact.objects.filter(user_from_id=current_user.id).order_by('id')
+        following_count = Profile.objects.filter(user_id=current_user.id) \
+            .values_list('following_count', flat=True).first() or 0
+        offset = random.randint(0, max(following_count - 10, 0))
+        current_user_following_ids = list(following.values_list('user_to_id', flat=True)[offset:offset + 10])
 
         if not current_user_following_ids:
-            mutual_following_list.append(
-                self.queryset.values_list('id', flat=True).exclude(username=current_user).order_by('?')[:3])
-            recommended_list = User.objects.filter(id__in=mutual_following_list)
+            recommended_set = set(user_sampler.sample(3 + 1))
         else:
-            for other_ids in current_user_following_ids:
-                user = self.queryset.get(id=other_ids)
-                mutual_following_list.append(user.following.values_list('id', flat=True).exclude(username=current_user))
+            # who the sampled followings follow, in one query
+            recommended_set = set(Contact.objects.filter(user_from_id__in=current_user_following_ids)
+                                  .values_list('user_to_id', flat=True)[:500])
 
-            if len(mutual_following_list) <= 2:
-                mutual_following_list.append(self.queryset.values_list('id', flat=True).exclude(
-                    Q(id__in=current_user_following_ids) and Q(username=current_user)).order_by('?')[:3])
+            if len(current_user_following_ids) <= 2:
+                recommended_set.update(user_sampler.sample(3 + len(current_user_following_ids) + 1))
 
-            # set comprehension to remove the duplicates lists
-            recommended_set = {item for sublist in mutual_following_list for item in sublist if
-                               item not in current_user_following_ids}
+        recommended_set.discard(current_user.id)
+        # only a handful of candidates are checked against who the user already follows
+        candidates = random.sample(list(recommended_set), min(30, len(recommended_set)))
+        candidates = set(candidates) - set(following.filter(user_to_id__in=candidates)
+                                           .values_list('user_to_id', flat=True))
 
-            recommended_list = self.queryset.filter(id__in=recommended_set).order_by('?')[:3]
-        # random_ids = random.sample(recommended_list, 3)
+        recommended_ids = random.sample(list(candidates), min(3, len(candidates)))
+        recommended_users = self.queryset.in_bulk(recommended_ids)
 
-        for f in recommended_list:
-            following_list.append(self.serializer_class(f, context={'request': request}).data)
+        for user_id in recommended_ids:
+            if user_id in recommended_users:
+                following_list.append(self.serializer_class(recommended_users[user_id],
+                                                            context={'request': request}).data)
 
         return views.Response({"status": True, "message": "Success", "result": following_list})
 
@@ -341,7 +342,7 @@ class RecentlyPlayedSongsAPIView(views.APIView):
 
         song_slug = request.data.get('song_slug')
         try:
-            song = Songs.objects.get(slug=song_slug)
+            song = published(Songs.objects.all()).get(slug=song_slug)
 
             # Check if the recent song already exists for the user
             if self.model.objects.filter(user=user, song=song).exists():
@@ -374,7 +375,7 @@ class RecentlySearchedSongsAPIView(views.APIView):
 
         song_slug = request.data.get('song_slug')
         try:
-            song = Songs.objects.get(slug=song_slug)
+            song = published(Songs.objects.all()).get(slug=song_slug)
 
             # Check if the searched song already exists for the user
             if SearchedSong.objects.filter(user=user, song=song).exists():